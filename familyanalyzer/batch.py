@@ -0,0 +1,186 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Batch mode: analyses many levels (and pairs of levels) on a single
+#  parsed and annotated orthoxml file. Independent jobs are computed in
+#  forked worker processes, which share the parsed document with the
+#  parent, and every job writes its report to its own file.
+#
+import io
+import multiprocessing
+import os
+import re
+
+
+class BatchError(Exception):
+    pass
+
+
+class BatchJob(object):
+    """analysis of `level', optionally compared with the younger
+    `second_level'. `species' restricts the reported genes (None: all
+    species)."""
+
+    def __init__(self, level, second_level=None, species=None):
+        self.level = level
+        self.second_level = second_level
+        self.species = list(species) if species else None
+
+    @classmethod
+    def from_spec(cls, spec, species=None):
+        """parses 'LEVEL' or 'LEVEL:SECOND_LEVEL'."""
+        level, _, second = spec.partition(':')
+        if not level:
+            raise BatchError('invalid job: {}'.format(spec))
+        return cls(level, second or None, species)
+
+    @property
+    def name(self):
+        name = self.level
+        if self.second_level is not None:
+            name += '_vs_' + self.second_level
+        return re.sub(r'[^\w.-]+', '_', name)
+
+    def __repr__(self):
+        return 'BatchJob({!r}, {!r}, {!r})'.format(self.level,
+                                                   self.second_level,
+                                                   self.species)
+
+
+def read_job_file(fd, species=None):
+    """reads jobs from a text stream. Each line has the form
+
+        LEVEL[<TAB>SECOND_LEVEL[<TAB>SPECIES,SPECIES,...]]
+
+    empty fields, empty lines and lines starting with '#' are allowed.
+    Jobs without species list use `species'."""
+    jobs = []
+    for line in fd:
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.split('\t')] + ['', '']
+        job_species = [s for s in fields[2].split(',') if s] or species
+        jobs.append(BatchJob(fields[0], fields[1] or None, job_species))
+    return jobs
+
+
+class BatchRunner(object):
+    """BatchRunner(parser, outdir, xreftag=None, processes=1)
+
+    Runs BatchJobs on an annotated OrthoXMLParser and writes the report
+    of every job to '<outdir>/<job.name>.txt'. The report has the same
+    format as the output of a single-level familyanalyzer run.
+
+    With processes > 1 the jobs are distributed over forked worker
+    processes. Platforms without fork run the jobs sequentially."""
+
+    def __init__(self, parser, outdir, xreftag=None, processes=1):
+        self.parser = parser
+        self.outdir = outdir
+        self.xreftag = xreftag
+        self.processes = processes
+        self._histories = dict()
+        self._filters = dict()
+
+    def check(self, jobs):
+        # augmentTaxonomyInfo may add levels missing in the document
+        tax = getattr(self.parser, 'tax', None)
+        levels = tax.hierarchy if tax is not None else self.parser.getLevels()
+        known = set(levels) | self.parser.getSpeciesSet()
+        for job in jobs:
+            for level in (job.level, job.second_level):
+                if level is not None and level not in known:
+                    raise BatchError('unknown taxonomic level: {}'
+                                     .format(level))
+        names = [job.name for job in jobs]
+        if len(set(names)) != len(names):
+            raise BatchError('jobs need distinct output names')
+
+    def history(self, level, species=None):
+        """FamHistory of `level' restricted to `species' (None: all
+        species), computed once per process."""
+        key = (level, frozenset(species) if species else None)
+        hist = self._histories.get(key)
+        if hist is None:
+            speciesFilter = self._filters.get(key[1])
+            if speciesFilter is None and key[1] is not None:
+                speciesFilter = self._filters[key[1]] = \
+                    self.parser.getSpeciesFilter(key[1])
+            hist = self.parser.getFamHistory(speciesFilter)
+            hist.analyzeLevel(level)
+            hist.setXRefTag(self.xreftag)
+            self._histories[key] = hist
+        return hist
+
+    def write_job(self, job, fd):
+        hist = self.history(job.level, job.species)
+        hist.write(fd)
+        fd.write('\n')
+        if job.second_level is not None:
+            hist2 = self.history(job.second_level, job.species)
+            hist2.write(fd)
+            hist.compare(hist2).write(fd)
+            fd.write('\n')
+
+    def run_job(self, job):
+        """writes the report of `job' and returns (job, filename, error)."""
+        fname = os.path.join(self.outdir, job.name + '.txt')
+        try:
+            with io.open(fname, 'w') as fd:
+                self.write_job(job, fd)
+        except Exception as e:
+            return job, fname, '{}: {}'.format(type(e).__name__, e)
+        return job, fname, None
+
+    def run(self, jobs, callback=None):
+        """runs all jobs and returns the list of (job, filename, error)
+        tuples in the order of `jobs'. `callback' is called with every
+        tuple as soon as the job is done."""
+        jobs = list(jobs)
+        self.check(jobs)
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+        # annotate the document once, before the workers are forked
+        self.parser.getFamHistory()
+
+        results = dict()
+        if (self.processes > 1 and len(jobs) > 1 and
+                'fork' in multiprocessing.get_all_start_methods()):
+            # the workers inherit runner and jobs, only indices are sent
+            global _BATCH
+            _BATCH = (self, jobs)
+            ctx = multiprocessing.get_context('fork')
+            pool = ctx.Pool(min(self.processes, len(jobs)))
+            try:
+                for i, fname, error in pool.imap_unordered(_run_indexed,
+                                                           range(len(jobs))):
+                    results[i] = (jobs[i], fname, error)
+                    if callback is not None:
+                        callback(results[i])
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                _BATCH = None
+        else:
+            for i, job in enumerate(jobs):
+                results[i] = self.run_job(job)
+                if callback is not None:
+                    callback(results[i])
+        return [results[i] for i in range(len(jobs))]
+
+
+_BATCH = None
+
+
+def _run_indexed(i):
+    runner, jobs = _BATCH
+    return (i,) + runner.run_job(jobs[i])[1:]
@@ -0,0 +1,118 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Benchmark suite: times the main analysis phases on synthetic
+#  datasets of increasing size and reports the results as json.
+#
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from .familyanalyzer import OrthoXMLParser, TaxonomyFactory
+from .genetree import GeneTreeTracer
+from .newick import NewickLexer, Streamer
+from .synthetic import SyntheticDataset
+
+# (nr_species, nr_families) of the predefined dataset sizes
+PRESETS = {'tiny': (8, 20),
+           'small': (16, 200),
+           'medium': (64, 1000),
+           'large': (256, 5000)}
+
+PHASES = ('parse', 'taxonomy', 'augmentTaxonomyInfo', 'get_histories',
+          'get_comparisons', 'GeneTreeTracer', 'newick_lexing')
+
+
+class PhaseTimer(object):
+    """collects the wall time of named phases (best of all repeats)."""
+
+    def __init__(self):
+        self.timings = dict()
+
+    def run(self, phase, func, *args, **kwargs):
+        start = time.perf_counter()
+        res = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.timings[phase] = min(elapsed, self.timings.get(phase, elapsed))
+        return res
+
+
+def _lex_all(text):
+    return sum(1 for _ in NewickLexer(Streamer(io.StringIO(text))))
+
+
+def run_pipeline(xml_fname, nwk_fname, timer):
+    """runs all benchmarked phases once on the given dataset."""
+    op = timer.run('parse', OrthoXMLParser, xml_fname)
+    tax = timer.run('taxonomy', TaxonomyFactory.newTaxonomy, nwk_fname)
+    timer.run('augmentTaxonomyInfo', op.augmentTaxonomyInfo, tax)
+    timer.run('get_histories', tax.get_histories, op)
+    timer.run('get_comparisons', tax.get_comparisons, op)
+    gtt = GeneTreeTracer(op, tax)
+    timer.run('GeneTreeTracer', gtt.trace_gene_families)
+    newick = '\n'.join(str(t) for t in gtt.trees)
+    with io.open(nwk_fname) as fh:
+        newick = fh.read() + newick
+    timer.run('newick_lexing', _lex_all, newick)
+    return {'nr_genes': len(op._gene2species),
+            'nr_families': len(op.getToplevelGroups()),
+            'nr_levels': len(tax.hierarchy),
+            'nr_gene_trees': len(gtt.trees)}
+
+
+def benchmark_dataset(dataset, repeat=1, workdir=None):
+    """times all phases on `dataset' (a SyntheticDataset). Each phase
+    is run `repeat' times and the fastest run is reported."""
+    cleanup = workdir is None
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='fa_bench_')
+    try:
+        xml_fname, nwk_fname = dataset.write(os.path.join(
+            workdir, 'synthetic_{}_{}'.format(dataset.nr_species,
+                                              dataset.nr_families)))
+        timer = PhaseTimer()
+        for _ in range(repeat):
+            counts = run_pipeline(xml_fname, nwk_fname, timer)
+        result = {'dataset': dataset.params(),
+                  'counts': counts,
+                  'xml_bytes': os.path.getsize(xml_fname),
+                  'timings': dict((p, timer.timings[p]) for p in PHASES)}
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir)
+    return result
+
+
+def run_benchmarks(sizes, seed=1, repeat=1, dup_rate=0.1, loss_rate=0.1,
+                   shape='balanced', workdir=None):
+    """runs the benchmark for a list of sizes. Each size is either the
+    name of a preset or a (nr_species, nr_families) tuple. Returns a
+    json-serialisable dict."""
+    results = []
+    for size in sizes:
+        nr_species, nr_families = PRESETS.get(size, size)
+        dataset = SyntheticDataset(nr_species, nr_families,
+                                   dup_rate=dup_rate, loss_rate=loss_rate,
+                                   shape=shape, seed=seed)
+        res = benchmark_dataset(dataset, repeat=repeat, workdir=workdir)
+        res['size'] = size if size in PRESETS else list(size)
+        results.append(res)
+    return {'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'results': results}
+
+
+def write_report(report, fd):
+    json.dump(report, fd, indent=2, sort_keys=True)
+    fd.write('\n')
@@ -0,0 +1,383 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Columnar binary export of FamHistory and LevelComparisonResult
+#  objects. Levels, families, species and genes are dictionary encoded,
+#  gene classes and events use the codes of the analysis classes, and
+#  all columns are int32 arrays. Rows are buffered and written in
+#  chunks, so the export can be filled while the analysis runs.
+#
+#  Two formats are supported: a numpy .npz (zip) file and, if pyarrow
+#  is installed, a directory of parquet files.
+#
+import io
+import os
+import zipfile
+from array import array
+
+from .familyanalyzer import BasicLevelAnalysis, LevelComparisonResult
+
+try:
+    import numpy
+    from numpy.lib import format as npformat
+except ImportError:
+    numpy = None
+
+FAMILY_COLUMNS = ('level', 'family', 'species', 'gene_class', 'gene')
+EVENT_COLUMNS = ('level1', 'level2', 'family', 'event', 'subfamily')
+DICTIONARIES = ('level', 'family', 'species', 'gene', 'gene_class', 'event')
+GENE_CLASSES = [BasicLevelAnalysis.GeneClasses.reverse[i] for i in
+                range(len(BasicLevelAnalysis.GeneClasses.reverse))]
+EVENTS = [LevelComparisonResult.groups_back[i] for i in
+          range(len(LevelComparisonResult.groups_back))]
+
+
+class ColumnarError(Exception):
+    pass
+
+
+def _require(module, name):
+    if module is None:
+        raise ColumnarError('{} is required for the columnar export'
+                            .format(name))
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ColumnarError('pyarrow is required for the parquet format')
+    return pyarrow
+
+
+def _format_of(path, fmt):
+    if fmt is None:
+        fmt = 'npz' if path.endswith('.npz') else 'parquet'
+    if fmt not in ('npz', 'parquet'):
+        raise ColumnarError('unknown format: {}'.format(fmt))
+    return fmt
+
+
+class Dictionary(object):
+    """maps strings to consecutive integer codes."""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = dict()
+        for value in values:
+            self.code(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+def _encode_strings(values):
+    """utf-8 data and offsets array of a list of strings."""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8), offsets
+
+
+def _decode_strings(data, offsets):
+    data = data.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+            for i in range(len(offsets) - 1)]
+
+
+class ColumnarWriter(object):
+    """ColumnarWriter(path, parser, xreftag=None, fmt=None,
+                      chunk_rows=1 << 20)
+
+    Writes histories and comparisons to `path': a '.npz' file, or
+    (fmt='parquet', the default for other names) a directory with the
+    parquet files families, events and dictionaries. Genes are reported
+    by the `xreftag' attribute (default: the XRefTag of the history or
+    the internal id). Rows are flushed every `chunk_rows' rows.
+
+    usage:
+        with ColumnarWriter('out.npz', parser) as out:
+            for level in levels:
+                hist = parser.getFamHistory()
+                hist.analyzeLevel(level)
+                out.add_history(hist)
+    """
+
+    def __init__(self, path, parser, xreftag=None, fmt=None,
+                 chunk_rows=1 << 20):
+        _require(numpy, 'numpy')
+        self.path = path
+        self.parser = parser
+        self.xreftag = xreftag
+        self.fmt = _format_of(path, fmt)
+        self.chunk_rows = chunk_rows
+        self.dicts = dict((name, Dictionary()) for name in DICTIONARIES)
+        self.dicts['gene_class'] = Dictionary(GENE_CLASSES)
+        self.dicts['event'] = Dictionary(EVENTS)
+        self._gene_codes = dict()
+        self._buffers = {'families': self._new_buffer(FAMILY_COLUMNS),
+                         'events': self._new_buffer(EVENT_COLUMNS)}
+        self._chunks = {'families': 0, 'events': 0}
+        if self.fmt == 'npz':
+            self._zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED,
+                                        allowZip64=True)
+        else:
+            self._pa = _pyarrow()
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            self._writers = dict()
+
+    @staticmethod
+    def _new_buffer(columns):
+        return dict((col, array('i')) for col in columns)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _gene_code(self, gene, tag):
+        codes = self._gene_codes.get(tag)
+        if codes is None:
+            codes = self._gene_codes[tag] = dict()
+        code = codes.get(gene)
+        if code is None:
+            xref = (self.parser.mapGeneToXRef(gene, tag) if tag is not None
+                    else gene)
+            code = codes[gene] = self.dicts['gene'].code(xref)
+        return code
+
+    def add_history(self, hist, speciesFilter=None):
+        """adds the rows of an analyzed FamHistory: one per gene, and
+        one with gene -1 per species without genes (i.e. lost). As in
+        FamHistory.write, `speciesFilter' restricts the species."""
+        buf = self._buffers['families']
+        level, family, species, gclass, gene = (buf[c] for c in
+                                                FAMILY_COLUMNS)
+        lcode = self.dicts['level'].code(hist.analyzedLevel)
+        fam_dict, spec_dict = self.dicts['family'], self.dicts['species']
+        class_codes = self.dicts['gene_class'].codes
+        tag = self.xreftag if self.xreftag is not None else hist.XRefTag
+        for fam in hist:
+            fcode = fam_dict.code(fam.getFamId())
+            for spec, elem in fam.summary.items():
+                if speciesFilter is not None and spec not in speciesFilter:
+                    continue
+                scode = spec_dict.code(spec)
+                ccode = class_codes[elem.typ]
+                genes = [self._gene_code(g, tag) for g in elem.genes] or [-1]
+                n = len(genes)
+                level.extend([lcode] * n)
+                family.extend([fcode] * n)
+                species.extend([scode] * n)
+                gclass.extend([ccode] * n)
+                gene.extend(genes)
+            if len(gene) >= self.chunk_rows:
+                self.flush('families')
+
+    def add_comparison(self, comp):
+        """adds the events of a LevelComparisonResult; duplications get
+        one row per subfamily."""
+        buf = self._buffers['events']
+        level1, level2, family, event, subfamily = (buf[c] for c in
+                                                    EVENT_COLUMNS)
+        l1 = self.dicts['level'].code(comp.lev1)
+        l2 = self.dicts['level'].code(comp.lev2)
+        fam_dict = self.dicts['family']
+        event_codes = self.dicts['event'].codes
+        for fam, ev, into in comp.iter_events():
+            fcode = fam_dict.code(fam)
+            subfams = ([fam_dict.code(f) for f in into]
+                       if ev == 'duplicated' else [-1])
+            n = len(subfams)
+            level1.extend([l1] * n)
+            level2.extend([l2] * n)
+            family.extend([fcode] * n)
+            event.extend([event_codes[ev]] * n)
+            subfamily.extend(subfams)
+            if len(subfamily) >= self.chunk_rows:
+                self.flush('events')
+
+    def flush(self, table=None):
+        """writes the buffered rows of `table' (default: all tables)."""
+        for name in ([table] if table is not None else list(self._buffers)):
+            buf = self._buffers[name]
+            columns = FAMILY_COLUMNS if name == 'families' else EVENT_COLUMNS
+            if not len(buf[columns[0]]):
+                continue
+            # copies, as the buffers are cleared in place for reuse
+            arrays = [(col, numpy.array(buf[col], dtype=numpy.int32))
+                      for col in columns]
+            if self.fmt == 'npz':
+                for col, arr in arrays:
+                    self._write_npy('{}/{:05d}/{}'.format(
+                        name, self._chunks[name], col), arr)
+            else:
+                self._write_parquet(name, arrays)
+            self._chunks[name] += 1
+            for col in columns:
+                del buf[col][:]
+
+    def _write_npy(self, name, arr):
+        out = io.BytesIO()
+        npformat.write_array(out, arr, allow_pickle=False)
+        self._zip.writestr(name + '.npy', out.getvalue())
+
+    def _write_parquet(self, name, arrays):
+        pa = self._pa
+        table = pa.Table.from_arrays([pa.array(arr) for _, arr in arrays],
+                                     names=[col for col, _ in arrays])
+        writer = self._writers.get(name)
+        if writer is None:
+            writer = self._writers[name] = pa.parquet.ParquetWriter(
+                os.path.join(self.path, name + '.parquet'), table.schema)
+        writer.write_table(table)
+
+    def close(self):
+        if self._buffers is None:
+            return
+        self.flush()
+        self._buffers = None
+        if self.fmt == 'npz':
+            for name in DICTIONARIES:
+                data, offsets = _encode_strings(self.dicts[name].values)
+                self._write_npy('dict/{}.data'.format(name), data)
+                self._write_npy('dict/{}.offsets'.format(name), offsets)
+            self._zip.close()
+        else:
+            pa = self._pa
+            for name in ('families', 'events'):
+                if name not in self._writers:
+                    columns = (FAMILY_COLUMNS if name == 'families'
+                               else EVENT_COLUMNS)
+                    self._write_parquet(name, [
+                        (col, numpy.zeros(0, dtype=numpy.int32))
+                        for col in columns])
+                self._writers[name].close()
+            names, codes, values = [], [], []
+            for name in DICTIONARIES:
+                vals = self.dicts[name].values
+                names.extend([name] * len(vals))
+                codes.extend(range(len(vals)))
+                values.extend(vals)
+            table = pa.Table.from_arrays(
+                [pa.array(names).dictionary_encode(),
+                 pa.array(codes, type=pa.int32()), pa.array(values)],
+                names=['dictionary', 'code', 'value'])
+            pa.parquet.write_table(table, os.path.join(self.path,
+                                                       'dictionaries.parquet'))
+
+
+class ColumnarReader(object):
+    """ColumnarReader(path, fmt=None)
+
+    Loads an export of ColumnarWriter. `families' and `events' are dicts
+    of int32 numpy arrays (see FAMILY_COLUMNS and EVENT_COLUMNS); codes
+    are resolved with dictionary() or decode()."""
+
+    def __init__(self, path, fmt=None):
+        _require(numpy, 'numpy')
+        self.path = path
+        self.fmt = _format_of(path, fmt)
+        if self.fmt == 'npz':
+            self._load_npz()
+        else:
+            self._load_parquet()
+
+    def _load_npz(self):
+        chunks = {'families': dict(), 'events': dict()}
+        raw = dict()
+        with zipfile.ZipFile(self.path) as zf:
+            for name in sorted(zf.namelist()):
+                arr = npformat.read_array(io.BytesIO(zf.read(name)),
+                                          allow_pickle=False)
+                table, _, rest = name[:-len('.npy')].partition('/')
+                if table == 'dict':
+                    raw[rest] = arr
+                else:
+                    _, _, col = rest.partition('/')
+                    chunks[table].setdefault(col, []).append(arr)
+        self.families = self._concat(chunks['families'], FAMILY_COLUMNS)
+        self.events = self._concat(chunks['events'], EVENT_COLUMNS)
+        self._raw = raw
+        self._dicts = dict()
+
+    @staticmethod
+    def _concat(chunks, columns):
+        return dict((col, numpy.concatenate(chunks[col]) if col in chunks
+                     else numpy.zeros(0, dtype=numpy.int32))
+                    for col in columns)
+
+    def _load_parquet(self):
+        pa = _pyarrow()
+        self.families, self.events = [
+            dict((col, table.column(col).to_numpy().astype(numpy.int32))
+                 for col in table.column_names)
+            for table in (pa.parquet.read_table(os.path.join(self.path, n))
+                          for n in ('families.parquet', 'events.parquet'))]
+        table = pa.parquet.read_table(os.path.join(self.path,
+                                                   'dictionaries.parquet'))
+        self._dicts = dict((name, []) for name in DICTIONARIES)
+        for name, code, value in zip(table.column('dictionary').to_pylist(),
+                                     table.column('code').to_pylist(),
+                                     table.column('value').to_pylist()):
+            self._dicts[name].append(value)
+
+    def dictionary(self, name):
+        """list of the strings of dictionary `name', indexed by code."""
+        values = self._dicts.get(name)
+        if values is None:
+            values = self._dicts[name] = _decode_strings(
+                self._raw['{}.data'.format(name)],
+                self._raw['{}.offsets'.format(name)])
+        return values
+
+    def decode(self, name, codes):
+        """strings of `codes' in dictionary `name' (None for -1)."""
+        values = self.dictionary(name)
+        return [values[c] if c >= 0 else None for c in codes.tolist()]
+
+    def iter_families(self):
+        """yields (level, family, species, gene_class, gene) tuples."""
+        columns = [self.decode(col, self.families[col])
+                   for col in FAMILY_COLUMNS]
+        return zip(*columns)
+
+    def iter_events(self):
+        """yields (level1, level2, family, event, subfamily) tuples."""
+        names = ('level', 'level', 'family', 'event', 'family')
+        columns = [self.decode(name, self.events[col])
+                   for name, col in zip(names, EVENT_COLUMNS)]
+        return zip(*columns)
+
+
+def export_taxonomy(parser, tax, path, xreftag=None, fmt=None):
+    """analyzes every level of `tax' and writes the histories and the
+    parent-child comparisons to `path'. Only the histories on the path
+    from the root to the current level are kept in memory."""
+    with ColumnarWriter(path, parser, xreftag, fmt) as out:
+        stack = [(tax.hierarchy[tax.root], None)]
+        while stack:
+            node, parent_hist = stack.pop()
+            hist = parser.getFamHistory()
+            hist.analyzeLevel(node.name)
+            out.add_history(hist)
+            if parent_hist is not None:
+                out.add_comparison(parent_hist.compare(hist))
+            stack.extend((child, hist) for child in reversed(node.down))
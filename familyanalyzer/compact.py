@@ -0,0 +1,579 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Compact representation of the HOGs of an orthoxml document. The
+#  orthologGroup, paralogGroup and geneRef elements of the groups
+#  section are stored in preorder as parallel integer arrays (node kind,
+#  parent, first child, next sibling, end of the subtree, gene and
+#  TaxRange levels); gene ids, species, levels, xrefs, LOFT ids and the
+#  ids of the singleton families are stored as utf-8 data with offsets.
+#  All arrays can be placed into a single multiprocessing.shared_memory
+#  block, so that worker processes attach to one copy of the dataset
+#  instead of parsing the document again.
+#
+#  CompactHOGs provides the part of the OrthoXMLParser interface used
+#  by the analysis, i.e. FamHistory, Comparer and GeneTreeTracer run on
+#  it directly.
+#
+import collections
+import io
+import multiprocessing
+
+from .familyanalyzer import (FamHistory, GeneFamily, GroupAnnotator,
+                             LevelAnalysisFactory, SpeciesFilter)
+from .geneindex import GeneIndexBuilder
+from .taxonomy import NewickTaxonomy
+from .traversal import walk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+ORTHOLOG, PARALOG, GENEREF = 0, 1, 2
+
+# per node arrays and their dtypes
+NODE_FIELDS = (('kind', 'i1'), ('parent', 'i4'), ('first_child', 'i4'),
+               ('next_sibling', 'i4'), ('end', 'i4'), ('gene', 'i4'),
+               ('level_ptr', 'i4'), ('level_ids', 'i4'),
+               ('loft_offsets', 'i8'), ('loft_data', 'u1'),
+               ('gene_species', 'i4'))
+STRING_TABLES = ('genes', 'species', 'levels')
+
+
+class CompactError(Exception):
+    pass
+
+
+def _require(module, name):
+    if module is None:
+        raise CompactError('{} is required for the compact HOGs'
+                           .format(name))
+
+
+def _encode_strings(values):
+    """utf-8 data and offsets array of a list of strings."""
+    encoded = [v.encode('utf-8') for v in values]
+    offsets = numpy.zeros(len(encoded) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return numpy.frombuffer(b''.join(encoded), dtype=numpy.uint8), offsets
+
+
+def _tracker_pid():
+    """pid of the resource tracker started by this process or inherited
+    by fork; None in spawned children, which only get the connection
+    to the tracker of their parent."""
+    return getattr(resource_tracker._resource_tracker, '_pid', None)
+
+
+def _open_segment(name, tracker=None):
+    """attaches to the existing shared memory block `name'. The block
+    belongs to the process which created it, whose resource tracker
+    has the pid `tracker'; it must not be registered with another
+    tracker, which would remove it when this process exits."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # before python 3.13 attaching always registers the block. In the
+    # creating process and its children the block is registered with
+    # the same tracker already, and unregistering it there would drop
+    # the registration of the creator.
+    own = resource_tracker._resource_tracker._fd is None or \
+        _tracker_pid() not in (None, tracker)
+    shm = shared_memory.SharedMemory(name)
+    if own:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class StringTable(object):
+    """StringTable(data, offsets)
+
+    read-only list of strings stored as utf-8 `data' with `offsets'.
+    Strings are decoded on access; index() builds the reverse mapping
+    on first use."""
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._pos = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes() \
+            .decode('utf-8')
+
+    def __iter__(self):
+        data = self.data.tobytes()
+        offsets = self.offsets.tolist()
+        return (data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                for i in range(len(offsets) - 1))
+
+    def index(self, value):
+        if self._pos is None:
+            self._pos = dict((v, i) for i, v in enumerate(self))
+        return self._pos[value]
+
+    def get(self, value, default=None):
+        try:
+            return self.index(value)
+        except KeyError:
+            return default
+
+
+class _Builder(object):
+    """collects the nodes of the toplevel groups in preorder."""
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.propertyTag = '{{{ns0}}}property'.format(**parser.ns)
+        self.geneRefTag = '{{{ns0}}}geneRef'.format(**parser.ns)
+        self.kind, self.parent, self.gene, self.end = [], [], [], []
+        self.level_ptr, self.level_ids = [0], []
+        self.lofts = []
+        self.levels, self.level_pos = [], dict()
+        self._open = []
+
+    def enter(self, node, parent):
+        parser = self.parser
+        idx = len(self.kind)
+        gene = -1
+        if parser.is_ortholog_group(node):
+            kind = ORTHOLOG
+            for child in node.iterchildren(self.propertyTag):
+                if child.get('name') == 'TaxRange':
+                    level = child.get('value')
+                    lid = self.level_pos.get(level)
+                    if lid is None:
+                        lid = self.level_pos[level] = len(self.levels)
+                        self.levels.append(level)
+                    self.level_ids.append(lid)
+        elif parser.is_paralog_group(node):
+            kind = PARALOG
+        else:
+            kind = GENEREF
+            gene = parser._genePos.get(node.get('id'))
+            if gene is None:
+                raise CompactError('unknown gene: {}'.format(node.get('id')))
+        self.kind.append(kind)
+        self.parent.append(parent)
+        self.gene.append(gene)
+        self.end.append(-1)
+        self.level_ptr.append(len(self.level_ids))
+        self.lofts.append(node.get('og', '') if kind == ORTHOLOG else '')
+        self._open.append(idx)
+        if kind == GENEREF:
+            return None
+        return ((child, idx) for child in node
+                if child.tag == self.geneRefTag or
+                parser.is_evolutionary_node(child))
+
+    def leave(self, node, parent, results):
+        idx = self._open.pop()
+        self.end[idx] = len(self.kind)
+
+    def arrays(self, xreftags):
+        parser = self.parser
+        n = len(self.kind)
+        parent = numpy.array(self.parent, dtype=numpy.int32)
+        first_child = numpy.full(n, -1, dtype=numpy.int32)
+        next_sibling = numpy.full(n, -1, dtype=numpy.int32)
+        # in preorder, the first child of a node directly follows it and
+        # the next sibling of a node follows its subtree
+        end = numpy.array(self.end, dtype=numpy.int32)
+        has_child = numpy.flatnonzero(end > numpy.arange(1, n + 1))
+        first_child[has_child] = has_child + 1
+        inner = numpy.flatnonzero(parent >= 0)
+        follow = end[inner]
+        last = follow >= end[parent[inner]]
+        next_sibling[inner[~last]] = follow[~last]
+
+        loft_data, loft_offsets = _encode_strings(self.lofts)
+        species = sorted(parser.getSpeciesSet())
+        species_pos = dict((s, i) for i, s in enumerate(species))
+        genes = parser._geneIds
+        arrays = {'kind': numpy.array(self.kind, dtype=numpy.int8),
+                  'parent': parent,
+                  'first_child': first_child,
+                  'next_sibling': next_sibling,
+                  'end': end,
+                  'gene': numpy.array(self.gene, dtype=numpy.int32),
+                  'level_ptr': numpy.array(self.level_ptr,
+                                           dtype=numpy.int32),
+                  'level_ids': numpy.array(self.level_ids,
+                                           dtype=numpy.int32),
+                  'loft_offsets': loft_offsets,
+                  'loft_data': loft_data,
+                  'gene_species': numpy.array(
+                      [species_pos[parser.mapGeneToSpecies(g)]
+                       for g in genes], dtype=numpy.int32)}
+        tables = [('genes', genes), ('species', species),
+                  ('levels', self.levels)]
+        if parser.singletons is not None:
+            tables.append(('singletons', sorted(parser.singletons)))
+        for tag in xreftags:
+            tables.append(('xref_' + tag,
+                           [parser._xrefs.get((g, tag), '') for g in genes]))
+        for name, values in tables:
+            arrays[name + '_data'], arrays[name + '_offsets'] = \
+                _encode_strings(values)
+        return arrays
+
+
+class CompactGeneFamily(GeneFamily):
+    """GeneFamily of an orthologGroup node of CompactHOGs. The node
+    index is used as `root'."""
+
+    def __init__(self, hogs, node):
+        if hogs.kind[node] != ORTHOLOG:
+            raise CompactError('node {} is not an orthologGroup'
+                               .format(node))
+        self.hogs = hogs
+        self.root = node
+        self.memberCache = None
+
+    def getMemberGenes(self, speciesFilter=None):
+        if speciesFilter is not None:
+            selected = getattr(self, '_selected_genes', None)
+            if selected is not None and selected[0] is speciesFilter:
+                return selected[1]
+            return speciesFilter.filterGenes(self.getMemberGenes())
+        if not hasattr(self, '_member_genes'):
+            genes = self.hogs.genes
+            self._member_genes = [genes[g] for g in
+                                  self.hogs.memberPositions(self.root)]
+        return self._member_genes
+
+    def getFamId(self):
+        return self.hogs.getFamId(self.root)
+
+    def getLevels(self):
+        return self.hogs.getNodeLevels(self.root)
+
+    def analyzeLevel(self, level):
+        return [CompactGeneFamily(self.hogs, node) for node in
+                self.hogs.getSubFamilies(level, self.root)]
+
+
+class CompactHOGs(object):
+    """CompactHOGs(arrays, tax=None)
+
+    The HOGs of an orthoxml document as numpy arrays, usually created
+    with from_parser(). Node i is an orthologGroup, paralogGroup or
+    geneRef (kind[i]); its subtree are the nodes i to end[i]-1, the
+    TaxRange levels of orthologGroups are level_ids[level_ptr[i]:
+    level_ptr[i+1]] and the genes of geneRefs gene[i] (indices into the
+    string table `genes'; -1 for groups). The string tables are kept in
+    arrays too: `name'_data and `name'_offsets.
+
+    share() copies the arrays into a shared memory block; other
+    processes attach() to it with the returned handle:
+
+        hogs = CompactHOGs.from_parser(parser).share()
+        pool = hogs.pool(8)
+        counts = pool.map(count_families, levels)
+
+    where the worker functions access the data with worker_hogs()."""
+
+    def __init__(self, arrays, tax=None):
+        _require(numpy, 'numpy')
+        self.arrays = arrays
+        self.tax = tax
+        self.memberCache = None
+        self._species2genes = None
+        self._shm = None
+        self._owner = False
+        self._tracker = None
+        self._setup_views()
+
+    def _setup_views(self):
+        arrays = self.arrays
+        for name, _ in NODE_FIELDS:
+            setattr(self, name, arrays[name])
+        for name in STRING_TABLES:
+            setattr(self, name, self._table(name))
+        self.singletons = (set(self._table('singletons'))
+                           if 'singletons_data' in arrays else None)
+        self.xrefs = dict((name[len('xref_'):-len('_data')],
+                           self._table(name[:-len('_data')]))
+                          for name in arrays if name.startswith('xref_') and
+                          name.endswith('_data'))
+
+    def _table(self, name):
+        return StringTable(self.arrays[name + '_data'],
+                           self.arrays[name + '_offsets'])
+
+    @classmethod
+    def from_parser(cls, parser, tax=None, xreftags=('protId', 'geneId')):
+        """builds the arrays from the document of `parser', which is
+        LOFT annotated first if needed. The taxonomy defaults to the one
+        of the parser. The gene xrefs of `xreftags' are kept for
+        mapGeneToXRef."""
+        _require(numpy, 'numpy')
+        if not parser.isLoftAnnotated():
+            GroupAnnotator(parser).annotateDoc()
+        builder = _Builder(parser)
+        for fam in parser.getToplevelGroups():
+            walk(fam, builder.enter, builder.leave, -1)
+        return cls(builder.arrays(xreftags),
+                   tax if tax is not None else parser.tax)
+
+    def __len__(self):
+        return len(self.kind)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # shared memory
+
+    def _layout(self):
+        """(name, dtype, offset, length) of every array; the offsets are
+        8-byte aligned."""
+        layout, offset = [], 0
+        for name in sorted(self.arrays):
+            arr = self.arrays[name]
+            layout.append((name, arr.dtype.str, offset, len(arr)))
+            offset += -(-arr.nbytes // 8) * 8
+        return layout, offset
+
+    @staticmethod
+    def _views(buf, layout):
+        return dict((name, numpy.ndarray(length, dtype=dtype, buffer=buf,
+                                         offset=offset))
+                    for name, dtype, offset, length in layout)
+
+    def share(self):
+        """returns a copy of self stored in a new shared memory block.
+        The block is removed when the returned object is closed."""
+        _require(shared_memory, 'multiprocessing.shared_memory')
+        layout, size = self._layout()
+        shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        arrays = self._views(shm.buf, layout)
+        for name, arr in arrays.items():
+            arr[:] = self.arrays[name]
+        shared = type(self)(arrays, self.tax)
+        shared._shm, shared._owner = shm, True
+        shared._shared_layout = layout
+        shared._tracker = _tracker_pid()
+        return shared
+
+    @property
+    def handle(self):
+        """picklable description of the shared memory block, passed to
+        attach() in other processes."""
+        if self._shm is None:
+            raise CompactError('the HOGs are not in shared memory')
+        return {'name': self._shm.name,
+                'layout': self._shared_layout,
+                'tracker': self._tracker,
+                'taxonomy': (self.tax.newick() if self.tax is not None
+                             else None)}
+
+    @classmethod
+    def attach(cls, handle):
+        """attaches to the shared memory block of `handle' without
+        copying the arrays."""
+        _require(shared_memory, 'multiprocessing.shared_memory')
+        _require(numpy, 'numpy')
+        shm = _open_segment(handle['name'], handle.get('tracker'))
+        tax = handle['taxonomy']
+        if tax is not None:
+            tax = NewickTaxonomy(io.StringIO(tax))
+        hogs = cls(cls._views(shm.buf, handle['layout']), tax)
+        hogs._shm = shm
+        hogs._shared_layout = handle['layout']
+        hogs._tracker = handle.get('tracker')
+        return hogs
+
+    def close(self):
+        """releases the shared memory block; the creating process also
+        removes it."""
+        if self._shm is None:
+            return
+        shm, self._shm = self._shm, None
+        # the views need to be gone before the buffer can be released
+        self.arrays = None
+        for name, _ in NODE_FIELDS:
+            setattr(self, name, None)
+        for name in STRING_TABLES:
+            setattr(self, name, None)
+        self.xrefs = None
+        shm.close()
+        if self._owner:
+            shm.unlink()
+
+    def pool(self, processes=None):
+        """a multiprocessing.Pool whose workers are attached to the
+        shared memory block of self (see worker_hogs())."""
+        return multiprocessing.Pool(processes, _init_worker, (self.handle,))
+
+    # OrthoXMLParser interface used by the analysis
+
+    def getSpeciesSet(self):
+        return frozenset(self.species)
+
+    def getLevels(self):
+        return frozenset(self.levels)
+
+    def mapGeneToSpecies(self, id_):
+        return self.species[self.gene_species[self.genes.index(id_)]]
+
+    def mapGeneToXRef(self, id_, typ='protId'):
+        if typ is None:
+            return id_
+        if typ not in self.xrefs:
+            raise CompactError('xref {} is not available'.format(typ))
+        return self.xrefs[typ][self.genes.index(id_)]
+
+    def getSpeciesFilter(self, species):
+        if species is None or isinstance(species, SpeciesFilter):
+            return species
+        if self._species2genes is None:
+            species2genes = collections.defaultdict(set)
+            for gene, spec in zip(self.genes, self.gene_species.tolist()):
+                species2genes[self.species[spec]].add(gene)
+            self._species2genes = species2genes
+        return SpeciesFilter(species, self._species2genes)
+
+    def getToplevelGroups(self):
+        """node indices of the toplevel orthologGroups."""
+        return numpy.flatnonzero(self.parent < 0).tolist()
+
+    def getSubFamilies(self, level, root=None):
+        """node indices of the orthologGroups with a TaxRange property
+        of `level', in document order. If `root' is given, only its
+        subtree is searched."""
+        lid = self.levels.get(level)
+        if lid is None:
+            return []
+        entries = numpy.flatnonzero(self.level_ids == lid)
+        nodes = numpy.searchsorted(self.level_ptr, entries, 'right') - 1
+        if root is not None:
+            nodes = nodes[(nodes >= root) & (nodes < self.end[root])]
+        return nodes.tolist()
+
+    def iterSubFamilies(self, level, root=None):
+        return iter(self.getSubFamilies(level, root))
+
+    def getNodeLevels(self, node):
+        levels = self.levels
+        return [levels[lid] for lid in
+                self.level_ids[self.level_ptr[node]:self.level_ptr[node + 1]]]
+
+    def getFamId(self, node):
+        return self.loft_data[self.loft_offsets[node]:
+                              self.loft_offsets[node + 1]].tobytes() \
+            .decode('utf-8')
+
+    def memberPositions(self, node):
+        """indices into `genes' of the geneRefs below `node'."""
+        genes = self.gene[node:self.end[node]]
+        return genes[genes >= 0]
+
+    def children(self, node):
+        child = self.first_child[node]
+        while child >= 0:
+            yield child
+            child = self.next_sibling[child]
+
+    def newGeneFamily(self, node):
+        return CompactGeneFamily(self, node)
+
+    def geneIndex(self):
+        """returns the GeneIndex with the family lineage of every gene,
+        as collected by the LOFT annotation of the document."""
+        builder = GeneIndexBuilder(self.genes)
+        kind, gene, genes = self.kind, self.gene, self.genes
+
+        def enter(node, ctx):
+            if kind[node] == GENEREF:
+                builder.add_gene(genes[gene[node]])
+                return None
+            if kind[node] == ORTHOLOG:
+                # GeneIndexBuilder expects the oldest level first
+                builder.enter(self.getFamId(node),
+                              self.getNodeLevels(node)[::-1])
+            return ((child, None) for child in self.children(node))
+
+        def leave(node, ctx, results):
+            if kind[node] == ORTHOLOG:
+                builder.leave()
+
+        for fam in self.getToplevelGroups():
+            walk(fam, enter, leave)
+        return builder.build()
+
+    def membersByGroup(self, speciesFilter, groups):
+        selected = numpy.zeros(len(self.genes), dtype=bool)
+        selected[[self.genes.index(g) for g in speciesFilter.genes
+                  if self.genes.get(g) is not None]] = True
+        genes = self.genes
+        members = dict()
+        for node in groups:
+            pos = self.memberPositions(node)
+            members[node] = [genes[g] for g in pos[selected[pos]]]
+        return members
+
+    def getFamHistory(self, speciesFilter=None):
+        speciesFilter = self.getSpeciesFilter(speciesFilter)
+        analyzer = LevelAnalysisFactory().newLevelAnalysis(self,
+                                                           speciesFilter)
+        return FamHistory(self, analyzer)
+
+
+_HOGS = None
+
+
+def _init_worker(handle):
+    global _HOGS
+    _HOGS = CompactHOGs.attach(handle)
+
+
+def worker_hogs():
+    """the CompactHOGs attached in a worker of CompactHOGs.pool()."""
+    if _HOGS is None:
+        raise CompactError('not running in a worker of CompactHOGs.pool()')
+    return _HOGS
+
+
+def _analyze_level(job):
+    level, species = job
+    hist = worker_hogs().getFamHistory(species)
+    hist.analyzeLevel(level)
+    return level, [(fam.getFamId(), spec, summary.typ, sorted(summary.genes))
+                   for fam in hist for spec, summary in fam.summary.items()]
+
+
+def analyze_levels(hogs, levels, species=None, processes=None):
+    """analyzes the shared CompactHOGs `hogs' at all `levels' in a pool
+    of worker processes. Returns a dict level -> list of (family,
+    species, gene class, genes) tuples, in the order of FamHistory.write.
+    `species' restricts the analysis to these species."""
+    pool = hogs.pool(processes)
+    try:
+        res = dict(pool.imap_unordered(_analyze_level,
+                                       [(level, species) for level in levels]))
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return res
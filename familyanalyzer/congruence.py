@@ -0,0 +1,462 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Gene tree congruence of HOGs: for every sampled HOG the tree implied
+#  by the HOG is compared to a maximum likelihood gene tree inferred
+#  from the sequences of its member genes. The per-HOG pipelines
+#  (alignment, tree building, collapse of weakly supported branches and
+#  tree comparison) run in a process pool; finished HOGs are recorded in
+#  a checkpoint file, so an interrupted run can be resumed.
+#
+import io
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import traceback
+
+from .genetree import GeneTree, GeneTreeTracer
+from .seqindex import FastaIndex
+from .treecompare import LeafIndex, TreeSplits, congruence
+
+CHECKPOINT = 'checkpoint.jsonl'
+JOBLIST = 'jobs.txt'
+MIN_SEQUENCES = 3
+
+
+class CongruenceError(Exception):
+    pass
+
+
+def read_fasta(fd, wanted=None):
+    """reads a fasta file object into a dict id -> sequence. If `wanted'
+    is given, only these ids are kept."""
+    seqs = dict()
+    name, chunks = None, []
+    for line in fd:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None and (wanted is None or name in wanted):
+                seqs[name] = ''.join(chunks)
+            name, chunks = line[1:].split(None, 1)[0], []
+        elif line:
+            chunks.append(line)
+    if name is not None and (wanted is None or name in wanted):
+        seqs[name] = ''.join(chunks)
+    return seqs
+
+
+def write_phylip(fd, records):
+    """writes aligned (name, seq) records in relaxed phylip format."""
+    records = list(records)
+    if not records:
+        raise CongruenceError('cannot write an empty alignment')
+    fd.write(' {} {}\n'.format(len(records), len(records[0][1])))
+    width = max(len(name) for name, _ in records) + 1
+    for name, seq in records:
+        fd.write('{}{}\n'.format(name.ljust(width), seq))
+
+
+def _run(cmd, stdout=None):
+    try:
+        subprocess.check_call(cmd, stdout=stdout)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise CongruenceError('{} failed: {}'.format(cmd[0], e))
+
+
+class Aligner(object):
+    """computes a multiple sequence alignment of a fasta file. Subclasses
+    implement align() and write the aligned sequences in fasta format
+    to `out_fname'."""
+
+    def align(self, fasta_fname, out_fname):
+        raise NotImplementedError
+
+
+class MafftAligner(Aligner):
+    def __init__(self, executable='mafft', options=('--auto', '--quiet')):
+        self.executable = executable
+        self.options = list(options)
+
+    def align(self, fasta_fname, out_fname):
+        with open(out_fname, 'wb') as out:
+            _run([self.executable] + self.options + [fasta_fname], stdout=out)
+
+
+class TreeBuilder(object):
+    """infers a tree with branch support values from an alignment in
+    fasta format. Subclasses implement build() which returns the
+    filename of the resulting newick tree."""
+
+    def build(self, aln_fname, prefix, bootstrap):
+        raise NotImplementedError
+
+
+class PhymlTreeBuilder(TreeBuilder):
+    def __init__(self, executable='phyml', datatype='aa'):
+        self.executable = executable
+        self.datatype = datatype
+
+    def build(self, aln_fname, prefix, bootstrap):
+        phy_fname = prefix + '.phy'
+        with io.open(aln_fname) as fh:
+            records = sorted(read_fasta(fh).items())
+        with io.open(phy_fname, 'w') as out:
+            write_phylip(out, records)
+        with open(os.devnull, 'wb') as devnull:
+            _run([self.executable, '-i', phy_fname, '-d', self.datatype,
+                  '-b', str(bootstrap), '--quiet'], stdout=devnull)
+        # phyml 3 appends '.txt' to its output files, older versions not
+        for fname in (phy_fname + '_phyml_tree', phy_fname + '_phyml_tree.txt'):
+            if os.path.exists(fname):
+                return fname
+        raise CongruenceError('phyml did not produce a tree for {}'
+                              .format(phy_fname))
+
+
+class Collapser(object):
+    """collapses branches with a support below `threshold' and writes
+    the resulting newick tree to `out_fname'."""
+
+    def collapse(self, tree_fname, threshold, out_fname):
+        raise NotImplementedError
+
+
+class ExternalCollapser(Collapser):
+    def __init__(self, executable='~/bin/collapse.py'):
+        self.executable = os.path.expanduser(executable)
+
+    def collapse(self, tree_fname, threshold, out_fname):
+        out = subprocess.check_output([self.executable, '--threshold',
+                                       str(threshold), tree_fname])
+        with io.open(out_fname, 'w') as fh:
+            for line in out.decode('utf-8').splitlines():
+                fh.write(line + ';\n')
+
+
+class TreeComparator(object):
+    """compares the collapsed gene tree with the hog tree. compare()
+    receives the three trees as newick strings and returns a dict with
+    the keys 'symmetric_difference', 'nodes_hog', 'nodes_gene',
+    'nodes_collapsed' and 'congruence'."""
+
+    def compare(self, collapsed, hogtree, genetree):
+        raise NotImplementedError
+
+    @staticmethod
+    def summarise(diff, nodes_hog, nodes_gene, nodes_collapsed):
+        return {'symmetric_difference': diff,
+                'nodes_hog': nodes_hog,
+                'nodes_gene': nodes_gene,
+                'nodes_collapsed': nodes_collapsed,
+                'congruence': 1 - diff / (nodes_collapsed + nodes_hog)}
+
+
+class DendropyComparator(TreeComparator):
+    def compare(self, collapsed, hogtree, genetree):
+        try:
+            import dendropy
+            from dendropy.calculate import treecompare
+        except ImportError:
+            raise CongruenceError('DendropyComparator requires dendropy')
+        tns = dendropy.TaxonNamespace()
+        trees = [dendropy.Tree.get(data=t, schema='newick',
+                                   taxon_namespace=tns)
+                 for t in (collapsed, hogtree, genetree)]
+        diff = treecompare.symmetric_difference(trees[0], trees[1],
+                                                is_bipartitions_updated=False)
+        return self.summarise(diff, len(trees[1].internal_nodes()),
+                              len(trees[2].internal_nodes()),
+                              len(trees[0].internal_nodes()))
+
+
+class NativeComparator(TreeComparator):
+    """bipartition bitset comparison (see the treecompare module). With
+    compare_collapsing() the gene tree is collapsed in memory, so the
+    pipeline needs no collapser stage."""
+
+    def compare(self, collapsed, hogtree, genetree):
+        index = LeafIndex()
+        hog = TreeSplits.from_newick(hogtree, index)
+        res = congruence(hog, TreeSplits.from_newick(collapsed, index))
+        res['nodes_gene'] = TreeSplits.from_newick(genetree).nr_internal
+        return res
+
+    def compare_collapsing(self, hogsplits, genetree, threshold):
+        gene = TreeSplits.from_newick(genetree, hogsplits.index)
+        res = congruence(hogsplits, gene, threshold)
+        res['collapsed'] = gene.collapse(threshold).newick() + ';'
+        return res
+
+
+class CongruencePipeline(object):
+    """the per-HOG pipeline. All stages are exchangeable; the objects
+    must be picklable to be sent to the worker processes. Without a
+    collapser the comparator collapses the gene tree itself."""
+
+    def __init__(self, aligner=None, builder=None, collapser=None,
+                 comparator=None, bootstrap=100, threshold=50):
+        self.aligner = aligner if aligner is not None else MafftAligner()
+        self.builder = builder if builder is not None else PhymlTreeBuilder()
+        self.collapser = collapser
+        self.comparator = (comparator if comparator is not None
+                           else NativeComparator())
+        if collapser is None and not hasattr(self.comparator,
+                                             'compare_collapsing'):
+            raise CongruenceError('{} needs a collapser'
+                                  .format(type(self.comparator).__name__))
+        self.bootstrap = bootstrap
+        self.threshold = threshold
+
+    def run(self, job):
+        """runs all stages for one prepared job (see
+        CongruenceRunner.prepare) and returns the result dict."""
+        famid, workdir = job['family'], job['workdir']
+        prefix = os.path.join(workdir, famid)
+        fasta = prefix + '.fasta'
+        alignment = prefix + '.alignment'
+        collapsed = prefix + '.phy_phyml_tree.collapsed'
+
+        self.aligner.align(fasta, alignment)
+        genetree = self.builder.build(alignment, prefix, self.bootstrap)
+        trees = dict()
+        with io.open(genetree) as fh:
+            trees['genetree'] = fh.read().strip()
+        if self.collapser is None:
+            res = self.comparator.compare_collapsing(
+                job['hogsplits'], trees['genetree'], self.threshold)
+            trees['collapsed'] = res.pop('collapsed')
+        else:
+            self.collapser.collapse(genetree, self.threshold, collapsed)
+            with io.open(collapsed) as fh:
+                trees['collapsed'] = fh.read().strip()
+            res = self.comparator.compare(trees['collapsed'], job['hogtree'],
+                                          trees['genetree'])
+        res['family'] = famid
+        res['level'] = job['level']
+        res['nodes_removed'] = res['nodes_gene'] - res['nodes_collapsed']
+        self._write_report(prefix, job['hogtree'], trees, res)
+        return res
+
+    def _write_report(self, prefix, hogtree, trees, res):
+        with io.open(prefix + '.gtc', 'w') as fh:
+            fh.write('{}\n'.format(res['congruence']))
+        with io.open(prefix + '.txt', 'w') as fh:
+            fh.write('HOG tree:\n{}\n\n'.format(hogtree))
+            fh.write('Uncollapsed Gene tree:\n{}\n\n'.format(trees['genetree']))
+            fh.write('Collapsed Gene tree:\n{}\n\n'.format(trees['collapsed']))
+            fh.write('# nodes collapsed: {}\n\n'.format(res['nodes_removed']))
+            fh.write('Symmetric distance: {}\n\n'
+                     .format(res['symmetric_difference']))
+            fh.write('# Nodes (Hogtree): {}\n\n'.format(res['nodes_hog']))
+            fh.write('# Nodes (Uncollaped Gene tree): {}\n\n'
+                     .format(res['nodes_gene']))
+            fh.write('# Nodes (Collapsed Gene tree): {}\n\n'
+                     .format(res['nodes_collapsed']))
+            fh.write('HOG Tree Congruence:{}\n\n'.format(res['congruence']))
+
+
+class Checkpoint(object):
+    """append-only record of finished HOGs (one json object per line).
+    A line that was cut short by an interruption is ignored."""
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.results = dict()
+        self._partial = False
+        if os.path.exists(fname):
+            with io.open(fname) as fh:
+                for line in fh:
+                    self._partial = not line.endswith('\n')
+                    try:
+                        res = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.results[res['family']] = res
+
+    def __contains__(self, famid):
+        return famid in self.results
+
+    def record(self, res):
+        self.results[res['family']] = res
+        with io.open(self.fname, 'a') as fh:
+            if self._partial:
+                # terminate the line of an interrupted write
+                fh.write('\n')
+                self._partial = False
+            fh.write(json.dumps(res, sort_keys=True) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+
+_PIPELINE = None
+
+
+def _init_worker(pipeline):
+    global _PIPELINE
+    _PIPELINE = pipeline
+
+
+def _run_job(job):
+    try:
+        return _PIPELINE.run(job)
+    except Exception as e:
+        return {'family': job['family'], 'level': job['level'],
+                'error': '{}: {}'.format(type(e).__name__, e),
+                'traceback': traceback.format_exc()}
+
+
+class CongruenceRunner(object):
+    """schedules the congruence pipeline of many HOGs.
+
+    usage:
+        runner = CongruenceRunner(parser, tax, pipeline, 'outdir')
+        fams = runner.select_families(num=100, seed=1)
+        results = runner.run(fams, 'seqs.fasta', processes=8)
+
+    `tax' needs to have its histories and comparisons computed. The
+    output directory may exist already; HOGs recorded in its checkpoint
+    are skipped, failed HOGs are retried on the next run."""
+
+    def __init__(self, parser, tax, pipeline, outdir, level=None,
+                 xreftag='protId'):
+        self.parser = parser
+        self.tax = tax
+        self.pipeline = pipeline
+        self.outdir = outdir
+        self.level = level if level is not None else tax.root
+        self.xreftag = xreftag
+        if self.level not in tax.hierarchy:
+            raise CongruenceError('unknown taxonomic level: {}'
+                                  .format(self.level))
+        self.taxnode = tax[self.level]
+        self.history = self.taxnode.history
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        self.checkpoint = Checkpoint(os.path.join(outdir, CHECKPOINT))
+
+    def select_families(self, families=None, num=1, seed=None):
+        """returns the ids of the HOGs to analyse: the given `families'
+        or `num' randomly drawn ones. A random sample is stored in the
+        output directory and reused when the run is resumed."""
+        if families is not None:
+            for famid in families:
+                if famid not in self.history.geneFamDict:
+                    raise CongruenceError('family {} does not exist at {}'
+                                          .format(famid, self.level))
+            return list(families)
+        joblist = os.path.join(self.outdir, JOBLIST)
+        if os.path.exists(joblist):
+            with io.open(joblist) as fh:
+                return [line.strip() for line in fh if line.strip()]
+        fams = [fam.getFamId() for fam in self.history.geneFamList]
+        sample = random.Random(seed).sample(fams, min(num, len(fams)))
+        with io.open(joblist, 'w') as fh:
+            fh.write(''.join(famid + '\n' for famid in sample))
+        return sample
+
+    def hog_tree(self, famid):
+        fam = self.history[famid]
+        gtt = GeneTreeTracer(self.parser, self.tax)
+        root = gtt.trace_gene_family(self.taxnode, fam)
+        if root is None:
+            raise CongruenceError('no gene tree for family {}'.format(famid))
+        return GeneTree(root)
+
+    def prepare(self, famid):
+        """writes the hog tree of a family into its working directory and
+        returns the job description. The 'genes' of the job are the
+        xrefs of the member genes, whose sequences are still to be
+        written to the job's 'fasta' file."""
+        workdir = os.path.join(self.outdir, famid)
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        prefix = os.path.join(workdir, famid)
+        tree = self.hog_tree(famid)
+        hogtree = tree.write_topology()
+        with io.open(prefix + '.FAtree', 'w') as fh:
+            fh.write(tree.write() + '\n')
+        with io.open(prefix + '.hogtree', 'w') as fh:
+            fh.write(hogtree + '\n')
+
+        genes = [self.parser.mapGeneToXRef(gene, self.xreftag)
+                 for gene in self.history[famid].getMemberGenes()]
+        if len(genes) < MIN_SEQUENCES:
+            raise CongruenceError('family {} has fewer than {} genes'
+                                  .format(famid, MIN_SEQUENCES))
+        return {'family': famid, 'level': self.level, 'workdir': workdir,
+                'fasta': prefix + '.fasta', 'genes': genes,
+                'hogtree': hogtree,
+                'hogsplits': TreeSplits.from_genetree(tree)}
+
+    def pending(self, famids):
+        return [famid for famid in famids if famid not in self.checkpoint]
+
+    def run(self, famids, seqs, processes=1, callback=None):
+        """runs the pipeline for all not yet finished HOGs of `famids'.
+        `seqs' is a fasta filename or a FastaIndex. Returns the list of
+        result dicts of all `famids' (including the ones from previous
+        runs); failed HOGs carry an 'error' key. `callback' is called
+        with every new result as it arrives."""
+        prepared, failed = [], dict()
+
+        def fail(famid, msg):
+            failed[famid] = {'family': famid, 'level': self.level,
+                             'error': msg}
+            if callback is not None:
+                callback(failed[famid])
+
+        for famid in self.pending(famids):
+            try:
+                prepared.append(self.prepare(famid))
+            except CongruenceError as e:
+                fail(famid, str(e))
+
+        index = seqs if isinstance(seqs, FastaIndex) else FastaIndex(seqs)
+        try:
+            missing = index.extract_many(
+                ((job['fasta'], job['genes']) for job in prepared), processes)
+        finally:
+            if index is not seqs:
+                index.close()
+        jobs = []
+        for job in prepared:
+            if missing[job['fasta']]:
+                fail(job['family'], 'no sequence for gene(s) {}'
+                     .format(', '.join(missing[job['fasta']])))
+            else:
+                jobs.append(job)
+
+        def collect(res):
+            if 'error' in res:
+                failed[res['family']] = res
+            else:
+                self.checkpoint.record(res)
+            if callback is not None:
+                callback(res)
+
+        if processes > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(processes, _init_worker,
+                                        (self.pipeline,))
+            try:
+                for res in pool.imap_unordered(_run_job, jobs):
+                    collect(res)
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            _init_worker(self.pipeline)
+            for job in jobs:
+                collect(_run_job(job))
+
+        return [self.checkpoint.results.get(famid) or failed[famid]
+                for famid in famids]
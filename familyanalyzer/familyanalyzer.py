@@ -20,46 +20,224 @@ standard_library.install_hooks()
 #                            Adrian Altenhoff, June 2013
 #
 import lxml.etree as etree
+from xml.sax.saxutils import quoteattr
+from array import array
 import collections
+import hashlib
+import heapq
 import itertools
 import io
 import re
 import sys
-from .tools import enum, PROGRESSBAR, setup_progressbar
+import zlib
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from .tools import enum, PROGRESSBAR, setup_progressbar, LRUCache
+from .profiling import phase
 from .orthoxmlquery import ElementError, OrthoXMLQuery
 from .taxonomy import NewickTaxonomy, TaxRangeOrthoXMLTaxonomy, XMLTaxonomy
+from .geneindex import GeneIndexBuilder
+from .traversal import walk
+from . import lca
 
 MAXINT = sys.maxsize
 
 
+class DocumentReleasedError(Exception):
+    """raised if an operation needs the xml document after
+    OrthoXMLParser.releaseDocument() was called."""
+    pass
+
+
+class AnnotationState(object):
+    """records what has been added to an orthoxml document: the LOFT
+    ids (og attributes), the missing TaxRange properties (with the
+    digest of the taxonomy used and the propagate_top flag) and the
+    singleton families (range of their ids). The state is stored as
+    <?familyanalyzer ...?> processing instruction, the last child of the
+    root element, so that reloaded documents need not be checked again.
+    `loft' is None as long as it is unknown."""
+
+    target = 'familyanalyzer'
+
+    def __init__(self, loft=None, taxonomy=None, propagate_top=False,
+                 singletons=None):
+        self.loft = loft
+        self.taxonomy = taxonomy
+        self.propagate_top = propagate_top
+        self.singletons = singletons
+
+    @staticmethod
+    def taxonomy_digest(tax):
+        """a digest of the topology of the taxonomy `tax', independent
+        of the order of the children."""
+        edges = sorted('{}\t{}'.format(name, node.up.name if node.up
+                                       is not None else '')
+                       for name, node in tax.hierarchy.items())
+        return hashlib.sha1('\n'.join(edges).encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _find(cls, root):
+        for node in reversed(root):
+            if isinstance(node, etree._ProcessingInstruction):
+                if node.target == cls.target:
+                    return node
+            elif isinstance(node.tag, str):
+                break
+        return None
+
+    @classmethod
+    def from_document(cls, root):
+        """the state stored in the document with the root element
+        `root'; an unknown state if there is none."""
+        pi = cls._find(root)
+        if pi is None:
+            return cls()
+        singletons = pi.get('singletons')
+        if singletons is not None:
+            singletons = tuple(int(x) for x in singletons.split(':'))
+        return cls(loft=pi.get('loft') == 'yes',
+                   taxonomy=pi.get('taxonomy'),
+                   propagate_top=pi.get('propagate_top') == 'yes',
+                   singletons=singletons)
+
+    def singleton_families(self):
+        """set of the ids of the singleton families."""
+        if self.singletons is None:
+            return None
+        return set(str(i) for i in range(*self.singletons))
+
+    def is_empty(self):
+        return not (self.loft or self.taxonomy or
+                    self.singletons is not None)
+
+    def processing_instruction(self):
+        attrs = [('loft', 'yes' if self.loft else 'no')]
+        if self.taxonomy is not None:
+            attrs.append(('taxonomy', self.taxonomy))
+            attrs.append(('propagate_top',
+                          'yes' if self.propagate_top else 'no'))
+        if self.singletons is not None:
+            attrs.append(('singletons', '{}:{}'.format(*self.singletons)))
+        return etree.ProcessingInstruction(
+            self.target, ' '.join('{}="{}"'.format(*a) for a in attrs))
+
+    def store(self, root):
+        """replaces the state stored in the document of `root'."""
+        old = self._find(root)
+        if old is not None:
+            root.remove(old)
+        if not self.is_empty():
+            root.append(self.processing_instruction())
+
+
 class OrthoXMLParser(object):
     ns = {"ns0": "http://orthoXML.org/2011/"}   # xml namespace
 
+    # number of member gene lists kept per parser (see GeneFamily)
+    member_cache_size = 1 << 14
+
     def __init__(self, filename):
         """creates a OrthoXMLParser object. the parameter filename
         needs to be a path pointing to the orthoxml file to be
         analyzed."""
-        self.doc = etree.parse(filename)
+        with phase('parse'):
+            # huge_tree lifts the nesting limit of libxml2 (256 levels)
+            # that deeply nested families easily exceed
+            self.doc = etree.parse(filename,
+                                   etree.XMLParser(huge_tree=True))
         self.root = self.doc.getroot()
         self.tax = None
         self.singletons = None
-
-        self._buildMappings()   # builds three dictionaries - see def below
+        # species -> singleton orthologGroups added by augmentSingletons
+        self._singletonGroups = dict()
+        # incremented whenever geneRef elements are added to the groups
+        self._groupsVersion = 0
+        # (GeneIndex, groups version), set by the LOFT annotation
+        self._geneIndex = None
+        # annotations added to the document, possibly in an earlier run
+        self.annotation = AnnotationState.from_document(self.root)
+        self.singletons = self.annotation.singleton_families()
+        self.memberCache = LRUCache(self.member_cache_size,
+                                    name='GeneFamily.getMemberGenes')
+        # CompactHOGs and the compressed document (if kept), set by
+        # releaseDocument
+        self._hogs = None
+        self._xml = None
+
+        with phase('buildMappings') as ph:
+            self._buildMappings()   # builds three dictionaries - see def below
+            ph.count(len(self._gene2species))
 
     def write(self, filename, **kwargs):
         """Write out the (modified) orthoxml file into a new file.
         kwargs include:
             pretty_print=[True/False],
             xml_declaration=[True/False]
-            encoding=[e.g. 'UTF-8']"""
+            encoding=[e.g. 'UTF-8']
+        After releaseDocument(), this is only possible if the document
+        was kept with keep_xml=True."""
+        doc = self.doc
+        if doc is None:
+            if self._xml is None:
+                raise DocumentReleasedError(
+                    'the document was released without keep_xml')
+            doc = etree.ElementTree(etree.fromstring(
+                zlib.decompress(self._xml), etree.XMLParser(huge_tree=True)))
         if 'pretty_print' in kwargs:
-            self._remove_whitespace()
-        self.doc.write(filename, **kwargs)
-
-    def _remove_whitespace(self):
+            self._remove_whitespace(doc.getroot())
+        self.annotation.store(doc.getroot())
+        doc.write(filename, **kwargs)
+
+    def releaseDocument(self, keep_xml=False):
+        """builds the compact form of the groups (see CompactHOGs) and
+        releases the lxml document, which usually needs several times
+        more memory. The histories, comparisons and gene trees are
+        computed from the compact form afterwards; getToplevelGroups()
+        and getSubFamilies() return its node indices instead of
+        elements. The document has to be augmented (taxonomy and
+        singletons) before, as it cannot be changed any more.
+
+        write() remains possible only if `keep_xml' is set; the
+        serialized document is kept zlib compressed. GeneFamily objects
+        created before keep their part of the document alive."""
+        if self._hogs is not None:
+            return
+        from .compact import CompactHOGs
+        with phase('releaseDocument'):
+            self._hogs = CompactHOGs.from_parser(self)
+            if keep_xml:
+                self._xml = zlib.compress(etree.tostring(self.doc))
+            # the species elements would keep the document alive
+            species = dict((id(elem), dict(elem.attrib)) for elem in
+                           set(self._gene2species.values()))
+            self._gene2species = dict(
+                (gene, species[id(elem)])
+                for gene, elem in self._gene2species.items())
+            self.doc = self.root = None
+            self._singletonGroups = dict()
+            self._speciesGeneRefs = None
+            # the cached member lists are keyed by elements
+            self.memberCache = LRUCache(self.member_cache_size,
+                                        name='GeneFamily.getMemberGenes')
+
+    def isReleased(self):
+        """whether the document was released, see releaseDocument()."""
+        return self._hogs is not None
+
+    def _requireDocument(self, action):
+        if self._hogs is not None:
+            raise DocumentReleasedError(
+                'cannot {} after the document was released'.format(action))
+
+    def _remove_whitespace(self, root=None):
         """Remove whitespace from text and tail fields so that lxml can
         pretty_print the tree"""
-        for element in self.root.iter():
+        if root is None:
+            root = self.root
+        for element in root.iter():
             if element.text is not None and element.text.isspace():
                 element.text = None
             element.tail = None
@@ -75,7 +253,7 @@ class OrthoXMLParser(object):
         else:
             tup = (id_, typ)
             res = self._xrefs.get(tup, None)
-            if res is None:
+            if res is None and self.root is not None:
                 # fallback, if not in dict
                 gene = OrthoXMLQuery.getGeneFromId(id_, self.root)
                 # return desired ID typ, otherwise whole element
@@ -95,9 +273,50 @@ class OrthoXMLParser(object):
                      if self._gene2species[g].get(tag, None) in speciesFilter]
         return genes
 
+    def getSpeciesFilter(self, species):
+        """returns a SpeciesFilter for the given species names. An
+        existing SpeciesFilter is returned unchanged."""
+        if species is None or isinstance(species, SpeciesFilter):
+            return species
+        if self._species2genes is None:
+            species2genes = collections.defaultdict(set)
+            for gid, spec in self._gene2species.items():
+                species2genes[spec.get('name')].add(gid)
+            self._species2genes = species2genes
+        return SpeciesFilter(species, self._species2genes)
+
+    def _groupedGenes(self):
+        """bytearray with a 1 for every interned gene which is
+        referenced in a group."""
+        if self._grouped is None:
+            grouped = bytearray(len(self._geneIds))
+            for ref in self.root.iter('{{{ns0}}}geneRef'.format(**self.ns)):
+                pos = self._genePos.get(ref.get('id'))
+                if pos is not None:
+                    grouped[pos] = 1
+            self._grouped = grouped
+        return self._grouped
+
+    def _geneRefsBySpecies(self):
+        """dict species -> list of (document position, geneRef element)
+        of its genes in the groups section. Built in one pass over the
+        document and kept until geneRef elements are added."""
+        cached = self._speciesGeneRefs
+        if cached is None or cached[0] != self._groupsVersion:
+            refs = collections.defaultdict(list)
+            tag = '{{{ns0}}}geneRef'.format(**self.ns)
+            for pos, gref in enumerate(self.root.iter(tag)):
+                species = self._gene2species.get(gref.get('id'))
+                if species is not None:
+                    refs[species.get('name')].append((pos, gref))
+            cached = self._speciesGeneRefs = (self._groupsVersion, refs)
+        return cached[1]
+
     def getToplevelGroups(self):
         """A function yielding the toplevel orthologGroups from the file.
         This corresponds to gene families for the purpose of this project."""
+        if self._hogs is not None:
+            return self._hogs.getToplevelGroups()
         return OrthoXMLQuery.getToplevelOrthologGroups(self.root)
 
     def getSubFamilies(self, level, root=None):
@@ -106,19 +325,55 @@ class OrthoXMLParser(object):
         orthologGroup nodes are annotated with a 'property' element
         with 'TaxRange' as a name and the actual level in a 'value'
         attribute. This is not required by the orthoxml schema."""
+        if self._hogs is not None:
+            return self._hogs.getSubFamilies(level, root)
         if root is None:
             root = self.root
 
         return OrthoXMLQuery.getGroupsAtLevel(level, root)
 
-    def get_species_below_node(self, node):
+    def iterSubFamilies(self, level, root=None):
+        """as getSubFamilies, but yields the nodes one by one instead of
+        collecting them first."""
+        if self._hogs is not None:
+            return iter(self._hogs.getSubFamilies(level, root))
+        if root is None:
+            root = self.root
+        return OrthoXMLQuery.iterGroupsAtLevel(level, root)
+
+    def newGeneFamily(self, group):
+        """returns the GeneFamily of the orthologGroup element `group'."""
+        if self._hogs is not None:
+            return self._hogs.newGeneFamily(group)
+        return GeneFamily(group, self.memberCache)
+
+    def membersByGroup(self, speciesFilter, groups):
+        """maps each of the orthologGroup elements `groups' onto the
+        list of its member genes selected by `speciesFilter'."""
+        if self._hogs is not None:
+            return self._hogs.membersByGroup(speciesFilter, groups)
+        return speciesFilter.membersByGroup(self, groups)
+
+    def get_species_below_node(self, node, speciesFilter=None):
         """ return a set of all species that have a geneRef present beneath
         the specified node
 
         :param root: Node of interest
+        :param speciesFilter: optional SpeciesFilter; only the selected
+            species are reported
         :return:
         """
+        if self._hogs is not None:
+            genes = self._hogs.genes
+            gids = [genes[g] for g in self._hogs.memberPositions(node)]
+            if speciesFilter is not None:
+                gids = speciesFilter.filterGenes(gids)
+            return {self.mapGeneToSpecies(gid) for gid in gids}
         generef_nodes = OrthoXMLQuery.getGeneRefNodes(node)
+        if speciesFilter is not None:
+            genes = speciesFilter.genes
+            return {self.mapGeneToSpecies(gid) for gid in
+                    (gr.get('id') for gr in generef_nodes) if gid in genes}
         species_covered = {self.mapGeneToSpecies(gr.get('id'))
                            for gr in generef_nodes}
         return species_covered
@@ -169,7 +424,8 @@ class OrthoXMLParser(object):
               (idnum, idtype ['geneId','protId']),
           values are gene names
         Also builds the set:
-          self._species - All species names in the xml tree"""
+          self._species - All species names in the xml tree
+        and interns the gene ids (self._geneIds, self._genePos)"""
         mapping = dict()
         xref = dict()
         for species in self._findSubNodes("species"):
@@ -181,6 +437,15 @@ class OrthoXMLParser(object):
                     if tag != "id":
                         xref[(id_, tag)] = gene.get(tag)
         self._gene2species = mapping
+        self._species2genes = None
+        self._geneIds = list(mapping)
+        self._genePos = dict((g, i) for i, g in enumerate(self._geneIds))
+        # bitmap over _geneIds of the genes in groups, set by the
+        # TaxRange annotation or on demand (see _groupedGenes)
+        self._grouped = None
+        self._maxFamilyId = None
+        # (groups version, species -> geneRefs), see _geneRefsBySpecies
+        self._speciesGeneRefs = None
         self._xrefs = xref
         self._species = frozenset({z.get('name') for z in mapping.values()})
         self._levels = frozenset({n.get('value')
@@ -203,26 +468,59 @@ class OrthoXMLParser(object):
                 descended from the family
         """
         genes = collections.defaultdict(set)
-        geneRefs = self._findSubNodes("geneRef", fam)
-        for gref in geneRefs:
-            gid = gref.get('id')
+        if self._hogs is not None:
+            gids = self.newGeneFamily(fam).getMemberGenes()
+        else:
+            gids = [gref.get('id') for gref in
+                    self._findSubNodes("geneRef", fam)]
+        for gid in gids:
             sp = self.mapGeneToSpecies(gid)
             genes[sp].add(gid)
         return genes
 
-    def getFamHistory(self):
+    def getFamHistory(self, speciesFilter=None):
         """This method returns a FamHistory object initialized with
         the most powerful LevelAnalysis handler. The handler depends
         on whether the parser contains a tax attribute, set by the
-        augmentTaxonomyInfo method if called."""
+        augmentTaxonomyInfo method if called.
+
+        If speciesFilter (a list of species names or a SpeciesFilter)
+        is given, only the genes and losses of these species are
+        analyzed."""
 
         # assure that orthologGroup xml elements annotated with an 'og' attr
-        if self.root.find(".//*[@og]") is None:
+        if not self.isLoftAnnotated():
             GroupAnnotator(self).annotateDoc()
 
-        analyzer = LevelAnalysisFactory().newLevelAnalysis(self)
+        speciesFilter = self.getSpeciesFilter(speciesFilter)
+        analyzer = LevelAnalysisFactory().newLevelAnalysis(self, speciesFilter)
         return FamHistory(self, analyzer)
 
+    def isLoftAnnotated(self):
+        """whether the orthologGroups carry LOFT ids. Unless known from
+        the annotation state, the document is checked once."""
+        if self.annotation.loft is None:
+            self.annotation.loft = self.root.find(".//*[@og]") is not None
+        return self.annotation.loft
+
+    def getGeneIndex(self):
+        """returns the GeneIndex with the family lineage of every gene.
+        It is built by the LOFT annotation of the document, which is
+        (re-)run if needed."""
+        if (self._geneIndex is None or
+                self._geneIndex[1] != self._groupsVersion):
+            if self._hogs is not None:
+                self._geneIndex = (self._hogs.geneIndex(),
+                                   self._groupsVersion)
+            else:
+                GroupAnnotator(self).annotateDoc()
+        return self._geneIndex[0]
+
+    def getGeneLineage(self, gene):
+        """returns the list of (level, LOFT id) of the families
+        containing `gene', from the root to the leaf."""
+        return self.getGeneIndex().lineage(gene)
+
     def augmentTaxonomyInfo(self, tax, propagate_top=False):
         """Assign a taxonomy to the orthoxml file. this taxonomy
         is used to augment the xml with the relevant level infos
@@ -236,10 +534,54 @@ class OrthoXMLParser(object):
         if self.tax is not None:
             raise Exception("a taxonomy can be assigned only once")
         self.tax = tax
+        digest = AnnotationState.taxonomy_digest(tax)
+        if (self.annotation.taxonomy == digest and
+                self.annotation.propagate_top == propagate_top):
+            # the document has been augmented with this taxonomy before
+            return
+        self._requireDocument('add a taxonomy')
         GroupAnnotator(self).annotateMissingTaxRanges(tax, propagate_top)
+        self.annotation.taxonomy = digest
+        self.annotation.propagate_top = propagate_top
+        # lineages collected before lack the added levels
+        self._geneIndex = None
 
     def augmentSingletons(self):
+        self._requireDocument('add singletons')
         GroupAnnotator(self).annotateSingletons()
+        self._groupsVersion += 1
+
+    def getSingletonHistories(self, species=None):
+        """returns a dict species -> FamHistory of the singleton
+        families of the species (all species if None), as added by
+        augmentSingletons. The histories are built directly from the
+        added groups instead of analyzing the species levels."""
+        if species is None:
+            species = self.getSpeciesSet()
+        # assures the LOFT annotation
+        analyzer = self.getFamHistory().analyzer
+        groups = self._singletonGroups
+        if not groups and self.singletons and self._hogs is not None:
+            # LOFT ids of toplevel groups are their ids
+            hogs = self._hogs
+            for fam in hogs.getToplevelGroups():
+                if hogs.getFamId(fam) in self.singletons:
+                    gene = hogs.genes[hogs.memberPositions(fam)[0]]
+                    groups.setdefault(self.mapGeneToSpecies(gene),
+                                      []).append(fam)
+        elif not groups and self.singletons:
+            # singletons added before the document was reloaded
+            for fam in self.getToplevelGroups():
+                if fam.get('id') in self.singletons:
+                    gene = OrthoXMLQuery.getGeneRefNodes(fam)[0].get('id')
+                    groups.setdefault(self.mapGeneToSpecies(gene),
+                                      []).append(fam)
+        histories = dict()
+        for spec in species:
+            hist = FamHistory(self, analyzer)
+            hist.analyzeGroups(spec, groups.get(spec, []))
+            histories[spec] = hist
+        return histories
 
 
 class TaxonomyFactory(object):
@@ -253,19 +595,24 @@ class TaxonomyFactory(object):
                 if suffix in ['.nwk', '.tree', '.newick']:
                     return NewickTaxonomy(arg)
         elif isinstance(arg, OrthoXMLParser):
+            arg._requireDocument('extract the taxonomy')
             return TaxRangeOrthoXMLTaxonomy(arg)
         else:
             raise NotImplementedError("unknown type of Taxonomy")
 
 
 class GeneFamily(object):
-    """GeneFamily(root_element)
+    """GeneFamily(root_element, memberCache=None)
 
-    Represents one gene family rooted at an orthologous group. """
-    def __init__(self, root_element):
+    Represents one gene family rooted at an orthologous group.
+    If a memberCache (a LRUCache, usually the one of the parser) is
+    passed, the member genes are shared with other GeneFamily objects
+    of the same orthologGroup element."""
+    def __init__(self, root_element, memberCache=None):
         if not OrthoXMLParser.is_ortholog_group(root_element):
             raise ElementError('Not an orthologGroup node')
         self.root = root_element
+        self.memberCache = memberCache
 
     def __repr__(self):
         return '{} (id#={})'.format(self.__class__.__name__, self.getFamId())
@@ -290,17 +637,30 @@ class GeneFamily(object):
         target = other._cmp()
         return target[:len(query)] == query
 
-    def getMemberGenes(self):
+    def getMemberGenes(self, speciesFilter=None):
         """
         Get all genes belonging to this family. Cached to speed up repeated calls.
+        If a SpeciesFilter is passed, only the genes of the selected
+        species are returned.
         """
+        if speciesFilter is not None:
+            selected = getattr(self, '_selected_genes', None)
+            if selected is not None and selected[0] is speciesFilter:
+                return selected[1]
+            return speciesFilter.filterGenes(self.getMemberGenes())
         if hasattr(self, '_member_genes'):
             return self._member_genes
-        else:
-            members = self.root.findall('.//{{{ns0}}}geneRef'.
-                                        format(**OrthoXMLParser.ns))
-            self._member_genes = [x.get('id') for x in members]
-            return self._member_genes
+        if self.memberCache is not None:
+            members = self.memberCache.get(self.root)
+            if members is not None:
+                self._member_genes = members
+                return members
+        members = self.root.findall('.//{{{ns0}}}geneRef'.
+                                    format(**OrthoXMLParser.ns))
+        self._member_genes = [x.get('id') for x in members]
+        if self.memberCache is not None:
+            self.memberCache[self.root] = self._member_genes
+        return self._member_genes
 
     def getFamId(self):
         return self.root.get('og')
@@ -330,7 +690,7 @@ class GeneFamily(object):
         returns a list of GeneFamily object, one per sub-family"""
 
         subFamNodes = OrthoXMLQuery.getGroupsAtLevel(level, self.root)
-        subFams = [GeneFamily(fam) for fam in subFamNodes]
+        subFams = [GeneFamily(fam, self.memberCache) for fam in subFamNodes]
         return subFams
 
     def analyze(self, strategy, level):
@@ -353,7 +713,13 @@ class GeneFamily(object):
                 self.getFamId(), spec, len(sumElem.genes),
                 sumElem.typ, refs))
 
-    def is_singleton(self):
+    def is_singleton(self, singletons=None):
+        """whether the family is a singleton. If the ids of the
+        singleton families (parser.singletons) are given, they decide;
+        otherwise the summary, which is empty for a singleton of a
+        species excluded by a SpeciesFilter."""
+        if singletons is not None:
+            return self.getFamId() in singletons
         if not hasattr(self, 'summary'):
             return False
         return 'SINGLETON' in {x.typ for x in self.summary.values()}
@@ -368,7 +734,9 @@ class Singletons(GeneFamily):
             memb.update(element)
         self.members = memb
 
-    def getMemberGenes(self):
+    def getMemberGenes(self, speciesFilter=None):
+        if speciesFilter is not None:
+            return speciesFilter.filterGenes(self.members)
         return self.members
 
     def getFamId(self):
@@ -386,7 +754,61 @@ class Singletons(GeneFamily):
             sumElement.typ = "SINGLETON"
 
 
+class SpeciesFilter(object):
+    """set of selected species together with the ids of their genes.
+    Created with OrthoXMLParser.getSpeciesFilter."""
+
+    def __init__(self, species, species2genes):
+        self.species = frozenset(species)
+        genes = set()
+        for spec in self.species:
+            genes.update(species2genes.get(spec, ()))
+        self.genes = frozenset(genes)
+
+    def __contains__(self, species):
+        return species in self.species
+
+    def __iter__(self):
+        return iter(self.species)
+
+    def __len__(self):
+        return len(self.species)
+
+    def filterGenes(self, genes):
+        return [gid for gid in genes if gid in self.genes]
+
+    def geneRefs(self, parser):
+        """the geneRef elements of the selected genes in the groups
+        section, in document order. They are merged from the lists of
+        the selected species in the index of the parser."""
+        cached = getattr(self, '_geneRefs', None)
+        if cached is None or cached[0] != parser._groupsVersion:
+            bySpecies = parser._geneRefsBySpecies()
+            refs = [gref for _, gref in heapq.merge(
+                *[bySpecies.get(spec, ()) for spec in self.species])]
+            cached = self._geneRefs = (parser._groupsVersion, refs)
+        return cached[1]
+
+    def membersByGroup(self, parser, groups):
+        """maps each of the orthologGroup elements `groups' onto the
+        list of its selected member genes. The selected genes are
+        located by walking up from their geneRef elements, so apart
+        from the geneRef index of the parser, which is built once, the
+        cost depends on the selected genes and the depth of their
+        groups, not on the size of the document."""
+        members = dict((grp, []) for grp in groups)
+        tag = '{{{ns0}}}orthologGroup'.format(**OrthoXMLParser.ns)
+        for gref in self.geneRefs(parser):
+            gid = gref.get('id')
+            for grp in gref.iterancestors(tag):
+                if grp in members:
+                    members[grp].append(gid)
+        return members
+
+
 class SummaryOfSpecies(object):
+    __slots__ = ('typ', 'genes')
+
     def __init__(self, typ, genes):
         self.typ = typ
         self.genes = genes
@@ -396,17 +818,18 @@ class LevelAnalysisFactory(object):
     def __init__(self):
         pass
 
-    def newLevelAnalysis(self, parser):
+    def newLevelAnalysis(self, parser, speciesFilter=None):
         """return a the appropriate LevelAnalysis instance based on
         the presents/absence of a taxonomy in the parser"""
         if parser.tax is None:
-            return BasicLevelAnalysis(parser)
+            return BasicLevelAnalysis(parser, speciesFilter)
         elif parser.singletons is None:
-            return TaxAwareLevelAnalysis(parser, parser.tax)
+            return TaxAwareLevelAnalysis(parser, parser.tax, speciesFilter)
         else:
             return SingletonAwareLevelAnalysis(parser,
                                                parser.tax,
-                                               parser.singletons)
+                                               parser.singletons,
+                                               speciesFilter)
 
 
 class BasicLevelAnalysis(object):
@@ -416,8 +839,9 @@ class BasicLevelAnalysis(object):
                        "LATER_GAINED",
                        "SINGLETON")
 
-    def __init__(self, parser):
+    def __init__(self, parser, speciesFilter=None):
         self.parser = parser
+        self.speciesFilter = speciesFilter
 
     def analyzeGeneFam(self, fam, level=None):
         """analyzes a single gene family and returns a summary dict.
@@ -427,7 +851,7 @@ class BasicLevelAnalysis(object):
         genes."""
 
         spec2genes = collections.defaultdict(set)
-        for geneId in fam.getMemberGenes():
+        for geneId in fam.getMemberGenes(self.speciesFilter):
             spec = self.parser.mapGeneToSpecies(geneId)
             spec2genes[spec].add(geneId)
         summary = dict()
@@ -443,8 +867,8 @@ class BasicLevelAnalysis(object):
 
 
 class TaxAwareLevelAnalysis(BasicLevelAnalysis):
-    def __init__(self, parser, tax):
-        super().__init__(parser)
+    def __init__(self, parser, tax, speciesFilter=None):
+        super().__init__(parser, speciesFilter)
         self.tax = tax
 
     def addLosses(self, fam, summary, level):
@@ -455,6 +879,9 @@ class TaxAwareLevelAnalysis(BasicLevelAnalysis):
             lev = self.tax.younger_than_filter(lev, level)
             mostGeneralLevel = self.tax.mostGeneralLevel(lev)
             speciesCoveredByLevel = self.tax.descendents[mostGeneralLevel]
+            if self.speciesFilter is not None:
+                speciesCoveredByLevel = speciesCoveredByLevel.intersection(
+                    self.speciesFilter.species)
             lostSpecies = speciesCoveredByLevel.difference(summary.keys())
             for lost in lostSpecies:
                 summary[lost] = SummaryOfSpecies("ANCIENT_BUT_LOST", [])
@@ -474,8 +901,8 @@ class TaxAwareLevelAnalysis(BasicLevelAnalysis):
 
 
 class SingletonAwareLevelAnalysis(TaxAwareLevelAnalysis):
-    def __init__(self, parser, tax, singletons):
-        super().__init__(parser, tax)
+    def __init__(self, parser, tax, singletons, speciesFilter=None):
+        super().__init__(parser, tax, speciesFilter)
         self.singletons = singletons
 
     def analyzeGeneFam(self, fam, level):
@@ -486,7 +913,7 @@ class SingletonAwareLevelAnalysis(TaxAwareLevelAnalysis):
         genes."""
 
         spec2genes = collections.defaultdict(set)
-        for geneId in fam.getMemberGenes():
+        for geneId in fam.getMemberGenes(self.speciesFilter):
             spec = self.parser.mapGeneToSpecies(geneId)
             spec2genes[spec].add(geneId)
         summary = dict()
@@ -539,8 +966,20 @@ class FamHistory(object):
         self.XRefTag = tag
 
     def analyzeLevel(self, level):
-        subFamNodes = OrthoXMLQuery.getGroupsAtLevel(level, self.parser.root)
-        gfamList = [GeneFamily(fam) for fam in subFamNodes]
+        with phase('analyzeLevel') as ph:
+            subFamNodes = self.parser.getSubFamilies(level)
+            self.analyzeGroups(level, subFamNodes)
+            ph.count(len(subFamNodes))
+
+    def analyzeGroups(self, level, subFamNodes):
+        """analyzes the given orthologGroup elements as the families at
+        `level'."""
+        gfamList = [self.parser.newGeneFamily(fam) for fam in subFamNodes]
+        speciesFilter = self.analyzer.speciesFilter
+        if speciesFilter is not None:
+            members = self.parser.membersByGroup(speciesFilter, subFamNodes)
+            for gfam in gfamList:
+                gfam._selected_genes = (speciesFilter, members[gfam.root])
 
         for gfam in gfamList:
             gfam.analyze(self.analyzer, level)
@@ -573,14 +1012,17 @@ class FamHistory(object):
         """ compares two FamilyHistory objects in linear time
             algorithm implemented in Comparer class
         """
-        c = Comparer(self, other)
-        c.run()
+        with phase('compare') as ph:
+            c = Comparer(self, other)
+            c.run()
+            ph.count(len(c.comp.fams_dict))
         return c.comp
 
     def get_number_of_fams(self, singletons=False):
         if singletons:
             return len(self.geneFamList)
-        return len([x for x in self if not x.is_singleton()])
+        singletons = getattr(self.parser, 'singletons', None)
+        return len([x for x in self if not x.is_singleton(singletons)])
 
 
 class Comparer(object):
@@ -628,6 +1070,7 @@ class Comparer(object):
         self.advance_i2()
         self.comp = LevelComparisonResult(fam_history_1.analyzedLevel,
             fam_history_2.analyzedLevel)
+        self.singletons = getattr(fam_history_2.parser, 'singletons', None)
 
     def run(self):
         while self.f1 is not None and self.f2 is not None:
@@ -653,36 +1096,35 @@ class Comparer(object):
             self.l2_exhausted()
 
     def ident(self):
-        self.comp.addFamily(FamIdent(self.f1.getFamId()))
+        self.comp.add(self.f1.getFamId(), 'identical')
         self.advance_i1()
         self.advance_i2()
 
     def dupl(self):
         m = list()
         while self.f1.prefix_match(self.f2):
-            m.append(self.f2)
+            m.append(self.f2.getFamId())
             self.advance_i2()
             if self.f2 is None:
                 break
-        self.comp.addFamily(FamDupl(self.f1.getFamId(),
-            '; '.join(gf.getFamId() for gf in m)))
+        self.comp.add(self.f1.getFamId(), 'duplicated', m)
         self.advance_i1()
 
     def lost(self):
         while self.f1 < self.f2 and not self.f1.prefix_match(self.f2):
-            self.comp.addFamily(FamLost(self.f1.getFamId()))
+            self.comp.add(self.f1.getFamId(), 'lost')
             self.advance_i1()
             if self.f1 is None:
                 break
 
     def novel(self):
         while self.f1 > self.f2 and not self.f1.prefix_match(self.f2):
-            _Event = (FamSingleton if self.f2.is_singleton()
-                      else FamNovel) # this check is probably redundant
-                                     # because there shouldn't be any
-                                     # singletons if l1 is not exhausted
-                                     # (singletons are always annotated last)
-            self.comp.addFamily(_Event(self.f2.getFamId()))
+            event = ('singleton' if self.f2.is_singleton(self.singletons)
+                     else 'novel') # this check is probably redundant
+                                   # because there shouldn't be any
+                                   # singletons if l1 is not exhausted
+                                   # (singletons are always annotated last)
+            self.comp.add(self.f2.getFamId(), event)
             self.advance_i2()
             if self.f2 is None:
                 break
@@ -703,18 +1145,19 @@ class Comparer(object):
 
     def l1_exhausted(self):
         while self.f2 is not None:
-            _Event = (FamSingleton if self.f2.is_singleton()
-                      else FamNovel)
-            self.comp.addFamily(_Event(self.f2.getFamId()))
+            event = ('singleton' if self.f2.is_singleton(self.singletons)
+                     else 'novel')
+            self.comp.add(self.f2.getFamId(), event)
             self.advance_i2()
 
     def l2_exhausted(self):
         while self.f1 is not None:
-            self.comp.addFamily(FamLost(self.f1.getFamId()))
+            self.comp.add(self.f1.getFamId(), 'lost')
             self.advance_i1()
 
 
 class FamEvent(object):
+    __slots__ = ('fam',)
     event = None
 
     def __init__(self, fam):
@@ -731,37 +1174,68 @@ class FamEvent(object):
 
 
 class FamIdent(FamEvent):
+    __slots__ = ()
     event = "identical"
 
 
 class FamNovel(FamEvent):
+    __slots__ = ()
     event = "novel"
 
 
 class FamLost(FamEvent):
+    __slots__ = ()
     event = "lost"
 
 
 class FamSingleton(FamEvent):
     """A single-member 'family' consisting of a gene that doesn't
     match any other family. Only occurs in a leaf."""
+    __slots__ = ()
     event = "singleton"
 
 
 class FamDupl(FamEvent):
+    """`subfamilies' is the list of the LOFT ids of the families the
+    family duplicated into; `into' the same joined by '; '."""
+    __slots__ = ('subfamilies',)
     event = "duplicated"
 
     def __init__(self, fam, subfam):
         super().__init__(fam)
-        if isinstance(subfam, list):
-            subfam = "; ".join(subfam)
-        self.into = subfam
+        if not isinstance(subfam, list):
+            subfam = subfam.split('; ')
+        self.subfamilies = subfam
+
+    @property
+    def into(self):
+        return '; '.join(self.subfamilies)
 
     def __str__(self):
         return "{} --> {}\n".format(self.fam, self.into)
 
     def __eq__(self, other):
-        return super().__eq__(other) and self.into == other.into
+        return (super().__eq__(other) and
+                self.subfamilies == other.subfamilies)
+
+
+class FamEventMapping(Mapping):
+    """read-only mapping LOFT id -> FamEvent of a LevelComparisonResult,
+    in the order the families were added. The FamEvent objects are
+    created on access."""
+
+    def __init__(self, result):
+        self.result = result
+
+    def __getitem__(self, fam):
+        return self.result[fam]
+
+    def __iter__(self):
+        name = self.result._name
+        return (name(code) for code in self.result._fam)
+
+    def __len__(self):
+        return len(self.result._fam)
 
 
 class LevelComparisonResult(object):
@@ -784,12 +1258,21 @@ class LevelComparisonResult(object):
                    3: 'novel',
                    4: 'singleton'}
 
+    event_classes = {0: FamIdent,
+                     2: FamLost,
+                     3: FamNovel,
+                     4: FamSingleton}
+
     @staticmethod
     def sort_key(item):
-        if item.fam == 'n/a':
+        return LevelComparisonResult.fam_sort_key(item.fam)
+
+    @staticmethod
+    def fam_sort_key(fam):
+        if fam == 'n/a':
             return (MAXINT,)
         return tuple((int(num) if num else alpha) for
-                    (num, alpha) in re.findall(r'(\d+)|(\D+)', item.fam))
+                    (num, alpha) in re.findall(r'(\d+)|(\D+)', fam))
 
     def group_sort_key(self, item):
         return tuple(itertools.chain((self.group_key(item),),
@@ -799,9 +1282,32 @@ class LevelComparisonResult(object):
         return self.groups[item.event]
 
     def __init__(self, lev1, lev2):
-        self.fams_dict = dict()
+        """the events are stored column-wise, one row per family: the
+        code of its LOFT id, the event code (see `groups') and, for
+        duplications, the codes of the subfamilies in
+        _into[_into_start[row]:][:_into_len[row]]. The LOFT ids are
+        kept utf-8 encoded in _names, id `code' ending at
+        _name_end[code]; the mapping LOFT id -> row is only built
+        on lookup.
+        _order lists the rows sorted by `sort_key' and _buckets the
+        positions in _order of the rows of each event code. Both are
+        extended as long as families are added in that order (as the
+        Comparer mostly does), and otherwise rebuilt on next use.
+        _counts are the running counts of `summarise'."""
         self.lev1 = lev1
         self.lev2 = lev2
+        self._names = bytearray()
+        self._name_end = array('i')
+        self._rows = None
+        self._fam = array('i')
+        self._event = array('b')
+        self._into_start = array('i')
+        self._into_len = array('i')
+        self._into = array('i')
+        self._order = array('i')
+        self._buckets = dict((code, array('i')) for code in self.groups_back)
+        self._last_key = None
+        self._counts = dict((code, 0) for code in self.groups_back)
 
     def __str__(self):
         fd = io.StringIO()
@@ -811,17 +1317,132 @@ class LevelComparisonResult(object):
         return res
 
     def __getitem__(self, key):
-        return self.fams_dict[key]
+        row = self._row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self._event_at(row)
+
+    def __contains__(self, key):
+        return self._row(key) >= 0
+
+    def __len__(self):
+        return len(self._fam)
 
     def __iter__(self):
         return iter(self.fams)
 
+    @property
+    def fams_dict(self):
+        return FamEventMapping(self)
+
     @property
     def fams(self):
-        return sorted(self.fams_dict.values(), key=self.sort_key)
+        return [self._event_at(row) for row in self._sorted_rows()]
+
+    def _sorted_rows(self):
+        if self._order is None:
+            name = self._name
+            self._order = array('i', sorted(
+                range(len(self._fam)),
+                key=lambda row: self.fam_sort_key(name(self._fam[row]))))
+            self._buckets = dict((code, array('i'))
+                                 for code in self.groups_back)
+            for pos, row in enumerate(self._order):
+                self._buckets[self._event[row]].append(pos)
+            self._last_key = (self.fam_sort_key(name(self._fam[row]))
+                              if len(self._order) else None)
+        return self._order
+
+    def _count(self, row, sign):
+        event = self._event[row]
+        self._counts[event] += sign * (self._into_len[row]
+                                       if event == self.groups['duplicated']
+                                       else 1)
+
+    def _code(self, fam):
+        self._names.extend(fam.encode('utf-8'))
+        self._name_end.append(len(self._names))
+        return len(self._name_end) - 1
+
+    def _name(self, code):
+        start = self._name_end[code - 1] if code > 0 else 0
+        return self._names[start:self._name_end[code]].decode('utf-8')
+
+    def _row(self, fam):
+        if self._rows is None:
+            self._rows = dict((self._name(code), row)
+                              for row, code in enumerate(self._fam))
+        return self._rows.get(fam, -1)
+
+    def _subfamilies(self, row):
+        start = self._into_start[row]
+        return [self._name(code) for code in
+                self._into[start:start + self._into_len[row]]]
+
+    def _event_at(self, row):
+        event = self._event[row]
+        fam = self._name(self._fam[row])
+        if event == self.groups['duplicated']:
+            return FamDupl(fam, self._subfamilies(row))
+        return self.event_classes[event](fam)
+
+    def add(self, fam, event, subfamilies=()):
+        """records the `event' (a key of `groups') of family `fam';
+        `subfamilies' are the LOFT ids of the families a duplicated
+        family duplicated into. An event added again for the same
+        family replaces the former one if the mapping LOFT id -> row
+        has been built already (as addFamily does) or if it was the
+        last one added, which covers the Comparer's sorted merge."""
+        if self._rows is not None:
+            row = self._row(fam)
+        elif len(self._fam) and self._name(self._fam[-1]) == fam:
+            row = len(self._fam) - 1
+        else:
+            row = -1
+        subcodes = [self._code(sub) for sub in subfamilies]
+        code = self.groups[event]
+        if row < 0:
+            row = len(self._fam)
+            if self._rows is not None:
+                self._rows[fam] = row
+            self._fam.append(self._code(fam))
+            self._event.append(code)
+            self._into_start.append(len(self._into))
+            self._into_len.append(len(subcodes))
+            if self._order is not None:
+                key = self.fam_sort_key(fam)
+                if self._last_key is None or self._last_key <= key:
+                    self._buckets[code].append(len(self._order))
+                    self._order.append(row)
+                    self._last_key = key
+                else:
+                    self._order = None
+        else:
+            self._count(row, -1)
+            if (self._order is not None and len(self._order) and
+                    self._order[-1] == row):
+                self._buckets[self._event[row]].pop()
+                self._buckets[code].append(len(self._order) - 1)
+            else:
+                self._order = None
+            self._event[row] = code
+            self._into_start[row] = len(self._into)
+            self._into_len[row] = len(subcodes)
+        self._into.extend(subcodes)
+        self._count(row, 1)
 
     def addFamily(self, famEvent):
-        self.fams_dict[famEvent.fam] = famEvent
+        self._row(famEvent.fam)
+        self.add(famEvent.fam, famEvent.event,
+                 getattr(famEvent, 'subfamilies', ()))
+
+    def iter_events(self):
+        """yields (LOFT id, event, subfamilies) tuples in the order the
+        families were added, without creating FamEvent objects."""
+        events = self.groups_back
+        for row, code in enumerate(self._fam):
+            yield (self._name(code), events[self._event[row]],
+                   self._subfamilies(row) if self._into_len[row] else [])
 
     def write(self, fd):
         fd.write("\nLevelComparisonResult between taxlevel {} and {}\n".
@@ -830,18 +1451,8 @@ class LevelComparisonResult(object):
             fd.writelines(str(fam))
 
     def summarise(self):
-        summary = {'identical': 0,
-                   'novel': 0,
-                   'lost': 0,
-                   'duplicated': 0,
-                   'singleton': 0}
-
-        for family in self.fams_dict.values():
-            if family.event in ['identical', 'lost', 'singleton', 'novel']:
-                summary[family.event] += 1
-            elif family.event == 'duplicated':
-                summary['duplicated'] += len(family.into.split('; '))
-
+        summary = dict((self.groups_back[code], n)
+                       for code, n in self._counts.items())
         self.summary = summary
         return summary
 
@@ -851,14 +1462,17 @@ class LevelComparisonResult(object):
         if not filters.issubset({'identical', 'lost', 'singleton', 'novel',
                                  'duplicated'}):
             raise Exception('Unexpected filters: {0}'.format(filters))
-        return [x for x in self if x.event in filters]
+        order = self._sorted_rows()
+        positions = heapq.merge(*[self._buckets[self.groups[event]]
+                                  for event in filters])
+        return [self._event_at(order[pos]) for pos in positions]
 
     def group_fams(self):
-        return dict([(self.groups_back[num], list(iterator))
-                     for (num, iterator)
-                     in itertools.groupby(sorted(self.fams_dict.values(),
-                                                 key=self.group_sort_key),
-                                          self.group_key)])
+        order = self._sorted_rows()
+        return dict((self.groups_back[code],
+                     [self._event_at(order[pos]) for pos in positions])
+                    for code, positions in self._buckets.items()
+                    if len(positions))
 
 
 class GroupAnnotator(object):
@@ -893,59 +1507,154 @@ class GroupAnnotator(object):
         letters.append(chr(97 + (nr % 26)))
         return prefix+''.join(letters[::-1])  # letters were in reverse order
 
-    def _annotateGroupR(self, node, og, idx=0):
+    def _annotateGroup(self, fam, og):
         """create the og attributes at the orthologGroup elements
         according to the naming schema of LOFT. ParalogGroup elements
         do not get own attributes (not possible in the xml schema),
         but propagate their sub-names for the subsequent orthologGroup
         elements."""
-        if self.parser.is_ortholog_group(node):
-            node.set('og', og)
-            for child in list(node):
-                self._annotateGroupR(child, og, idx)
-        elif self.parser.is_paralog_group(node):
-            idx += 1
-            nextOG = "{}.{}".format(og, self._getNextSubId(idx))
-            for i, child in enumerate(list(node)):
-                self._annotateGroupR(child,
-                                     self._encodeParalogClusterId(nextOG, i),
-                                     idx)
-
-    def _addTaxRangeR(self, node, noUpwardLevels=False):
-        """recursive method to add TaxRange property tags."""
-        if self.parser.is_ortholog_group(node) or self.parser.is_paralog_group(node) or OrthoXMLQuery.is_geneRef_node(node):
-            species_covered = self.parser.get_species_below_node(node)
-            current_level = self.tax.mrca(species_covered)
-
-            try: # find the closest ancestral orthogroup that has a TaxRange property
-                parent_orthogroup_generator = (n for n in node.iterancestors('{{{}}}orthologGroup'.format(OrthoXMLQuery.ns['ns0']))
-                                               if n[0].tag == '{{{}}}property'.format(OrthoXMLQuery.ns['ns0']))
-                parent_orthogroup = next(parent_orthogroup_generator)
-            except: # couldn't find a parent with a TaxRange property; no extra annotation possible
-                parent_orthogroup = None
-
-            if parent_orthogroup is not None:
-                parent_levels = {z.get('value')
-                                 for z in OrthoXMLQuery.getTaxRangeNodes(parent_orthogroup, False)}
-                most_recent_parent_level = self.tax.mostSpecific(parent_levels)
-
-                # Ortholog Node - append missing tax range(s) as property tags under the current node
-                if self.parser.is_ortholog_group(node):
-                    for level in self.tax.iterParents(current_level, most_recent_parent_level):
+        parser = self.parser
+        propertyTag, geneRefTag = self.propertyTag, self.geneRefTag
+
+        def enter(node, ctx):
+            og, idx = ctx
+            if parser.is_ortholog_group(node):
+                node.set('og', og)
+                children = list(node)
+                # TaxRange properties list the most specific level first
+                levels = [child.get('value') for child in children
+                          if child.tag == propertyTag and
+                          child.get('name') == 'TaxRange']
+                self.geneIndex.enter(og, levels[::-1])
+                return ((child, ctx) for child in children)
+            elif parser.is_paralog_group(node):
+                idx += 1
+                nextOG = "{}.{}".format(og, self._getNextSubId(idx))
+                return ((child,
+                         (self._encodeParalogClusterId(nextOG, i), idx))
+                        for i, child in enumerate(list(node)))
+            elif node.tag == geneRefTag:
+                self.geneIndex.add_gene(node.get('id'))
+
+        def leave(node, ctx, results):
+            if parser.is_ortholog_group(node):
+                self.geneIndex.leave()
+
+        walk(fam, enter, leave, (og, 0))
+
+    def _levelsBelow(self, fam):
+        """returns a dict with the most recent common ancestor of the
+        species below every orthologGroup, paralogGroup and geneRef of
+        `fam'. The genes are flagged as grouped on the way. With numpy
+        the ancestors of all nodes are resolved in one batch query."""
+        if lca.numpy is not None:
+            return self._levelsBelowBatch(fam)
+        parser = self.parser
+        levels = dict()
+
+        def enter(node, ctx):
+            if parser.is_evolutionary_node(node):
+                return ((child, None) for child in node)
+
+        def leave(node, ctx, below):
+            if node.tag == self.geneRefTag:
+                gene = node.get('id')
+                pos = parser._genePos.get(gene)
+                if pos is not None:
+                    self.grouped[pos] = 1
+                species = frozenset((parser.mapGeneToSpecies(gene),))
+            elif parser.is_evolutionary_node(node):
+                species = frozenset().union(*below)
+            else:
+                return frozenset()
+            levels[node] = self.tax.mrca(species)
+            return species
+
+        walk(fam, enter, leave)
+        return levels
+
+    def _levelsBelowBatch(self, fam):
+        """as _levelsBelow, but every node only carries the minimal and
+        maximal preorder rank of the species below it, from which the
+        MRCAIndex of the taxonomy computes all ancestors at once."""
+        parser = self.parser
+        index = self.tax.mrca_index()
+        empty = (len(index), -1)
+        nodes, lo, hi = [], array('i'), array('i')
+
+        def enter(node, ctx):
+            if parser.is_evolutionary_node(node):
+                return ((child, None) for child in node)
+
+        def leave(node, ctx, below):
+            if node.tag == self.geneRefTag:
+                gene = node.get('id')
+                pos = parser._genePos.get(gene)
+                if pos is not None:
+                    self.grouped[pos] = 1
+                rank = index.rank[parser.mapGeneToSpecies(gene)]
+                span = (rank, rank)
+            elif parser.is_evolutionary_node(node):
+                below = [b for b in below if b is not None]
+                span = (min([b[0] for b in below] or (empty[0],)),
+                        max([b[1] for b in below] or (empty[1],)))
+            else:
+                return None
+            nodes.append(node)
+            lo.append(span[0])
+            hi.append(span[1])
+            return span
+
+        walk(fam, enter, leave)
+        names = index.names
+        return dict((node, names[r] if r >= 0 else None) for node, r in
+                    zip(nodes, index.mrca_ranks(lo, hi).tolist()))
+
+    def _mostSpecificTaxRange(self, node):
+        return self.tax.mostSpecific(
+            {z.get('value') for z in OrthoXMLQuery.getTaxRangeNodes(node,
+                                                                    False)})
+
+    def _addTaxRange(self, fam, noUpwardLevels=False):
+        """add the missing TaxRange property tags to the family `fam'.
+        The context passed down is the most specific level of the
+        closest ancestral orthologGroup that has a TaxRange property."""
+        parser = self.parser
+        levels = self._levelsBelow(fam)
+
+        def enter(node, parent_level):
+            if node.tag == self.geneRefTag:
+                # GeneRef Node - insert ortholog node between self and
+                # parent; add all tax range(s) to new parent
+                if parent_level is not None:
+                    self._insertOG(node.getparent(), node, levels[node],
+                                   parent_level, include_self=True)
+                return None
+            if not parser.is_evolutionary_node(node):
+                return None
+            current_level = levels[node]
+            child_level = parent_level
+            if parser.is_ortholog_group(node):
+                # Ortholog Node - append missing tax range(s) as property
+                # tags under the current node
+                if parent_level is not None:
+                    for level in self.tax.iterParents(current_level,
+                                                      parent_level):
                         node.append(self._createTaxRangeTag(level))
-
-                # Paralog Node - insert ortholog node between self and parent; add missing tax range(s) to new parent
-                elif self.parser.is_paralog_group(node):
-                    if self.tax.levels_between(most_recent_parent_level, current_level) > 1:
-                        self._insertOG(node.getparent(), node, current_level, most_recent_parent_level, include_self=False)
-
-                # GeneRef Node - insert ortholog node between self and parent; add all tax range(s) to new parent
-                else:
-                    self._insertOG(node.getparent(), node, current_level, most_recent_parent_level, include_self=True)
-                    return
-
-            for child in node:
-                self._addTaxRangeR(child, noUpwardLevels)
+                if node[0].tag == self.propertyTag:
+                    child_level = self._mostSpecificTaxRange(node)
+            elif parent_level is not None:
+                # Paralog Node - insert ortholog node between self and
+                # parent; add missing tax range(s) to new parent
+                if self.tax.levels_between(parent_level, current_level) > 1:
+                    el = self._insertOG(node.getparent(), node,
+                                        current_level, parent_level,
+                                        include_self=False)
+                    if el[0].tag == self.propertyTag:
+                        child_level = self._mostSpecificTaxRange(el)
+            return ((child, child_level) for child in list(node))
+
+        walk(fam, enter)
 
     def _insertOG(self, parent, child, specificLev, beforeLev,
                   include_self=True):
@@ -957,6 +1666,7 @@ class GroupAnnotator(object):
             el.append(self._createTaxRangeTag(lev))
         el.append(child)
         parent.insert(pos, el)
+        return el
 
     def _createTaxRangeTag(self, lev):
         return etree.Element('{{{ns0}}}property'.format(**self.parser.ns),
@@ -969,69 +1679,116 @@ class GroupAnnotator(object):
         level and the current nodes level. If no parent exists, all
         tax-levels above the current one are used."""
         self.tax = tax
+        self.propertyTag = '{{{ns0}}}property'.format(**self.ns)
+        self.geneRefTag = '{{{ns0}}}geneRef'.format(**self.ns)
+        # genes in groups and the highest family id are recorded on the way
+        self.grouped = bytearray(len(self.parser._geneIds))
+        maxFamilyId = -1
 
-        top_level_groups = self.parser.getToplevelGroups()
+        with phase('augmentTaxonomyInfo') as ph:
+            top_level_groups = self.parser.getToplevelGroups()
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar = setup_progressbar(
-                'Adding missing taxonomy annotation: ',
-                len(top_level_groups)
-                )
-            pbar.start()
-
-        for i, fam in enumerate(top_level_groups, start=1):
-            self._addTaxRangeR(fam, noUpwardLevels=not propagate_top)
             if PROGRESSBAR and verbosity > 0:
-                pbar.update(i)
-
-        if PROGRESSBAR and verbosity > 0:
-            pbar.finish()
+                pbar = setup_progressbar(
+                    'Adding missing taxonomy annotation: ',
+                    len(top_level_groups)
+                    )
+                pbar.start()
+
+            for i, fam in enumerate(top_level_groups, start=1):
+                self._addTaxRange(fam, noUpwardLevels=not propagate_top)
+                # families without id are numbered by position, as in
+                # annotateDoc
+                try:
+                    maxFamilyId = max(maxFamilyId,
+                                      int(fam.get('id', str(i - 1))))
+                except ValueError:
+                    pass
+                if PROGRESSBAR and verbosity > 0:
+                    pbar.update(i)
 
-        del self.tax
+            if PROGRESSBAR and verbosity > 0:
+                pbar.finish()
+            ph.count(len(top_level_groups))
+
+        self.parser._grouped = self.grouped
+        self.parser._maxFamilyId = maxFamilyId
+        del self.tax, self.grouped
+
+    def startAnnotation(self, genes=()):
+        """prepares the LOFT annotation of families with
+        annotateFamily. The lineages of the genes are collected in the
+        GeneIndexBuilder `geneIndex'."""
+        self.propertyTag = '{{{ns0}}}property'.format(**self.ns)
+        self.geneRefTag = '{{{ns0}}}geneRef'.format(**self.ns)
+        self.geneIndex = GeneIndexBuilder(genes)
+
+    def annotateFamily(self, fam, i):
+        """apply the LOFT naming schema to a toplevel orthologGroup.
+        `i' is used as its id if the element has none."""
+        self.dupCnt = list()
+        self._annotateGroup(fam, fam.get('id', str(i)))
 
     def annotateDoc(self):
-        """apply the LOFT naming schema to all the orthologGroups."""
-        for i, fam in enumerate(self.parser.getToplevelGroups()):
-            self.dupCnt = list()
-            self._annotateGroupR(fam, fam.get('id', str(i)))
+        """apply the LOFT naming schema to all the orthologGroups. The
+        family lineages of all genes are collected on the way and
+        stored as GeneIndex in the parser."""
+        self.startAnnotation(self.parser._gene2species)
+        with phase('annotateDoc') as ph:
+            for i, fam in enumerate(self.parser.getToplevelGroups()):
+                self.annotateFamily(fam, i)
+                ph.count()
+        self.parser._geneIndex = (self.geneIndex.build(),
+                                  self.parser._groupsVersion)
+        self.parser.annotation.loft = True
+        del self.geneIndex
 
     def annotateSingletons(self, verbosity=0):
         """Any input genes that aren't assigned to ortholog groups are
         singletons, which are added to the xml as extra ortholog groups"""
-        if PROGRESSBAR and verbosity > 0:
-            pbar = setup_progressbar('Adding singletons: ', 1)
-            pbar.start()
-
-        highest_group = max(self.parser.getToplevelGroups(),
-                            key=lambda x: int(x.get('id'))) # TODO: If top-level orthologNodes have no id field this errors out
-        input_genes = set(n.get('id') for n in              # Maybe add code to enumerate OG nodes if ids are missing?
-                          OrthoXMLQuery.getInputGenes(self.parser.root))
-        grouped_genes = set(n.get('id') for n in
-                            OrthoXMLQuery.getGroupedGenes(self.parser.root))
-        singletons = input_genes - grouped_genes
-        groups_node = OrthoXMLQuery.getSubNodes('groups', self.parser.root)[0]
-
-        fam_num = int(highest_group.get('id')) + 1
-        singleton_families = set()
-
-        if PROGRESSBAR and verbosity > 0:
-            pbar.maxval = len(singletons)
-
-        for i, gene in enumerate(sorted(singletons), start=1):
-            singleton_families.add(str(fam_num))
-            species = self.parser.mapGeneToSpecies(gene)
-            new_node = etree.Element('{{{ns0}}}orthologGroup'.format(
-                                                            **self.parser.ns),
-                                                            id=str(fam_num))
-            new_node.append(self._createTaxRangeTag(species))
-            new_node.append(etree.Element('{{{ns0}}}geneRef'.format(
-                                                            **self.parser.ns),
-                                                            id=gene))
-            groups_node.append(new_node)
-            fam_num += 1
-            if PROGRESSBAR and verbosity > 0:
-                pbar.update(i)
-
-        self.parser.singletons = singleton_families
-        if PROGRESSBAR and verbosity > 0:
-            pbar.finish()
+        with phase('annotateSingletons') as ph:
+            parser = self.parser
+            grouped = parser._groupedGenes()
+            singletons = []
+            pos = grouped.find(0)
+            while pos >= 0:
+                singletons.append(parser._geneIds[pos])
+                pos = grouped.find(0, pos + 1)
+            singletons.sort()
+            groups_node = OrthoXMLQuery.getSubNodes('groups', parser.root)[0]
+
+            if parser._maxFamilyId is None:
+                # families without id are numbered by position, as in
+                # annotateDoc
+                ids = (fam.get('id', str(i)) for i, fam in
+                       enumerate(parser.getToplevelGroups()))
+                parser._maxFamilyId = max(
+                    [int(id_) for id_ in ids if id_.isdigit()] or [-1])
+            fam_num = parser._maxFamilyId + 1
+
+            # LOFT ids are set directly if the document is annotated
+            og = ' og="{0}"' if parser.isLoftAnnotated() else ''
+            template = ('<orthologGroup id="{0}"' + og + '><property '
+                        'name="TaxRange" value={1}/><geneRef id={2}/>'
+                        '</orthologGroup>')
+            species = [parser.mapGeneToSpecies(gene) for gene in singletons]
+            fragment = ['<groups xmlns={}>'.format(quoteattr(self.ns['ns0']))]
+            fragment.extend(template.format(fam_num + i, quoteattr(spec),
+                                            quoteattr(gene))
+                            for i, (gene, spec) in enumerate(zip(singletons,
+                                                                 species)))
+            fragment.append('</groups>')
+            new_nodes = list(etree.fromstring(''.join(fragment)))
+            groups_node.extend(new_nodes)
+
+            singletonGroups = collections.defaultdict(list)
+            for spec, node in zip(species, new_nodes):
+                singletonGroups[spec].append(node)
+            parser._singletonGroups = singletonGroups
+            parser._maxFamilyId = fam_num + len(singletons) - 1
+            grouped[:] = b'\x01' * len(grouped)
+            state = parser.annotation
+            if singletons or state.singletons is None:
+                state.singletons = (fam_num, fam_num + len(singletons))
+            parser.singletons = state.singleton_families()
+            ph.count(len(singletons))
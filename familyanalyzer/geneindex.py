@@ -0,0 +1,192 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Index of the family lineage of every gene: for each gene, the LOFT
+#  id of the orthologGroup containing it at every TaxRange level, from
+#  the root to the leaf. The index is filled during the LOFT annotation
+#  of the document and stored in compressed-row form as integer arrays.
+#
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class GeneIndexBuilder(object):
+    """collects the lineages while the document is traversed. The
+    traversal calls enter() for every orthologGroup, add_gene() for
+    every geneRef and leave() when the orthologGroup is done."""
+
+    def __init__(self, genes=()):
+        self.genes = list(genes)
+        self.gene_pos = dict((g, i) for i, g in enumerate(self.genes))
+        self.levels, self.level_pos = [], dict()
+        self.lofts = []
+        self.rows = array('i', [-1]) * len(self.genes)
+        self.ptr = array('i', [0])
+        self.level_ids = array('i')
+        self.loft_ids = array('i')
+        self._stack_levels = array('i')
+        self._stack_lofts = array('i')
+        self._frames = []
+
+    def enter(self, og, levels):
+        """`levels' are the TaxRange values of the group, oldest first."""
+        loft = len(self.lofts)
+        self.lofts.append(og)
+        for level in levels:
+            lid = self.level_pos.get(level)
+            if lid is None:
+                lid = self.level_pos[level] = len(self.levels)
+                self.levels.append(level)
+            self._stack_levels.append(lid)
+            self._stack_lofts.append(loft)
+        self._frames.append(len(levels))
+
+    def leave(self):
+        n = self._frames.pop()
+        if n:
+            del self._stack_levels[-n:]
+            del self._stack_lofts[-n:]
+
+    def add_gene(self, gene):
+        pos = self.gene_pos.get(gene)
+        if pos is None:
+            pos = self.gene_pos[gene] = len(self.genes)
+            self.genes.append(gene)
+            self.rows.append(-1)
+        if self.rows[pos] >= 0:
+            # a gene is referenced once; further references are ignored
+            return
+        self.rows[pos] = len(self.ptr) - 1
+        self.level_ids.extend(self._stack_levels)
+        self.loft_ids.extend(self._stack_lofts)
+        self.ptr.append(len(self.level_ids))
+
+    def build(self):
+        return GeneIndex(self.genes, self.levels, self.lofts, self.rows,
+                         self.ptr, self.level_ids, self.loft_ids)
+
+
+class GeneIndex(object):
+    """GeneIndex(genes, levels, lofts, rows, ptr, level_ids, loft_ids)
+
+    Lineage of gene `genes[i]' are the entries ptr[rows[i]] to
+    ptr[rows[i]+1] of level_ids/loft_ids, which index into `levels'
+    and `lofts'. rows[i] is -1 for genes not in any group.
+    Usually obtained with OrthoXMLParser.getGeneIndex()."""
+
+    def __init__(self, genes, levels, lofts, rows, ptr, level_ids, loft_ids):
+        self.genes = genes
+        self.levels = levels
+        self.lofts = lofts
+        self.rows = rows
+        self.ptr = ptr
+        self.level_ids = level_ids
+        self.loft_ids = loft_ids
+        self.gene_pos = dict((g, i) for i, g in enumerate(genes))
+        self.level_pos = dict((lev, i) for i, lev in enumerate(levels))
+        self._columns = dict()
+        self._entry_rows = None
+
+    def __len__(self):
+        return len(self.genes)
+
+    def __contains__(self, gene):
+        return gene in self.gene_pos
+
+    def _row(self, gene):
+        try:
+            return self.rows[self.gene_pos[gene]]
+        except KeyError:
+            raise KeyError('unknown gene: {}'.format(gene))
+
+    def lineage(self, gene):
+        """list of (level, LOFT id) of the groups containing `gene',
+        from the root to the leaf."""
+        row = self._row(gene)
+        if row < 0:
+            return []
+        start, end = self.ptr[row], self.ptr[row + 1]
+        return [(self.levels[self.level_ids[i]], self.lofts[self.loft_ids[i]])
+                for i in range(start, end)]
+
+    def family_at(self, gene, level):
+        """LOFT id of the family of `gene' at `level' or None."""
+        row = self._row(gene)
+        lid = self.level_pos.get(level)
+        if row < 0 or lid is None:
+            return None
+        for i in range(self.ptr[row], self.ptr[row + 1]):
+            if self.level_ids[i] == lid:
+                return self.lofts[self.loft_ids[i]]
+        return None
+
+    def positions(self, genes):
+        """index positions of `genes' (-1 for unknown genes); an integer
+        numpy array if numpy is available."""
+        pos = [self.gene_pos.get(g, -1) for g in genes]
+        return numpy.array(pos, dtype=numpy.int64) if numpy else pos
+
+    def _column(self, level):
+        """LOFT code of every row at `level' (-1: none), computed once
+        per level."""
+        column = self._columns.get(level)
+        if column is None:
+            nrows = len(self.ptr) - 1
+            lid = self.level_pos.get(level, -1)
+            if numpy is not None:
+                if self._entry_rows is None:
+                    self._entry_rows = numpy.repeat(
+                        numpy.arange(nrows, dtype=numpy.int32),
+                        numpy.diff(numpy.frombuffer(self.ptr,
+                                                    dtype=numpy.int32)))
+                mask = numpy.frombuffer(self.level_ids,
+                                        dtype=numpy.int32) == lid
+                column = numpy.full(nrows, -1, dtype=numpy.int32)
+                column[self._entry_rows[mask]] = numpy.frombuffer(
+                    self.loft_ids, dtype=numpy.int32)[mask]
+            else:
+                column = array('i', [-1]) * nrows
+                row = 0
+                for i, level_id in enumerate(self.level_ids):
+                    while self.ptr[row + 1] <= i:
+                        row += 1
+                    if level_id == lid:
+                        column[row] = self.loft_ids[i]
+            self._columns[level] = column
+        return column
+
+    def codes_at(self, level, positions):
+        """LOFT codes (indices into `lofts', -1: none) at `level' of the
+        genes at `positions' (see positions())."""
+        column = self._column(level)
+        if numpy is not None:
+            positions = numpy.asarray(positions, dtype=numpy.int64)
+            rows = numpy.frombuffer(self.rows, dtype=numpy.int32)
+            valid = positions >= 0
+            found = rows[positions[valid]]
+            hit = found >= 0
+            sub = numpy.full(len(found), -1, dtype=numpy.int32)
+            sub[hit] = column[found[hit]]
+            codes = numpy.full(len(positions), -1, dtype=numpy.int32)
+            codes[valid] = sub
+            return codes
+        codes = []
+        for pos in positions:
+            row = self.rows[pos] if pos >= 0 else -1
+            codes.append(column[row] if row >= 0 else -1)
+        return codes
+
+    def families_at(self, level, genes):
+        """LOFT ids (None if not in a family) at `level' of all `genes'."""
+        lofts = self.lofts
+        return [lofts[c] if c >= 0 else None
+                for c in self.codes_at(level, self.positions(genes))]
@@ -7,6 +7,7 @@ from future import standard_library
 standard_library.install_hooks()
 import re
 from .tools import PROGRESSBAR, setup_progressbar
+from .profiling import phase
 
 
 class GeneTreeNodeException(Exception):
@@ -26,6 +27,12 @@ class GeneTree(object):
     def write(self, NHX=True):
         return self.root.write(NHX) + ';'
 
+    def write_topology(self, losses=False):
+        """returns the topology of the tree in newick format with only
+        the leaves labeled. Loss nodes are dropped unless `losses' is
+        set; inner nodes left with a single child are suppressed."""
+        return (self.root.write_topology(losses) or '') + ';'
+
 
 class GeneTreeNode(object):
 
@@ -126,6 +133,19 @@ class GeneTreeNode(object):
             node._invert()
         return self
 
+    def write_topology(self, losses=False):
+        if self.node_type == 'loss' and not losses:
+            return None
+        if self.is_leaf():
+            name = self.name
+            return '"{0}"'.format(name) if self.reg.search(name) else name
+        subtrees = [sub for sub in (child.write_topology(losses)
+                                    for child in self.children)
+                    if sub is not None]
+        if len(subtrees) <= 1:
+            return subtrees[0] if subtrees else None
+        return '({0})'.format(', '.join(subtrees))
+
     def write(self, NHX=True):
         name = self.name
         if self.reg.search(name):
@@ -163,21 +183,23 @@ class GeneTreeTracer(object):
         return sorted(job_list, key=lambda x: x[1])
 
     def trace_gene_families(self, add_genelists=False, verbosity=0):
-        job_list = self._get_job_list(add_genelists)
+        with phase('GeneTreeTracer') as ph:
+            job_list = self._get_job_list(add_genelists)
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar = setup_progressbar('Extracting {0} genetrees: '
-                                     .format(len(job_list)), len(job_list))
-            pbar.start()
-
-        for i, job in enumerate(job_list, start=1):
-            self.trace_gene_family(*job)
-            self._reset_counters()
             if PROGRESSBAR and verbosity > 0:
-                pbar.update(i)
+                pbar = setup_progressbar('Extracting {0} genetrees: '
+                                         .format(len(job_list)), len(job_list))
+                pbar.start()
+
+            for i, job in enumerate(job_list, start=1):
+                self.trace_gene_family(*job)
+                self._reset_counters()
+                if PROGRESSBAR and verbosity > 0:
+                    pbar.update(i)
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar.finish()
+            if PROGRESSBAR and verbosity > 0:
+                pbar.finish()
+            ph.count(len(job_list))
 
     def _create_parent(self, name, node_type, level):
         parent = GeneTreeNode(name, node_type, level)
@@ -250,7 +272,7 @@ class GeneTreeTracer(object):
                 parent.add_child(dup)
                 if add_genelists:
                     dup.genes = list()
-                for dup_id in comparison.into.split('; '):
+                for dup_id in comparison.subfamilies:
                     next_fam = child.history[dup_id]
                     if child.is_leaf():
                         gene = next_fam.getMemberGenes()[0]
@@ -0,0 +1,139 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Batch most recent common ancestor queries on a taxonomy. The nodes
+#  are numbered in preorder and the Euler tour of the tree is stored as
+#  the preorder ranks of the visited nodes. The common ancestor of two
+#  nodes is the node of minimal rank between their first occurrences in
+#  the tour, which a sparse table answers in constant time; the common
+#  ancestor of a set of species is the one of its species with minimal
+#  and maximal rank. All queries of a batch are answered with a few
+#  numpy operations.
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class LCAError(Exception):
+    pass
+
+
+def _require(module, name):
+    if module is None:
+        raise LCAError('{} is required for batch MRCA queries'.format(name))
+
+
+class MRCAIndex(object):
+    """MRCAIndex(tax)
+
+    Euler tour and sparse table of the Taxonomy `tax'. Nodes are
+    identified by their preorder rank; names[rank] is the name of a node
+    and rank[name] its rank."""
+
+    def __init__(self, tax):
+        _require(numpy, 'numpy')
+        self.names = []
+        self.rank = dict()
+        tour = []
+        stack = [(tax.hierarchy[tax.root], 0)]
+        while stack:
+            node, i = stack.pop()
+            if i == 0:
+                self.rank[node.name] = len(self.names)
+                self.names.append(node.name)
+            tour.append(self.rank[node.name])
+            if i < len(node.down):
+                stack.append((node, i + 1))
+                stack.append((node.down[i], 0))
+        tour = numpy.array(tour, dtype=numpy.int32)
+        self.first = numpy.full(len(self.names), len(tour), dtype=numpy.int64)
+        numpy.minimum.at(self.first, tour, numpy.arange(len(tour)))
+        self.table = [tour]
+        width = 1
+        while 2 * width <= len(tour):
+            prev = self.table[-1]
+            self.table.append(numpy.minimum(prev[:-width], prev[width:]))
+            width *= 2
+
+    def __len__(self):
+        return len(self.names)
+
+    def ranks(self, names):
+        """preorder ranks of the nodes `names'."""
+        rank = self.rank
+        return numpy.fromiter((rank[name] for name in names),
+                              dtype=numpy.int64)
+
+    def lca(self, a, b):
+        """ranks of the lowest common ancestors of the nodes with ranks
+        `a' and `b' (arrays of the same length)."""
+        fa = self.first[numpy.asarray(a, dtype=numpy.int64)]
+        fb = self.first[numpy.asarray(b, dtype=numpy.int64)]
+        lo = numpy.minimum(fa, fb)
+        hi = numpy.maximum(fa, fb)
+        res = numpy.empty(len(lo), dtype=numpy.int64)
+        if not len(lo):
+            return res
+        k = numpy.log2(hi - lo + 1).astype(numpy.int64)
+        for level in numpy.unique(k):
+            sel = numpy.flatnonzero(k == level)
+            table = self.table[level]
+            res[sel] = numpy.minimum(table[lo[sel]],
+                                     table[hi[sel] - (1 << level) + 1])
+        return res
+
+    def mrca_ranks(self, lo, hi):
+        """ranks of the MRCAs of sets of species given by their minimal
+        (`lo') and maximal (`hi') preorder ranks; -1 marks empty sets,
+        i.e. entries with lo > hi."""
+        lo = numpy.asarray(lo, dtype=numpy.int64)
+        hi = numpy.asarray(hi, dtype=numpy.int64)
+        res = numpy.full(len(lo), -1, dtype=numpy.int64)
+        valid = numpy.flatnonzero(lo <= hi)
+        res[valid] = self.lca(lo[valid], hi[valid])
+        return res
+
+    def mrca_csr(self, indptr, indices):
+        """ranks of the MRCAs of the sets of species
+        indices[indptr[i]:indptr[i+1]], the species given by their
+        preorder ranks."""
+        indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        indices = numpy.asarray(indices, dtype=numpy.int64)[:indptr[-1]]
+        nsets = len(indptr) - 1
+        lo = numpy.full(nsets, len(self.names), dtype=numpy.int64)
+        hi = numpy.full(nsets, -1, dtype=numpy.int64)
+        nonempty = numpy.flatnonzero(indptr[1:] > indptr[:-1])
+        if len(nonempty):
+            starts = indptr[nonempty]
+            lo[nonempty] = numpy.minimum.reduceat(indices, starts)
+            hi[nonempty] = numpy.maximum.reduceat(indices, starts)
+        return self.mrca_ranks(lo, hi)
+
+    def mrca_bitmask(self, masks, species):
+        """ranks of the MRCAs of the rows of the boolean matrix `masks'
+        (sets x species); column j stands for the species `species[j]'."""
+        masks = numpy.asarray(masks, dtype=bool)
+        cols = self.ranks(species)
+        lo = numpy.where(masks, cols, len(self.names)).min(axis=1)
+        hi = numpy.where(masks, cols, -1).max(axis=1)
+        return self.mrca_ranks(lo, hi)
+
+    def mrca(self, species_sets):
+        """names of the MRCAs of the iterables of species names
+        `species_sets'; None for empty sets."""
+        indptr, indices = [0], []
+        rank = self.rank
+        for species in species_sets:
+            indices.extend(rank[s] for s in species)
+            indptr.append(len(indices))
+        names = self.names
+        return [names[r] if r >= 0 else None
+                for r in self.mrca_csr(indptr, indices).tolist()]
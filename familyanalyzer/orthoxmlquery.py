@@ -58,6 +58,14 @@ class OrthoXMLQuery(object):
                   format(cls.ns['ns0'], level))
         return root.findall(xquery)
 
+    @classmethod
+    def iterGroupsAtLevel(cls, level, root):
+        """as getGroupsAtLevel, but yields the orthologGroup elements
+        while the document is searched."""
+        xquery = (".//{{{0}}}property[@name='TaxRange'][@value='{1}']/..".
+                  format(cls.ns['ns0'], level))
+        return root.iterfind(xquery)
+
     @classmethod
     def getSubNodes(cls, targetNode, root, recursively=True):
         """method which returns a list of all (if recursively
@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Phylostratigraphy: for each gene report the taxonomic level at which
+#  the gene family it belongs to has been founded, i.e. the level of
+#  the toplevel orthologGroup containing the gene.
+#
+from .orthoxmlquery import OrthoXMLQuery
+
+NOT_FOUND = 'ERROR: gene not found'
+HEADER = '"Gene","Species","Level of first common ancestor"\n'
+
+
+class Phylostratigrapher(object):
+    """Resolves the phylostratum of genes given by an xref (by default
+    the protId). The lookup tables are built in one pass over the
+    species and groups sections, afterwards every gene is resolved
+    with two dictionary lookups."""
+
+    def __init__(self, parser, xreftag='protId'):
+        self.parser = parser
+        self.xreftag = xreftag
+        self._xref2gene = dict()
+        for (gid, typ), xref in parser._xrefs.items():
+            if typ == xreftag:
+                # keep the first gene in document order like a xpath query
+                self._xref2gene.setdefault(xref, gid)
+        self._buildFamilyIndex()
+
+    def _buildFamilyIndex(self):
+        """maps every grouped gene onto the level of its toplevel
+        orthologGroup."""
+        propertyTag = '{{{ns0}}}property'.format(**OrthoXMLQuery.ns)
+        geneRefTag = '{{{ns0}}}geneRef'.format(**OrthoXMLQuery.ns)
+        self._gene2level = dict()
+        for fam in self.parser.getToplevelGroups():
+            level = None
+            genes = []
+            for node in fam.iter(propertyTag, geneRefTag):
+                if node.tag == geneRefTag:
+                    genes.append(node.get('id'))
+                elif level is None:
+                    level = node.get('value')
+            for gid in genes:
+                self._gene2level.setdefault(gid, level)
+
+    def origin(self, xref):
+        """returns a tuple (species, level) for the gene with the given
+        xref, or None if no such gene exists. Ungrouped genes have their
+        own species as level."""
+        gid = self._xref2gene.get(xref)
+        if gid is None:
+            return None
+        species = self.parser.mapGeneToSpecies(gid)
+        level = self._gene2level.get(gid, species)
+        if level is None:
+            # toplevel group without any TaxRange annotation
+            raise ValueError('family of gene {} has no TaxRange property'
+                             .format(xref))
+        return species, level
+
+    def all_xrefs(self):
+        """iterates over the xrefs of all genes in document order."""
+        seen = set()
+        for (gid, typ), xref in self.parser._xrefs.items():
+            if typ == self.xreftag and xref not in seen:
+                seen.add(xref)
+                yield xref
+
+    def iter_origins(self, xrefs):
+        """lazily yields (xref, species, level) for a stream of xrefs.
+        species and level are None for unknown genes."""
+        for xref in xrefs:
+            res = self.origin(xref)
+            if res is None:
+                yield xref, None, None
+            else:
+                yield (xref,) + res
+
+    def write(self, fd, xrefs):
+        """writes the phylostrata of `xrefs' as csv to `fd'."""
+        fd.write(HEADER)
+        for xref, species, level in self.iter_origins(xrefs):
+            if species is None:
+                species = level = NOT_FOUND
+            fd.write('"{}","{}","{}"\n'.format(xref, species, level))
+
+
+def read_genelist(fd):
+    """lazily yields the genes of a gene list file, one per line."""
+    for line in fd:
+        yield line.replace('\n', '').replace('"', "'")
@@ -0,0 +1,278 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Phylogenetic profiles: the presence/absence pattern of every family
+#  across the species, stored as a bit-packed numpy matrix (families x
+#  species, eight species per byte). Profiles are compared by counting
+#  the bits of their intersection and symmetric difference (Jaccard
+#  similarity and Hamming distance). For large numbers of families a
+#  MinHash signature of every profile is split into bands; families
+#  sharing a band are candidate neighbours, so a top-k query only scores
+#  the candidates instead of every family.
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ProfileError(Exception):
+    pass
+
+
+def _require(module, name):
+    if module is None:
+        raise ProfileError('{} is required for phylogenetic profiles'
+                           .format(name))
+
+
+def popcount(bits):
+    """number of set bits along the last axis of the uint8 array
+    `bits'."""
+    if hasattr(numpy, 'bitwise_count'):
+        counts = numpy.bitwise_count(bits)
+    else:
+        counts = _POPCOUNT[bits]
+    return counts.sum(axis=-1, dtype=numpy.int64)
+
+
+_POPCOUNT = (numpy.array([bin(i).count('1') for i in range(256)],
+                         dtype=numpy.uint8) if numpy is not None else None)
+
+
+class PhyloProfiles(object):
+    """PhyloProfiles(families, species, bits)
+
+    presence/absence of the `species' in the `families'; row i of the
+    uint8 matrix `bits' is the bit-packed profile of families[i], the
+    species j being bit j (most significant bit first)."""
+
+    # rows compared at once when scanning all profiles
+    chunk_rows = 1 << 16
+
+    def __init__(self, families, species, bits):
+        _require(numpy, 'numpy')
+        self.families = list(families)
+        self.species = list(species)
+        self.bits = bits
+        self.counts = popcount(bits)
+        self._pos = None
+
+    def __len__(self):
+        return len(self.families)
+
+    @classmethod
+    def from_pairs(cls, families, species, fam_idx, species_idx):
+        """builds the matrix from the (family, species) index pairs
+        `fam_idx', `species_idx' of the genes."""
+        _require(numpy, 'numpy')
+        fam_idx = numpy.asarray(fam_idx, dtype=numpy.int64)
+        species_idx = numpy.asarray(species_idx, dtype=numpy.int64)
+        bits = numpy.zeros((len(families), (len(species) + 7) // 8),
+                           dtype=numpy.uint8)
+        numpy.bitwise_or.at(bits, (fam_idx, species_idx >> 3),
+                            (128 >> (species_idx & 7)).astype(numpy.uint8))
+        return cls(families, species, bits)
+
+    @classmethod
+    def from_history(cls, history):
+        """profiles of the families of the analyzed FamHistory
+        `history', keyed by their LOFT ids."""
+        parser = history.parser
+        species = sorted(parser.getSpeciesSet())
+        species_pos = dict((s, i) for i, s in enumerate(species))
+        families, fam_idx, species_idx = [], [], []
+        for fam in history.geneFamList:
+            for gene in fam.getMemberGenes():
+                fam_idx.append(len(families))
+                species_idx.append(species_pos[parser.mapGeneToSpecies(gene)])
+            families.append(fam.getFamId())
+        return cls.from_pairs(families, species, fam_idx, species_idx)
+
+    @classmethod
+    def from_hogs(cls, hogs, level=None):
+        """profiles of the toplevel families of the CompactHOGs `hogs',
+        or of their orthologGroups at `level', in one vectorized pass
+        over the gene arrays."""
+        nodes = numpy.asarray(hogs.getToplevelGroups() if level is None
+                              else hogs.getSubFamilies(level),
+                              dtype=numpy.int64)
+        starts, ends = nodes, hogs.end[nodes].astype(numpy.int64)
+        sizes = ends - starts
+        fam_idx = numpy.repeat(numpy.arange(len(nodes)), sizes)
+        offsets = numpy.repeat(ends - sizes.cumsum(), sizes)
+        positions = numpy.arange(sizes.sum()) + offsets
+        genes = hogs.gene[positions]
+        keep = genes >= 0
+        return cls.from_pairs([hogs.getFamId(n) for n in nodes.tolist()],
+                              list(hogs.species), fam_idx[keep],
+                              hogs.gene_species[genes[keep]])
+
+    def index(self, family):
+        if self._pos is None:
+            self._pos = dict((f, i) for i, f in enumerate(self.families))
+        return self._pos[family]
+
+    def profile(self, family):
+        """names of the species present in `family'."""
+        row = numpy.unpackbits(self.bits[self.index(family)],
+                               count=len(self.species))
+        return [self.species[j] for j in numpy.flatnonzero(row)]
+
+    def _query_bits(self, query):
+        if isinstance(query, numpy.ndarray):
+            return query
+        return self.bits[self.index(query)]
+
+    def scores(self, query, rows=None, metric='jaccard'):
+        """Jaccard similarity or Hamming distance of the profile `query'
+        (a family or a packed profile row) to the profiles `rows' (all
+        by default). The Jaccard similarity of two empty profiles is 0."""
+        if metric not in ('jaccard', 'hamming'):
+            raise ProfileError('Unknown metric: {}'.format(metric))
+        q = self._query_bits(query)
+        qcount = popcount(q)
+        if rows is None:
+            rows = numpy.arange(len(self))
+        res = numpy.empty(len(rows),
+                          dtype=numpy.float64 if metric == 'jaccard'
+                          else numpy.int64)
+        for start in range(0, len(rows), self.chunk_rows):
+            sel = rows[start:start + self.chunk_rows]
+            inter = popcount(self.bits[sel] & q)
+            union = self.counts[sel] + qcount - inter
+            if metric == 'hamming':
+                res[start:start + len(sel)] = union - inter
+            else:
+                res[start:start + len(sel)] = numpy.where(
+                    union > 0, inter / numpy.maximum(union, 1), 0.)
+        return res
+
+    def jaccard(self, fam1, fam2):
+        return float(self.scores(fam1, [self.index(fam2)])[0])
+
+    def hamming(self, fam1, fam2):
+        return int(self.scores(fam1, [self.index(fam2)], 'hamming')[0])
+
+    def _top(self, query, rows, k, metric):
+        rows = numpy.sort(numpy.asarray(rows, dtype=numpy.int64))
+        if isinstance(query, numpy.ndarray):
+            exclude = -1
+        else:
+            exclude = self.index(query)
+        rows = rows[rows != exclude]
+        if k <= 0:
+            return []
+        scores = self.scores(query, rows, metric)
+        order_key = -scores if metric == 'jaccard' else scores
+        if len(rows) > k:
+            # ties at the k-th score are broken by the row, as in a sort
+            kth = numpy.partition(order_key, k - 1)[k - 1]
+            better = numpy.flatnonzero(order_key < kth)
+            ties = numpy.flatnonzero(order_key == kth)[:k - len(better)]
+            part = numpy.concatenate((better, ties))
+            rows, scores, order_key = rows[part], scores[part], order_key[part]
+        order = numpy.lexsort((rows, order_key))
+        return [(self.families[r], s) for r, s in
+                zip(rows[order].tolist(), scores[order].tolist())]
+
+    def nearest(self, query, k=10, metric='jaccard'):
+        """the `k' families most similar to `query' by comparing it
+        with all profiles, as (family, score) pairs, best first."""
+        return self._top(query, numpy.arange(len(self)), k, metric)
+
+
+class MinHashIndex(object):
+    """MinHashIndex(profiles, num_perm=64, bands=16, seed=0)
+
+    locality sensitive hashing index of PhyloProfiles. The signature of
+    a profile holds, for each of `num_perm' random permutations of the
+    species, the first present species; it is split into `bands' bands
+    and families with an identical band are stored in the same bucket.
+    Families whose Jaccard similarity exceeds about
+    (1/bands)**(bands/num_perm) are likely to share a bucket."""
+
+    def __init__(self, profiles, num_perm=64, bands=16, seed=0):
+        if num_perm % bands:
+            raise ProfileError('num_perm must be a multiple of bands')
+        self.profiles = profiles
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        rng = numpy.random.RandomState(seed)
+        self.perms = numpy.array([rng.permutation(len(profiles.species))
+                                  for _ in range(num_perm)])
+        self.signatures = self.signature(profiles.bits)
+        # buckets of every band as compressed rows: the families of
+        # bucket b are members[band][ptr[band][b]:ptr[band][b + 1]] and
+        # its band is keys[band][b] (sorted)
+        self.keys, self.bucket_of, self.members, self.ptr = [], [], [], []
+        for band in range(bands):
+            keys = self._band_keys(self.signatures, band)
+            uniq, inverse = numpy.unique(keys, return_inverse=True)
+            inverse = inverse.ravel()
+            members = numpy.argsort(inverse, kind='stable')
+            ptr = numpy.zeros(inverse.max() + 2 if len(inverse) else 1,
+                              dtype=numpy.int64)
+            numpy.cumsum(numpy.bincount(inverse), out=ptr[1:])
+            self.keys.append(uniq)
+            self.bucket_of.append(inverse)
+            self.members.append(members)
+            self.ptr.append(ptr)
+
+    def signature(self, bits):
+        """MinHash signatures of the packed profile rows `bits'; empty
+        profiles get the number of species in every position."""
+        bits = numpy.atleast_2d(bits)
+        nspecies = len(self.profiles.species)
+        sig = numpy.empty((len(bits), len(self.perms)), dtype=numpy.int32)
+        step = self.profiles.chunk_rows
+        for start in range(0, len(bits), step):
+            present = numpy.unpackbits(bits[start:start + step], axis=1,
+                                       count=nspecies).astype(bool)
+            empty = ~present.any(axis=1)
+            for p, perm in enumerate(self.perms):
+                first = present[:, perm].argmax(axis=1)
+                first[empty] = nspecies
+                sig[start:start + len(present), p] = first
+        return sig
+
+    def _band_keys(self, signatures, band):
+        cols = signatures[:, band * self.rows_per_band:
+                          (band + 1) * self.rows_per_band]
+        cols = numpy.ascontiguousarray(cols)
+        return cols.view(numpy.dtype((numpy.void, cols.dtype.itemsize *
+                                      cols.shape[1]))).ravel()
+
+    def candidates(self, query):
+        """rows of the families sharing a bucket with `query' (a family
+        or a packed profile row)."""
+        if isinstance(query, numpy.ndarray):
+            sig = self.signature(query)
+            buckets = []
+            for band in range(self.bands):
+                key = self._band_keys(sig, band)[0]
+                keys = self.keys[band]
+                b = numpy.searchsorted(keys, key)
+                buckets.append(b if b < len(keys) and keys[b] == key
+                               else None)
+        else:
+            row = self.profiles.index(query)
+            buckets = [self.bucket_of[band][row]
+                       for band in range(self.bands)]
+        rows = [numpy.empty(0, dtype=numpy.int64)]
+        for band, b in enumerate(buckets):
+            if b is not None:
+                ptr = self.ptr[band]
+                rows.append(self.members[band][ptr[b]:ptr[b + 1]])
+        return numpy.unique(numpy.concatenate(rows))
+
+    def nearest(self, query, k=10, metric='jaccard'):
+        """approximate `k' nearest families of `query': only the
+        candidates of the LSH buckets are scored exactly."""
+        return self.profiles._top(query, self.candidates(query), k, metric)
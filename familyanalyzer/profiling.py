@@ -0,0 +1,221 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Lightweight per-phase instrumentation. Phases are recorded with wall
+#  time, cpu time, peak memory and item counts. The peak resident set
+#  size is the high-water mark of the whole process when the phase
+#  ended, not the peak of the phase itself; with trace_memory the
+#  traced peak is measured per phase. While the profiler is disabled
+#  (the default) a phase costs one attribute lookup.
+#
+import collections
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+from .tools import cache_statistics
+
+try:
+    import resource
+    RESOURCE = True
+except ImportError:
+    RESOURCE = False
+
+
+def _peak_rss():
+    """peak resident set size of the process since its start in bytes
+    (or None)."""
+    if not RESOURCE:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # mac os reports bytes, linux and the BSDs kilobytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class PhaseRecord(object):
+    """accumulated measurements of all calls of one phase. peak_rss is
+    the process-wide peak at the end of the phase and includes the
+    memory used before the phase started."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.peak_rss = None
+        self.peak_traced = None
+        self.items = 0
+
+    def as_dict(self):
+        return collections.OrderedDict([('phase', self.name),
+                                        ('calls', self.calls),
+                                        ('wall', self.wall),
+                                        ('cpu', self.cpu),
+                                        ('peak_rss', self.peak_rss),
+                                        ('peak_traced', self.peak_traced),
+                                        ('items', self.items)])
+
+
+class _NullPhase(object):
+    """stand-in returned while profiling is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, n=1):
+        pass
+
+_NULL_PHASE = _NullPhase()
+
+
+class _ActivePhase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.items = 0
+        self.max_traced = 0
+
+    def count(self, n=1):
+        """adds `n' to the number of items processed in this phase."""
+        self.items += n
+
+    def __enter__(self):
+        prof = self.profiler
+        if prof.trace_memory:
+            current_peak = tracemalloc.get_traced_memory()[1]
+            for frame in prof._stack:
+                frame.max_traced = max(frame.max_traced, current_peak)
+            tracemalloc.reset_peak()
+        prof._stack.append(self)
+        self._cpu = time.process_time()
+        self._wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        prof = self.profiler
+        prof._stack.pop()
+        rec = prof.records.get(self.name)
+        if rec is None:
+            rec = prof.records[self.name] = PhaseRecord(self.name)
+        rec.calls += 1
+        rec.wall += wall
+        rec.cpu += cpu
+        rec.items += self.items
+        rss = _peak_rss()
+        if rss is not None:
+            rec.peak_rss = max(rss, rec.peak_rss or 0)
+        if prof.trace_memory:
+            peak = max(self.max_traced, tracemalloc.get_traced_memory()[1])
+            rec.peak_traced = max(peak, rec.peak_traced or 0)
+            if prof._stack:
+                parent = prof._stack[-1]
+                parent.max_traced = max(parent.max_traced, peak)
+        return False
+
+
+class Profiler(object):
+    """collects PhaseRecords of named phases.
+
+    usage:
+        PROFILER.enable()
+        with PROFILER.phase('parse') as ph:
+            ...
+            ph.count(nr_of_families)
+        PROFILER.write_text(sys.stderr)
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.records = collections.OrderedDict()
+        self._stack = []
+
+    def enable(self, trace_memory=False):
+        """enables the recording of phases. If `trace_memory' is set,
+        the peak of python allocations is measured with tracemalloc,
+        which slows down the analysis considerably."""
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def reset(self):
+        self.records.clear()
+        del self._stack[:]
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _ActivePhase(self, name)
+
+    def report(self):
+        return {'phases': [rec.as_dict() for rec in self.records.values()],
+                'caches': cache_statistics()}
+
+    def write_json(self, fd):
+        json.dump(self.report(), fd, indent=2)
+        fd.write('\n')
+
+    def write_text(self, fd):
+        def mb(nbytes):
+            return '-' if nbytes is None else '{:.1f}'.format(nbytes / 2**20)
+
+        fd.write('{:<24}{:>7}{:>11}{:>11}{:>14}{:>17}{:>10}\n'.format(
+            'phase', 'calls', 'wall[s]', 'cpu[s]', 'peak_rss[MB]',
+            'peak_traced[MB]', 'items'))
+        for rec in self.records.values():
+            fd.write('{:<24}{:>7}{:>11.3f}{:>11.3f}{:>14}{:>17}{:>10}\n'.format(
+                rec.name, rec.calls, rec.wall, rec.cpu, mb(rec.peak_rss),
+                mb(rec.peak_traced), rec.items))
+
+        caches = cache_statistics()
+        if caches:
+            fd.write('\n{:<34}{:>10}{:>10}{:>11}{:>10}{:>10}\n'.format(
+                'cache', 'hits', 'misses', 'evictions', 'size', 'hit_rate'))
+            for name in sorted(caches):
+                st = caches[name]
+                rate = ('-' if st['hit_rate'] is None
+                        else '{:.1%}'.format(st['hit_rate']))
+                fd.write('{:<34}{:>10}{:>10}{:>11}{:>10}{:>10}\n'.format(
+                    name, st['hits'], st['misses'], st['evictions'],
+                    st['size'], rate))
+
+
+PROFILER = Profiler()
+
+
+def phase(name):
+    """context manager recording `name' on the global profiler."""
+    return PROFILER.phase(name)
+
+
+def profiled(name):
+    """decorator recording each call of the decorated function as
+    phase `name' on the global profiler."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            with PROFILER.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,181 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Offset index of a (large) fasta file. The index is built in one scan,
+#  stored next to the fasta file and reused as long as the fasta file
+#  is unchanged; sequences are then read from a memory map of the file.
+#
+import io
+import mmap
+import multiprocessing
+import os
+
+SIDECAR_EXT = '.fa_index'
+_MAGIC = '#familyanalyzer fasta index'
+
+
+class FastaIndexError(Exception):
+    pass
+
+
+class FastaIndex(object):
+    """FastaIndex(fname, sidecar=None, rebuild=False)
+
+    Maps the ids of a fasta file (the first word of the header line)
+    onto the byte range of their sequence. The index is written to
+    `sidecar' (default: fname + '.fa_index') and loaded from there on
+    the next use, unless the fasta file has changed since.
+
+    usage:
+        with FastaIndex('proteome.fa') as idx:
+            seq = idx['HUMAN1']
+            missing = idx.extract_many([('fam1.fa', ['HUMAN1', 'PANTR1'])])
+    """
+
+    def __init__(self, fname, sidecar=None, rebuild=False):
+        self.fname = fname
+        self.sidecar = sidecar if sidecar is not None else fname + SIDECAR_EXT
+        self.offsets = dict()
+        self.from_sidecar = False
+        stat = os.stat(fname)
+        self._stamp = '{}\t{}'.format(stat.st_size,
+                                      getattr(stat, 'st_mtime_ns',
+                                              int(stat.st_mtime)))
+        if rebuild or not self._load():
+            self._build()
+            self._save()
+        self._fh = open(fname, 'rb')
+        self._map = (mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+                     if stat.st_size > 0 else b'')
+
+    def _load(self):
+        try:
+            with io.open(self.sidecar) as fh:
+                if fh.readline().rstrip('\n') != '{}\t{}'.format(_MAGIC,
+                                                                 self._stamp):
+                    return False
+                for line in fh:
+                    seqid, start, end = line.rstrip('\n').split('\t')
+                    self.offsets[seqid] = (int(start), int(end))
+        except (IOError, OSError, ValueError):
+            self.offsets.clear()
+            return False
+        self.from_sidecar = True
+        return True
+
+    def _save(self):
+        tmp = self.sidecar + '.tmp'
+        try:
+            with io.open(tmp, 'w') as fh:
+                fh.write('{}\t{}\n'.format(_MAGIC, self._stamp))
+                for seqid, (start, end) in self.offsets.items():
+                    fh.write('{}\t{}\t{}\n'.format(seqid, start, end))
+            os.rename(tmp, self.sidecar)
+        except (IOError, OSError):
+            # read-only location: keep the index in memory only
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _build(self):
+        seqid, start, pos = None, 0, 0
+        with open(self.fname, 'rb') as fh:
+            for line in fh:
+                if line.startswith(b'>'):
+                    if seqid is not None:
+                        self._add(seqid, start, pos)
+                    words = line[1:].split(None, 1)
+                    seqid = words[0].decode('utf-8') if words else ''
+                    start = pos + len(line)
+                pos += len(line)
+        if seqid is not None:
+            self._add(seqid, start, pos)
+
+    def _add(self, seqid, start, end):
+        if seqid in self.offsets:
+            raise FastaIndexError('duplicate id in {}: {}'
+                                  .format(self.fname, seqid))
+        self.offsets[seqid] = (start, end)
+
+    def close(self):
+        if self._fh is not None:
+            if self._map:
+                self._map.close()
+            self._fh.close()
+            self._fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, seqid):
+        return seqid in self.offsets
+
+    def __getitem__(self, seqid):
+        start, end = self.offsets[seqid]
+        raw = self._map[start:end]
+        return raw.replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+    def get(self, seqid, default=None):
+        if seqid not in self.offsets:
+            return default
+        return self[seqid]
+
+    def write_fasta(self, fd, seqids):
+        """writes the sequences of `seqids' to the text stream `fd' and
+        returns the list of ids that are not in the index."""
+        missing = []
+        for seqid in seqids:
+            if seqid not in self.offsets:
+                missing.append(seqid)
+                continue
+            fd.write('>{}\n{}\n'.format(seqid, self[seqid]))
+        return missing
+
+    def extract(self, out_fname, seqids):
+        with io.open(out_fname, 'w') as fh:
+            return self.write_fasta(fh, seqids)
+
+    def extract_many(self, jobs, processes=1):
+        """writes one fasta file per (out_fname, seqids) job. With more
+        than one process, the files are written in parallel; every
+        worker maps the fasta file once and loads the sidecar index.
+        Returns a dict out_fname -> list of missing ids."""
+        jobs = list(jobs)
+        if processes <= 1 or len(jobs) <= 1:
+            return dict((out, self.extract(out, ids)) for out, ids in jobs)
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (self.fname, self.sidecar))
+        try:
+            result = dict(pool.imap_unordered(
+                _extract_job, jobs, max(1, len(jobs) // (4 * processes))))
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        return result
+
+
+_INDEX = None
+
+
+def _init_worker(fname, sidecar):
+    global _INDEX
+    _INDEX = FastaIndex(fname, sidecar)
+
+
+def _extract_job(job):
+    out_fname, seqids = job
+    return out_fname, _INDEX.extract(out_fname, seqids)
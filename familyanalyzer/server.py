@@ -0,0 +1,353 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Long-running query server. The orthoxml file is parsed and annotated
+#  once; afterwards histories, comparisons, gene trees and gene lookups
+#  are answered over a local HTTP endpoint (tcp on the loopback device
+#  or a unix domain socket).
+#
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+
+from .genetree import GeneTree, GeneTreeNode, GeneTreeTracer
+from .tools import LRUCache
+
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+
+class QueryError(Exception):
+    pass
+
+
+class QueryEngine(object):
+    """Answers queries against one parsed and annotated orthoxml
+    file. Computed FamHistory objects are kept in a bounded LRU cache,
+    so repeated queries at the same level are served from memory."""
+
+    def __init__(self, parser, tax, cache_size=32):
+        self.parser = parser
+        self.tax = tax
+        self._histories = LRUCache(cache_size, name='QueryEngine.histories')
+        self._gene2fam = LRUCache(cache_size, name='QueryEngine.gene2fam')
+        self._gene_lookup = None
+        self._toplevel_of_gene = None
+        self._lock = threading.Lock()
+        # get_comparisons may run for long; it must not block the
+        # lookups guarded by _lock
+        self._comparisons_lock = threading.Lock()
+        self._comparisons_done = False
+
+        # assure the LOFT ids are assigned before serving queries
+        self.parser.getFamHistory()
+
+    def dispatch(self, query):
+        """dispatches a query dict to the matching handler method. The
+        'query' key selects the handler, all other keys are passed on
+        as keyword arguments."""
+        query = dict(query)
+        kind = query.pop('query', None)
+        handler = self.handlers.get(kind)
+        if handler is None:
+            raise QueryError('unknown query type: {}'.format(kind))
+        try:
+            return getattr(self, handler)(**query)
+        except TypeError as e:
+            raise QueryError('invalid arguments for {}: {}'.format(kind, e))
+
+    handlers = {'history': 'family_history',
+                'compare': 'compare_levels',
+                'genetree': 'gene_tree',
+                'gene': 'gene_family'}
+
+    def _check_level(self, level):
+        if level not in self.tax.hierarchy:
+            raise QueryError('unknown taxonomic level: {}'.format(level))
+
+    def history(self, level):
+        """returns the (cached) FamHistory object of `level'."""
+        self._check_level(level)
+        hist = self._histories.get(level)
+        if hist is None:
+            hist = self.parser.getFamHistory()
+            hist.analyzeLevel(level)
+            self._histories[level] = hist
+        return hist
+
+    def _formatter(self, xreftag):
+        return lambda gid: self.parser.mapGeneToXRef(gid, xreftag)
+
+    def _family_as_dict(self, fam, formatter, speciesFilter=None):
+        species = dict()
+        for spec, sumElem in fam.summary.items():
+            if speciesFilter is not None and spec not in speciesFilter:
+                continue
+            species[spec] = {'type': sumElem.typ,
+                             'genes': [formatter(gid)
+                                       for gid in sorted(sumElem.genes)]}
+        return {'family': fam.getFamId(), 'species': species}
+
+    def family_history(self, level, family=None, species=None,
+                       xreftag=None):
+        """history of all families (or of a single `family') at `level'.
+        `species' is an optional comma separated species filter."""
+        hist = self.history(level)
+        if family is not None:
+            try:
+                fams = [hist[family]]
+            except KeyError:
+                raise QueryError('family {} does not exist at {}'
+                                 .format(family, level))
+        else:
+            fams = hist.geneFamList
+        speciesFilter = (set(species.split(','))
+                         if species is not None else None)
+        formatter = self._formatter(xreftag)
+        return {'level': level,
+                'families': [self._family_as_dict(fam, formatter,
+                                                  speciesFilter)
+                             for fam in fams]}
+
+    def compare_levels(self, lev1, lev2):
+        """compares the histories of the two levels."""
+        comp = self.history(lev1).compare(self.history(lev2))
+        events = []
+        for famEvent in comp:
+            event = {'family': famEvent.fam, 'event': famEvent.event}
+            if famEvent.event == 'duplicated':
+                event['into'] = famEvent.subfamilies
+            events.append(event)
+        return {'lev1': lev1, 'lev2': lev2,
+                'summary': comp.summarise(),
+                'events': events}
+
+    def _ensure_comparisons(self):
+        with self._comparisons_lock:
+            if not self._comparisons_done:
+                self.tax.get_comparisons(self.parser)
+                self._comparisons_done = True
+
+    def _origin_of_family(self, family):
+        for taxnode in self.tax:
+            if (taxnode.history is not None and
+                    family in taxnode.history.geneFamDict):
+                return taxnode
+        raise QueryError('unknown family: {}'.format(family))
+
+    def gene_tree(self, family, xreftag='protId'):
+        """returns the gene tree of `family', traced from the level where
+        the family has been gained."""
+        self._ensure_comparisons()
+        taxnode = self._origin_of_family(family)
+        fam = taxnode.history[family]
+        gtt = GeneTreeTracer(self.parser, self.tax)
+        root = gtt.trace_gene_family(taxnode, fam)
+        if root is None:
+            # family only exists in a single species
+            gene = fam.getMemberGenes()[0]
+            root = GeneTreeNode(self.parser.mapGeneToXRef(gene, xreftag),
+                                node_type='leaf', level=taxnode.name)
+        tree = GeneTree(root)
+        return {'family': family,
+                'level': taxnode.name,
+                'newick': str(tree),
+                'nhx': tree.write()}
+
+    def _resolve_gene(self, gene):
+        if gene in self.parser._gene2species:
+            return gene
+        with self._lock:
+            if self._gene_lookup is None:
+                self._gene_lookup = {xref: gid for (gid, typ), xref
+                                     in self.parser._xrefs.items()}
+        try:
+            return self._gene_lookup[gene]
+        except KeyError:
+            raise QueryError('unknown gene: {}'.format(gene))
+
+    def _toplevel_family(self, gid):
+        with self._lock:
+            if self._toplevel_of_gene is None:
+                index = dict()
+                hogs = self.parser._hogs
+                if hogs is not None:
+                    # released document, see releaseDocument()
+                    genes = hogs.genes
+                    for grp in hogs.getToplevelGroups():
+                        og = hogs.getFamId(grp)
+                        for pos in hogs.memberPositions(grp).tolist():
+                            index[genes[pos]] = og
+                else:
+                    for grp in self.parser.getToplevelGroups():
+                        for gref in grp.iter('{{{ns0}}}geneRef'
+                                             .format(**self.parser.ns)):
+                            index[gref.get('id')] = grp.get('og')
+                self._toplevel_of_gene = index
+        return self._toplevel_of_gene.get(gid)
+
+    def _family_at_level(self, gid, level):
+        gene2fam = self._gene2fam.get(level)
+        if gene2fam is None:
+            gene2fam = dict()
+            for fam in self.history(level):
+                for g in fam.getMemberGenes():
+                    gene2fam[g] = fam.getFamId()
+            self._gene2fam[level] = gene2fam
+        return gene2fam.get(gid)
+
+    def gene_family(self, id, level=None):
+        """returns the family of a gene (given by its internal id or any
+        of its xrefs). If `level' is set, also the subfamily at that
+        level is reported."""
+        gid = self._resolve_gene(id)
+        res = {'gene': id,
+               'id': gid,
+               'species': self.parser.mapGeneToSpecies(gid),
+               'family': self._toplevel_family(gid)}
+        if level is not None:
+            res['level'] = level
+            res['subfamily'] = self._family_at_level(gid, level)
+        return res
+
+
+class QueryServer(object):
+    """asyncio based http frontend of a QueryEngine.
+
+    Supported requests:
+      GET  /history?level=L[&family=F][&species=A,B][&xreftag=T]
+      GET  /compare?lev1=L1&lev2=L2
+      GET  /genetree?family=F
+      GET  /gene?id=G[&level=L]
+      POST /batch   with a json list of query objects, e.g.
+                    [{"query": "history", "level": "Mammalia"}, ...]
+
+    At most `max_concurrent' queries are computed at the same time;
+    identical queries that are in flight concurrently are coalesced
+    into one computation."""
+
+    def __init__(self, engine, max_concurrent=4):
+        self.engine = engine
+        self.max_concurrent = max_concurrent
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent)
+        self._semaphore = None
+        self._inflight = dict()
+        self._server = None
+
+    async def _compute(self, query):
+        async with self._semaphore:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._executor,
+                                              self.engine.dispatch, query)
+
+    async def query(self, query):
+        """computes the result of a single query dict."""
+        key = json.dumps(query, sort_keys=True)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(query))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def batch(self, queries):
+        """computes a list of queries. Failing queries report their
+        error in place of the result."""
+        results = await asyncio.gather(*[self.query(q) for q in queries],
+                                       return_exceptions=True)
+        return [{'error': str(r)} if isinstance(r, Exception) else r
+                for r in results]
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        fields = request_line.decode('latin-1').split(' ', 2)
+        if len(fields) != 3:
+            raise QueryError('malformed request line: {!r}'
+                             .format(request_line.strip()))
+        method, target, _ = fields
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = b''
+        length = int(headers.get('content-length', 0))
+        if length > 0:
+            body = await reader.readexactly(length)
+        return method, target, body
+
+    async def _respond(self, method, target, body):
+        url = urlsplit(target)
+        endpoint = url.path.strip('/')
+        if method == 'POST' and endpoint == 'batch':
+            queries = json.loads(body.decode('utf-8'))
+            if not isinstance(queries, list):
+                raise QueryError('batch requests need a list of queries')
+            return await self.batch(queries)
+        if method != 'GET':
+            raise QueryError('unsupported method: {}'.format(method))
+        query = dict(parse_qsl(url.query))
+        query['query'] = endpoint
+        return await self.query(query)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try:
+                request = await self._read_request(reader)
+                if request is None:
+                    return
+                status, result = '200 OK', await self._respond(*request)
+            except (QueryError, ValueError) as e:
+                status, result = '400 Bad Request', {'error': str(e)}
+            except Exception as e:
+                status, result = ('500 Internal Server Error',
+                                  {'error': repr(e)})
+            payload = json.dumps(result).encode('utf-8')
+            writer.write('HTTP/1.1 {}\r\n'
+                         'Content-Type: application/json\r\n'
+                         'Content-Length: {}\r\n'
+                         'Connection: close\r\n\r\n'
+                         .format(status, len(payload)).encode('latin-1'))
+            writer.write(payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8080, path=None):
+        """starts listening either on a unix domain socket (if `path' is
+        set) or on a loopback tcp port."""
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(
+                self._handle_connection, path=path)
+        else:
+            if host not in LOOPBACK_HOSTS:
+                raise QueryError('the query server only listens on the '
+                                 'loopback device, not on {}'.format(host))
+            self._server = await asyncio.start_server(
+                self._handle_connection, host=host, port=port)
+        return self._server
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._executor.shutdown(wait=False)
+
+    def serve_forever(self, host='127.0.0.1', port=8080, path=None):
+        async def _serve():
+            server = await self.start(host, port, path)
+            async with server:
+                await server.serve_forever()
+        asyncio.run(_serve())
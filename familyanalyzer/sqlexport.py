@@ -0,0 +1,315 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Export of an annotated OrthoXMLParser to a SQLite database, and a
+#  query class answering the common lookups of OrthoXMLQuery and
+#  FamHistory from the database, i.e. without loading the xml.
+#
+import os
+import sqlite3
+
+from .compact import ORTHOLOG, GENEREF
+from .orthoxmlquery import OrthoXMLQuery
+
+SCHEMA = """
+CREATE TABLE species (
+    id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, taxid TEXT);
+CREATE TABLE genes (
+    id TEXT PRIMARY KEY, species_id INTEGER NOT NULL REFERENCES species);
+CREATE TABLE xrefs (
+    gene_id TEXT NOT NULL REFERENCES genes, tag TEXT NOT NULL,
+    value TEXT NOT NULL);
+CREATE TABLE groups (
+    id INTEGER PRIMARY KEY, parent_id INTEGER REFERENCES groups,
+    family TEXT NOT NULL, loft TEXT, kind TEXT NOT NULL);
+CREATE TABLE group_levels (
+    group_id INTEGER NOT NULL REFERENCES groups, level TEXT NOT NULL);
+CREATE TABLE gene_refs (
+    group_id INTEGER NOT NULL REFERENCES groups,
+    gene_id TEXT NOT NULL REFERENCES genes);
+CREATE TABLE gene_families (
+    gene_id TEXT NOT NULL REFERENCES genes, level TEXT NOT NULL,
+    loft TEXT NOT NULL, depth INTEGER NOT NULL);
+CREATE TABLE taxonomy (level TEXT PRIMARY KEY, parent TEXT);
+CREATE TABLE events (
+    level1 TEXT NOT NULL, level2 TEXT NOT NULL, family TEXT NOT NULL,
+    event TEXT NOT NULL, subfamily TEXT);
+"""
+
+INDEXES = """
+CREATE INDEX genes_species ON genes (species_id);
+CREATE INDEX xrefs_gene ON xrefs (gene_id);
+CREATE INDEX xrefs_value ON xrefs (tag, value);
+CREATE INDEX groups_parent ON groups (parent_id);
+CREATE INDEX groups_family ON groups (family);
+CREATE INDEX groups_loft ON groups (loft);
+CREATE INDEX group_levels_level ON group_levels (level, group_id);
+CREATE INDEX group_levels_group ON group_levels (group_id);
+CREATE INDEX gene_refs_gene ON gene_refs (gene_id);
+CREATE INDEX gene_refs_group ON gene_refs (group_id);
+CREATE INDEX gene_families_gene ON gene_families (gene_id, depth);
+CREATE INDEX gene_families_level ON gene_families (level, loft);
+CREATE INDEX events_levels ON events (level1, level2, event);
+CREATE INDEX events_family ON events (family);
+"""
+
+
+class SQLiteExportError(Exception):
+    pass
+
+
+def export_sqlite(parser, fname, comparisons=(), overwrite=False):
+    """writes the annotated document of `parser' and the events of the
+    LevelComparisonResults in `comparisons' to the SQLite database
+    `fname'. All rows are inserted in one transaction; the indexes are
+    created afterwards."""
+    if os.path.exists(fname):
+        if not overwrite:
+            raise SQLiteExportError('{} exists already'.format(fname))
+        os.remove(fname)
+    index = parser.getGeneIndex()
+    conn = sqlite3.connect(fname)
+    try:
+        # a failed export is removed, so the file needs no journal
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        with conn:
+            conn.executescript(SCHEMA)
+            _insert_genes(conn, parser)
+            _insert_groups(conn, parser)
+            conn.executemany(
+                'INSERT INTO gene_families VALUES (?, ?, ?, ?)',
+                ((gene, level, loft, depth) for gene in index.genes
+                 for depth, (level, loft) in enumerate(index.lineage(gene))))
+            if parser.tax is not None:
+                conn.executemany(
+                    'INSERT INTO taxonomy VALUES (?, ?)',
+                    ((name, node.up.name if node.up is not None else None)
+                     for name, node in parser.tax.hierarchy.items()))
+            conn.executemany('INSERT INTO events VALUES (?, ?, ?, ?, ?)',
+                             _event_rows(comparisons))
+            conn.executescript(INDEXES)
+    except BaseException:
+        conn.close()
+        os.remove(fname)
+        raise
+    conn.close()
+
+
+def _insert_genes(conn, parser):
+    species = dict()
+    for gene, elem in parser._gene2species.items():
+        name = elem.get('name')
+        if name not in species:
+            species[name] = (len(species) + 1, elem.get('NCBITaxId'))
+    conn.executemany('INSERT INTO species VALUES (?, ?, ?)',
+                     ((sid, name, taxid)
+                      for name, (sid, taxid) in species.items()))
+    conn.executemany('INSERT INTO genes VALUES (?, ?)',
+                     ((gene, species[elem.get('name')][0])
+                      for gene, elem in parser._gene2species.items()))
+    conn.executemany('INSERT INTO xrefs VALUES (?, ?, ?)',
+                     ((gene, tag, value)
+                      for (gene, tag), value in parser._xrefs.items()))
+
+
+def _insert_groups(conn, parser):
+    if parser.isReleased():
+        groups, levels, refs = _compact_group_rows(parser._hogs)
+    else:
+        groups, levels, refs = _group_rows(parser)
+    conn.executemany('INSERT INTO groups VALUES (?, ?, ?, ?, ?)', groups)
+    conn.executemany('INSERT INTO group_levels VALUES (?, ?)', levels)
+    conn.executemany('INSERT INTO gene_refs VALUES (?, ?)', refs)
+
+
+def _group_rows(parser):
+    groups, levels, refs = [], [], []
+    propertyTag = '{{{ns0}}}property'.format(**OrthoXMLQuery.ns)
+    geneRefTag = '{{{ns0}}}geneRef'.format(**OrthoXMLQuery.ns)
+    for i, fam in enumerate(parser.getToplevelGroups()):
+        # groups without id are numbered by position, as in annotateDoc
+        family = fam.get('id', str(i))
+        stack = [(fam, None)]
+        while stack:
+            node, parent = stack.pop()
+            gid = len(groups) + 1
+            ortholog = parser.is_ortholog_group(node)
+            groups.append((gid, parent, family, node.get('og'),
+                           'ortholog' if ortholog else 'paralog'))
+            for child in node:
+                if child.tag == geneRefTag:
+                    refs.append((gid, child.get('id')))
+                elif child.tag == propertyTag:
+                    if child.get('name') == 'TaxRange':
+                        levels.append((gid, child.get('value')))
+                elif parser.is_evolutionary_node(child):
+                    stack.append((child, gid))
+    return groups, levels, refs
+
+
+def _compact_group_rows(hogs):
+    """rows of _group_rows from the CompactHOGs of a released
+    document, in the same order. The family is the LOFT id of the
+    toplevel group, which is its id or, without id, its position."""
+    groups, levels, refs = [], [], []
+    kind, gene, genes = hogs.kind, hogs.gene, hogs.genes
+    for fam in hogs.getToplevelGroups():
+        family = hogs.getFamId(fam)
+        stack = [(fam, None)]
+        while stack:
+            node, parent = stack.pop()
+            gid = len(groups) + 1
+            ortholog = kind[node] == ORTHOLOG
+            groups.append((gid, parent, family,
+                           hogs.getFamId(node) if ortholog else None,
+                           'ortholog' if ortholog else 'paralog'))
+            levels.extend((gid, level) for level in hogs.getNodeLevels(node))
+            for child in hogs.children(node):
+                if kind[child] == GENEREF:
+                    refs.append((gid, genes[gene[child]]))
+                else:
+                    stack.append((child, gid))
+    return groups, levels, refs
+
+
+def _event_rows(comparisons):
+    for comp in comparisons:
+        for fam, event, into in comp.iter_events():
+            if event == 'duplicated':
+                for subfam in into:
+                    yield comp.lev1, comp.lev2, fam, event, subfam
+            else:
+                yield comp.lev1, comp.lev2, fam, event, None
+
+
+class SQLiteQuery(object):
+    """SQLiteQuery(fname)
+
+    Lookups on a database written by export_sqlite. Families are
+    identified by their LOFT id, genes by their internal id."""
+
+    def __init__(self, fname):
+        if not os.path.exists(fname):
+            raise SQLiteExportError('no such database: {}'.format(fname))
+        self.conn = sqlite3.connect(fname)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _column(self, sql, *args):
+        return [row[0] for row in self.conn.execute(sql, args)]
+
+    # lookups of OrthoXMLParser
+    def getSpeciesSet(self):
+        return set(self._column('SELECT name FROM species'))
+
+    def getLevels(self):
+        return set(self._column('SELECT DISTINCT level FROM group_levels'))
+
+    def getGeneIds(self, species):
+        return self._column('SELECT genes.id FROM genes JOIN species ON '
+                            'species.id = species_id WHERE name = ?', species)
+
+    def mapGeneToSpecies(self, gene):
+        rows = self._column('SELECT name FROM genes JOIN species ON '
+                            'species.id = species_id WHERE genes.id = ?', gene)
+        return rows[0] if rows else None
+
+    def mapGeneToXRef(self, gene, typ='protId'):
+        if typ is None:
+            return gene
+        rows = self._column('SELECT value FROM xrefs WHERE gene_id = ? '
+                            'AND tag = ?', gene, typ)
+        return rows[0] if rows else None
+
+    def mapXRefToGene(self, value, typ='protId'):
+        rows = self._column('SELECT gene_id FROM xrefs WHERE tag = ? '
+                            'AND value = ?', typ, value)
+        return rows[0] if rows else None
+
+    # lookups of OrthoXMLQuery
+    def getToplevelOrthologGroups(self):
+        return self._column('SELECT family FROM groups WHERE parent_id IS '
+                            'NULL ORDER BY id')
+
+    def getGroupsAtLevel(self, level):
+        """LOFT ids of the orthologGroups with TaxRange `level'."""
+        return self._column('SELECT DISTINCT loft FROM group_levels JOIN '
+                            'groups ON groups.id = group_id WHERE level = ?',
+                            level)
+
+    def getLevelsOfGroup(self, loft):
+        return set(self._column('SELECT level FROM group_levels JOIN groups '
+                                'ON groups.id = group_id WHERE loft = ?',
+                                loft))
+
+    def getGeneRefs(self, family):
+        """all genes of the toplevel family `family'."""
+        return self._column('SELECT gene_id FROM gene_refs JOIN groups ON '
+                            'groups.id = group_id WHERE family = ?', family)
+
+    # lookups of FamHistory
+    def getMemberGenes(self, loft, level):
+        """genes of the family `loft' at `level'."""
+        return self._column('SELECT gene_id FROM gene_families WHERE '
+                            'level = ? AND loft = ?', level, loft)
+
+    def getFamilies(self, level, species=None):
+        """dict LOFT id -> list of genes of all families at `level',
+        optionally restricted to the genes of `species'."""
+        sql = 'SELECT loft, gene_id FROM gene_families'
+        args = [level]
+        if species is not None:
+            species = list(species)
+            sql += (' JOIN genes ON genes.id = gene_id JOIN species ON '
+                    'species.id = species_id WHERE name IN ({}) AND'
+                    .format(', '.join('?' * len(species))))
+            args = species + args
+        else:
+            sql += ' WHERE'
+        families = dict()
+        for loft, gene in self.conn.execute(sql + ' level = ?', args):
+            families.setdefault(loft, []).append(gene)
+        return families
+
+    def getFamily(self, gene, level):
+        """LOFT id of the family of `gene' at `level' or None."""
+        rows = self._column('SELECT loft FROM gene_families WHERE '
+                            'gene_id = ? AND level = ?', gene, level)
+        return rows[0] if rows else None
+
+    def getLineage(self, gene):
+        """(level, LOFT id) of the families of `gene', root to leaf."""
+        return [tuple(row) for row in self.conn.execute(
+            'SELECT level, loft FROM gene_families WHERE gene_id = ? '
+            'ORDER BY depth', (gene,))]
+
+    def getEvents(self, level1, level2, event=None):
+        """(family, event, subfamily) rows of the comparison of `level1'
+        with `level2', optionally only of one kind of event."""
+        sql = ('SELECT family, event, subfamily FROM events WHERE '
+               'level1 = ? AND level2 = ?')
+        args = [level1, level2]
+        if event is not None:
+            sql += ' AND event = ?'
+            args.append(event)
+        return [tuple(row) for row in self.conn.execute(sql, args)]
+
+    def getFamilyEvents(self, family):
+        """(level1, level2, event, subfamily) rows of family `family'."""
+        return [tuple(row) for row in self.conn.execute(
+            'SELECT level1, level2, event, subfamily FROM events WHERE '
+            'family = ?', (family,))]
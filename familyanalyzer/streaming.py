@@ -0,0 +1,312 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import str
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Streaming annotation of orthoxml files: the input is read with
+#  iterparse one toplevel family at a time, every family is augmented
+#  with the missing TaxRange levels and LOFT ids, written with
+#  etree.xmlfile and then freed. Only the species section, the gene to
+#  species mapping and the family being processed are kept in memory.
+#  Gzip compressed input (files or streams) is detected by its magic
+#  number; files ending with '.gz' are written gzip compressed.
+#
+import gzip
+import io
+
+import lxml.etree as etree
+
+from .familyanalyzer import OrthoXMLParser, GroupAnnotator, AnnotationState
+from .orthoxmlquery import OrthoXMLQuery
+from .taxonomy import TaxRangeOrthoXMLTaxonomy
+
+
+class StreamingError(Exception):
+    pass
+
+
+def _seekable(fh):
+    try:
+        return fh.seekable()
+    except AttributeError:
+        return False
+
+
+def _open_input(fname):
+    if not hasattr(fname, 'read'):
+        fh = io.open(fname, 'rb')
+        if fh.read(2) == b'\x1f\x8b':
+            fh.close()
+            return gzip.open(fname, 'rb')
+        fh.seek(0)
+        return fh
+    # streams are sniffed without consuming the magic number
+    if _seekable(fname):
+        pos = fname.tell()
+        magic = fname.read(2)
+        fname.seek(pos)
+    elif hasattr(fname, 'peek'):
+        magic = fname.peek(2)[:2]
+    else:
+        return fname
+    if magic == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=fname, mode='rb')
+    return fname
+
+
+def _strip_whitespace(element):
+    for elem in element.iter():
+        if elem.text is not None and elem.text.isspace():
+            elem.text = None
+        elem.tail = None
+
+
+class StreamingOrthoXMLReader(object):
+    """StreamingOrthoXMLReader(fname)
+
+    Reads an orthoxml file (or stream, optionally gzip compressed)
+    incrementally. On construction everything up to the <groups>
+    element is read: `header' holds the elements before it (notes,
+    species, scores). families() then yields the toplevel orthologGroup
+    elements one by one; each is freed as soon as the next is read.
+
+    The reader provides the parser methods needed by GroupAnnotator and
+    TaxRangeOrthoXMLTaxonomy, so that families can be annotated while
+    they are streamed."""
+
+    ns = OrthoXMLParser.ns
+    is_ortholog_group = OrthoXMLParser.__dict__['is_ortholog_group']
+    is_paralog_group = OrthoXMLParser.__dict__['is_paralog_group']
+    is_evolutionary_node = OrthoXMLParser.__dict__['is_evolutionary_node']
+
+    def __init__(self, fname):
+        self._fh = _open_input(fname)
+        self._close = self._fh is not fname
+        self._events = etree.iterparse(self._fh, events=('start', 'end'),
+                                       remove_comments=True,
+                                       huge_tree=True)
+        self.root = None
+        self.header = []
+        self.trailer = []
+        self.groups = None
+        self._gene2species = dict()
+        self._xrefs = dict()
+        self._started = False
+        self._read_header()
+
+    def _tag(self, name):
+        return '{{{}}}{}'.format(self.ns['ns0'], name)
+
+    def _read_header(self):
+        species_tag, groups_tag = self._tag('species'), self._tag('groups')
+        depth = 0
+        for event, elem in self._events:
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    self.root = elem
+                elif depth == 2 and elem.tag == groups_tag:
+                    self.groups = elem
+                    self._geneIds = list(self._gene2species)
+                    self._genePos = dict((g, i) for i, g in
+                                         enumerate(self._geneIds))
+                    return
+                continue
+            depth -= 1
+            if depth == 1:
+                self.header.append(elem)
+                if elem.tag == species_tag:
+                    self._add_species(elem)
+        raise StreamingError('no groups element found')
+
+    def _add_species(self, species):
+        name = species.get('name')
+        for gene in species.iter(self._tag('gene')):
+            id_ = gene.get('id')
+            self._gene2species[id_] = name
+            for tag, value in gene.items():
+                if tag != 'id':
+                    self._xrefs[(id_, tag)] = value
+
+    def close(self):
+        if self._close:
+            self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def families(self):
+        """yields the toplevel orthologGroup elements. Can be iterated
+        only once."""
+        if self._started:
+            raise StreamingError('the families can be read only once')
+        self._started = True
+        depth = 2
+        for event, elem in self._events:
+            if event == 'start':
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 2:
+                if self.is_ortholog_group(elem):
+                    yield elem
+                elem.clear()
+                self.groups.remove(elem)
+            elif depth == 1:
+                if elem is not self.groups:
+                    self.trailer.append(elem)
+
+    # parser interface used by GroupAnnotator / TaxRangeOrthoXMLTaxonomy
+    def getToplevelGroups(self):
+        return self.families()
+
+    def getSpeciesSet(self):
+        return set(self._gene2species.values())
+
+    def mapGeneToSpecies(self, id_):
+        return self._gene2species[id_]
+
+    def mapGeneToXRef(self, id_, typ='protId'):
+        if typ is None:
+            return id_
+        return self._xrefs[(id_, typ)]
+
+    def get_species_below_node(self, node):
+        return {self._gene2species[gr.get('id')]
+                for gr in OrthoXMLQuery.getGeneRefNodes(node)}
+
+
+def streamed_taxonomy(fname):
+    """the implicit taxonomy of an orthoxml file (see
+    TaxRangeOrthoXMLTaxonomy), computed in one streaming pass."""
+    with StreamingOrthoXMLReader(fname) as reader:
+        return TaxRangeOrthoXMLTaxonomy(reader)
+
+
+class StreamingAnnotator(object):
+    """StreamingAnnotator(reader, tax, propagate_top=False,
+                          add_singletons=False)
+
+    Annotates the families of a StreamingOrthoXMLReader as they are
+    read, like augmentTaxonomyInfo, augmentSingletons and the LOFT
+    annotation do for a parsed document. After families() is exhausted,
+    `geneIndex' holds the GeneIndex of all genes, `singletons' the
+    ids of the added singleton families and `annotation' the
+    AnnotationState of the written document."""
+
+    def __init__(self, reader, tax, propagate_top=False,
+                 add_singletons=False):
+        self.reader = reader
+        self.tax = tax
+        self.propagate_top = propagate_top
+        self.add_singletons = add_singletons
+        self.geneIndex = None
+        self.singletons = None
+        self.annotation = AnnotationState(
+            loft=True, taxonomy=AnnotationState.taxonomy_digest(tax),
+            propagate_top=propagate_top)
+
+    def families(self):
+        annotator = GroupAnnotator(self.reader)
+        annotator.tax = self.tax
+        annotator.grouped = bytearray(len(self.reader._geneIds))
+        annotator.startAnnotation(self.reader._geneIds)
+        highest = -1
+        i = 0
+        for i, fam in enumerate(self.reader.families()):
+            annotator._addTaxRange(fam, noUpwardLevels=not
+                                   self.propagate_top)
+            annotator.annotateFamily(fam, i)
+            try:
+                highest = max(highest, int(fam.get('id', str(i))))
+            except ValueError:
+                pass
+            yield fam
+
+        if self.add_singletons:
+            genes = self.reader._geneIds
+            ungrouped = sorted(genes[pos] for pos, flag in
+                               enumerate(annotator.grouped) if not flag)
+            fam_num = highest + 1
+            self.singletons = set()
+            for gene in ungrouped:
+                # in the default namespace of <groups>, as the parsed
+                # families are written
+                fam = etree.Element(self.reader._tag('orthologGroup'),
+                                    id=str(fam_num),
+                                    nsmap=self.reader.groups.nsmap)
+                fam.append(annotator._createTaxRangeTag(
+                    self.reader.mapGeneToSpecies(gene)))
+                etree.SubElement(fam, self.reader._tag('geneRef'), id=gene)
+                annotator.annotateFamily(fam, i)
+                self.singletons.add(str(fam_num))
+                fam_num += 1
+                yield fam
+            self.annotation.singletons = (highest + 1, fam_num)
+        self.geneIndex = annotator.geneIndex.build()
+
+
+def write_stream(out, reader, families, pretty_print=False,
+                 compression=None, annotation=None):
+    """writes the header of `reader' and the `families' (an iterable of
+    orthologGroup elements, e.g. StreamingAnnotator.families()) as an
+    orthoxml document to `out' (file name or binary stream). Every
+    family is written and flushed as soon as it is produced. The
+    AnnotationState `annotation' is written after the families.
+    `compression' is the gzip level (default: 6 for names ending with
+    '.gz', otherwise uncompressed)."""
+    if compression is None:
+        compression = (6 if not hasattr(out, 'write') and
+                       str(out).endswith('.gz') else 0)
+    root = reader.root
+    with etree.xmlfile(out, encoding='UTF-8',
+                       compression=compression) as xf:
+        xf.write_declaration()
+        with xf.element(root.tag, dict(root.attrib), nsmap=root.nsmap):
+            for elem in reader.header:
+                if pretty_print:
+                    _strip_whitespace(elem)
+                xf.write(elem, pretty_print=pretty_print)
+            with xf.element(reader.groups.tag, dict(reader.groups.attrib)):
+                for fam in families:
+                    if pretty_print:
+                        _strip_whitespace(fam)
+                    xf.write(fam, pretty_print=pretty_print)
+                    xf.flush()
+            for elem in reader.trailer:
+                xf.write(elem, pretty_print=pretty_print)
+            if annotation is not None and not annotation.is_empty():
+                xf.write(annotation.processing_instruction())
+
+
+def annotate_stream(infile, outfile, tax=None, propagate_top=False,
+                    add_singletons=False, pretty_print=False):
+    """augments the orthoxml file `infile' with the missing TaxRange
+    levels, LOFT ids (and singletons) and writes it to `outfile',
+    without loading the document. Without `tax', the implicit taxonomy
+    is computed in a first pass over `infile'; a binary stream is then
+    read twice and has to be seekable. Returns the StreamingAnnotator,
+    whose geneIndex covers all genes."""
+    if tax is None:
+        stream = hasattr(infile, 'read')
+        if stream and not _seekable(infile):
+            raise StreamingError('a taxonomy is required to annotate a '
+                                 'stream which is not seekable')
+        start = infile.tell() if stream else None
+        tax = streamed_taxonomy(infile)
+        if stream:
+            infile.seek(start)
+    with StreamingOrthoXMLReader(infile) as reader:
+        annotator = StreamingAnnotator(reader, tax, propagate_top,
+                                       add_singletons)
+        write_stream(outfile, reader, annotator.families(), pretty_print,
+                     annotation=annotator.annotation)
+    return annotator
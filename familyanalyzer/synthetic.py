@@ -0,0 +1,225 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import range
+from future.builtins import str
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Generator for synthetic but realistic datasets: a species tree of a
+#  chosen shape and a set of gene families evolved along it with
+#  duplications and losses, written as OrthoXML and Newick files.
+#
+import io
+import random
+import lxml.etree as etree
+
+from .taxonomy import TaxNode
+
+ORTHOXML_NS = "http://orthoXML.org/2011/"
+TREE_SHAPES = ('balanced', 'caterpillar', 'random')
+
+
+class SyntheticDataset(object):
+    """SyntheticDataset(nr_species, nr_families, ...)
+
+    Simulates `nr_families' gene families along a species tree with
+    `nr_species' leaves. Every family is gained at the root (or, with
+    probability `novel_rate', at a random inner level). At each level
+    a gene copy duplicates with probability `dup_rate' (repeatedly, so
+    several rounds are possible) and is lost on each descending branch
+    with probability `loss_rate'. `singleton_rate' is the fraction of
+    extra genes per species that are not part of any group.
+
+    The shape of the species tree is one of 'balanced', 'caterpillar'
+    or 'random'. All randomness is drawn from `seed', so a dataset
+    can be reproduced exactly."""
+
+    def __init__(self, nr_species=10, nr_families=100, dup_rate=0.1,
+                 loss_rate=0.1, shape='balanced', novel_rate=0.1,
+                 singleton_rate=0.05, max_dup_rounds=3, seed=None):
+        if shape not in TREE_SHAPES:
+            raise ValueError('unknown tree shape: {}'.format(shape))
+        if nr_species < 2:
+            raise ValueError('need at least two species')
+        self.nr_species = nr_species
+        self.nr_families = nr_families
+        self.dup_rate = dup_rate
+        self.loss_rate = loss_rate
+        self.shape = shape
+        self.novel_rate = novel_rate
+        self.singleton_rate = singleton_rate
+        self.max_dup_rounds = max_dup_rounds
+        self.seed = seed
+        self.rng = random.Random(seed)
+
+        self.species_tree = self._build_species_tree()
+        self.genes = dict((sp, []) for sp in self.species_names())
+        self._gene_counter = 0
+        self.families = [self._simulate_family(i)
+                         for i in range(1, nr_families + 1)]
+        self.singletons = self._draw_singletons()
+
+    def params(self):
+        return {'nr_species': self.nr_species,
+                'nr_families': self.nr_families,
+                'dup_rate': self.dup_rate,
+                'loss_rate': self.loss_rate,
+                'shape': self.shape,
+                'novel_rate': self.novel_rate,
+                'singleton_rate': self.singleton_rate,
+                'seed': self.seed}
+
+    def species_names(self):
+        return [n.name for n in self.species_tree.iter_leaves()]
+
+    def nr_genes(self):
+        return sum(len(g) for g in self.genes.values())
+
+    def _build_species_tree(self):
+        leaves = [TaxNode('SP{:05d}'.format(i))
+                  for i in range(1, self.nr_species + 1)]
+        inner_counter = [0]
+
+        def join(children):
+            inner_counter[0] += 1
+            node = TaxNode('L{:05d}'.format(inner_counter[0]))
+            for child in children:
+                node.add_child(child)
+                child.add_parent(node)
+            return node
+
+        if self.shape == 'caterpillar':
+            root = leaves[0]
+            for leaf in leaves[1:]:
+                root = join([root, leaf])
+        elif self.shape == 'random':
+            # coalescent-like random joining of two lineages at a time
+            pool = list(leaves)
+            while len(pool) > 1:
+                a, b = self.rng.sample(range(len(pool)), 2)
+                node = join([pool[a], pool[b]])
+                pool = [n for i, n in enumerate(pool) if i not in (a, b)]
+                pool.append(node)
+            root = pool[0]
+        else:
+            level = list(leaves)
+            while len(level) > 1:
+                nxt = [join(level[i:i+2]) for i in range(0, len(level) - 1, 2)]
+                if len(level) % 2 == 1:
+                    nxt.append(level[-1])
+                level = nxt
+            root = level[0]
+        # name inner nodes in preorder, so the root is 'L00001'
+        for i, node in enumerate(root.iter_inner_nodes(), start=1):
+            node.name = 'L{:05d}'.format(i)
+        return root
+
+    def _new_gene(self, species):
+        self._gene_counter += 1
+        gid = self._gene_counter
+        self.genes[species].append(gid)
+        return gid
+
+    def _element(self, tag, **attrib):
+        return etree.Element('{{{}}}{}'.format(ORTHOXML_NS, tag), **attrib)
+
+    def _property(self, level):
+        return self._element('property', name='TaxRange', value=level)
+
+    def _simulate_family(self, fam_nr):
+        inner = list(self.species_tree.iter_inner_nodes())
+        if self.rng.random() < self.novel_rate and len(inner) > 1:
+            origin = self.rng.choice(inner[1:])
+        else:
+            origin = self.species_tree
+
+        fam = self._element('orthologGroup', id=str(fam_nr))
+        # work items: (taxnode, parent element, remaining duplication
+        # rounds). evolved with an explicit stack to support deep trees
+        stack = [(origin, fam, self.max_dup_rounds, True)]
+        while stack:
+            taxnode, parent, dup_rounds, is_root = stack.pop()
+            if dup_rounds > 0 and not is_root and \
+                    self.rng.random() < self.dup_rate:
+                para = self._element('paralogGroup')
+                parent.append(para)
+                for _ in range(2):
+                    stack.append((taxnode, para, dup_rounds - 1, False))
+                continue
+            if taxnode.is_leaf():
+                gid = self._new_gene(taxnode.name)
+                parent.append(self._element('geneRef', id=str(gid)))
+                continue
+            if is_root:
+                og = parent
+            else:
+                og = self._element('orthologGroup')
+                parent.append(og)
+            og.append(self._property(taxnode.name))
+            survivors = [c for c in taxnode.down
+                         if self.rng.random() >= self.loss_rate]
+            # a copy is never lost on all descending branches
+            if not survivors:
+                survivors = [self.rng.choice(taxnode.down)]
+            for child in survivors:
+                stack.append((child, og, self.max_dup_rounds, False))
+        return fam
+
+    def _draw_singletons(self):
+        singletons = []
+        for sp in self.species_names():
+            nr = int(round(self.singleton_rate * len(self.genes[sp])))
+            for _ in range(nr):
+                singletons.append(self._new_gene(sp))
+        return singletons
+
+    def orthoxml_tree(self):
+        root = etree.Element('{{{}}}orthoXML'.format(ORTHOXML_NS),
+                             nsmap={None: ORTHOXML_NS},
+                             version='0.3', origin='familyanalyzer.synthetic',
+                             originVersion='0.1')
+        for sp in self.species_names():
+            species = etree.SubElement(root, '{{{}}}species'.format(ORTHOXML_NS),
+                                       name=sp, NCBITaxId='0')
+            db = etree.SubElement(species, '{{{}}}database'.format(ORTHOXML_NS),
+                                  name='{}db'.format(sp), version='1')
+            genes = etree.SubElement(db, '{{{}}}genes'.format(ORTHOXML_NS))
+            for gid in sorted(self.genes[sp]):
+                etree.SubElement(genes, '{{{}}}gene'.format(ORTHOXML_NS),
+                                 id=str(gid),
+                                 protId='{}_{}'.format(sp, gid),
+                                 geneId='{}_g{}'.format(sp, gid))
+        groups = etree.SubElement(root, '{{{}}}groups'.format(ORTHOXML_NS))
+        for fam in self.families:
+            groups.append(fam)
+        return etree.ElementTree(root)
+
+    def newick(self):
+        return str(self.species_tree) + ';'
+
+    def write_orthoxml(self, fp):
+        """writes the dataset as OrthoXML to a filename or binary
+        file object."""
+        self.orthoxml_tree().write(fp, xml_declaration=True,
+                                   encoding='UTF-8', pretty_print=True)
+
+    def write_newick(self, fp):
+        """writes the species tree in Newick format to a filename or
+        text file object."""
+        if isinstance(fp, (str, bytes)):
+            with io.open(fp, 'w') as fh:
+                fh.write(self.newick() + '\n')
+        else:
+            fp.write(self.newick() + '\n')
+
+    def write(self, prefix):
+        """writes '<prefix>.orthoxml' and '<prefix>.nwk' and returns
+        both filenames."""
+        xml_fname = '{}.orthoxml'.format(prefix)
+        nwk_fname = '{}.nwk'.format(prefix)
+        self.write_orthoxml(xml_fname)
+        self.write_newick(nwk_fname)
+        return xml_fname, nwk_fname
@@ -13,7 +13,6 @@ from future import standard_library
 standard_library.install_hooks()
 from past.builtins import basestring
 
-import copy
 import io
 import itertools
 import os
@@ -23,7 +22,10 @@ from functools import reduce
 
 from .orthoxmlquery import OrthoXMLQuery
 from .newick import NewickLexer, Streamer
-from .tools import PROGRESSBAR, setup_progressbar, py2_iterable
+from .tools import PROGRESSBAR, setup_progressbar, py2_iterable, LRUCache
+from .profiling import phase, profiled
+from .traversal import walk
+from .lca import MRCAIndex
 
 
 class TaxonomyInconsistencyError(Exception):
@@ -77,30 +79,59 @@ class Taxonomy(object):
             return len(parents) + 1
 
     def retain(self, leaves):
-        """ Returns a deepcopy of self with all leaves not in `leaves'
-        pruned away """
-        keep = set(leaves)
+        """ Returns a TaxonomyView of self with all leaves not in `leaves'
+        pruned away. The view shares the nodes (and their histories and
+        comparisons) with self; building it costs O(retained nodes)."""
+        keep = set()
         for leaf in leaves:
-            keep.update(set(self.iterParents(leaf)))
-        lose=set(self.hierarchy.keys()).difference(keep)
-        return self._prune_set_of_nodes(lose)
+            if leaf in keep:
+                continue
+            keep.add(leaf)
+            for parent in self.iterParents(leaf):
+                if parent in keep:
+                    break
+                keep.add(parent)
+        return TaxonomyView(self, keep)
 
     def prune(self, leaves):
-        """ Returns a deepcopy of self with `leaves' pruned away """
+        """ Returns a TaxonomyView of self with `leaves' pruned away """
         all_leaves = {n.name for n in self.hierarchy[self.root].iter_leaves()}
         keep = all_leaves.difference(leaves)
         return self.retain(keep)
 
-    def _prune_set_of_nodes(self, leaves):
-        """ Returns a deepcopy of self with `leaves' pruned away """
-        newtax = copy.deepcopy(self)
-        for loser in leaves:
-            if loser in newtax.hierarchy:
-                node = newtax.hierarchy[loser]
-                node.up.down.remove(node)
-                node.up = None
-                del newtax.hierarchy[loser]
-        return newtax
+    def _preorder_ranks(self):
+        """position of every node in a preorder traversal; used to keep
+        the order of children in views. Cached until nodes are added."""
+        ranks = self.__dict__.get('_ranks')
+        if ranks is None or len(ranks) != len(self.hierarchy):
+            ranks = self._ranks = dict((node.name, i) for i, node in
+                                       enumerate(self))
+        return ranks
+
+    # capacity of the memo tables of mrca and _countParentAmongLevelSet
+    memo_capacity = 1 << 16
+
+    def _memo(self, attr, name):
+        """returns the bounded memo table stored in `attr', creating it
+        on first use."""
+        cache = self.__dict__.get(attr)
+        if cache is None:
+            cache = LRUCache(self.memo_capacity, name=name)
+            setattr(self, attr, cache)
+        return cache
+
+    def set_memo_capacity(self, capacity):
+        """sets the number of entries kept in each memo table."""
+        self.memo_capacity = capacity
+        for attr in ('_cpals_cache', '_mrca_cache'):
+            if attr in self.__dict__:
+                self.__dict__[attr].resize(capacity)
+
+    def memo_statistics(self):
+        """hits, misses, evictions and size of the memo tables."""
+        return {'mrca': self._memo('_mrca_cache', 'Taxonomy.mrca').stats(),
+                'countParentAmongLevelSet': self._memo(
+                    '_cpals_cache', 'Taxonomy.countParentAmongLevelSet').stats()}
 
     def _countParentAmongLevelSet(self, levels):
         """helper method to count for each level how many levels
@@ -109,37 +140,47 @@ class Taxonomy(object):
               \>D->E
         will return A=0,B=1,C=2,D=2,E=3
         Cached to speed up multiple calls"""
-        if not hasattr(self, '_cpals_cache'):
-            self._cpals_cache = {}
+        cache = self._memo('_cpals_cache', 'Taxonomy.countParentAmongLevelSet')
         levelSet = frozenset(levels)
-        try:
-            return self._cpals_cache[levelSet]
-        except KeyError:
+        counts = cache.get(levelSet)
+        if counts is None:
             counts = dict()
             for lev in levelSet:
                 t = set(self.iterParents(lev)).intersection(levelSet)
                 counts[lev] = len(t)
-            self._cpals_cache[levelSet] = counts
-            return counts
+            cache[levelSet] = counts
+        return counts
 
     def mrca(self, species):
         """Returns most recent common ancestor (MRCA) of a set of species
            This is cached to speed up multiple calls """
-        if not hasattr(self, '_mrca_cache'):
-            self._mrca_cache = {}
+        cache = self._memo('_mrca_cache', 'Taxonomy.mrca')
         species = frozenset(species)
-        try:
-            return self._mrca_cache[species]
-        except KeyError:
+        mrca = cache.get(species)
+        if mrca is None:
             if len(species) == 1:
                 mrca, = species
-                self._mrca_cache[species] = mrca
-                return mrca
-            ancestors = [set(self.iterParents(s)) for s in species]
-            common_ancestors = reduce(lambda x, y: x & y, ancestors)
-            mrca = self.mostSpecific(common_ancestors)
-            self._mrca_cache[species] = mrca
-            return mrca
+            else:
+                ancestors = [set(self.iterParents(s)) for s in species]
+                common_ancestors = reduce(lambda x, y: x & y, ancestors)
+                mrca = self.mostSpecific(common_ancestors)
+            cache[species] = mrca
+        return mrca
+
+    def mrca_index(self):
+        """the MRCAIndex of the taxonomy, answering many MRCA queries
+        in one vectorized pass (requires numpy). Cached until nodes are
+        added."""
+        index = self.__dict__.get('_mrca_index')
+        if index is None or len(index) != len(self.hierarchy):
+            index = self._mrca_index = MRCAIndex(self)
+        return index
+
+    def mrca_batch(self, species_sets):
+        """Returns the MRCAs of many sets of species at once; None for
+        empty sets. See MRCAIndex for queries on bitmasks or compressed
+        rows of species indices."""
+        return self.mrca_index().mrca(species_sets)
 
     def mostSpecific(self, levels):
         """returns the most specific (youngest) level among a set of
@@ -178,6 +219,22 @@ class Taxonomy(object):
 
         return [lev for lev in levels if lev in self.younger_nodes[oldest_permitted]]
 
+    def extractDescendentSpecies(self):
+        """
+        Caches some frequently looked-up information - descendent leaves of every node
+        """
+        self.descendents = {}
+        for k, v in self.hierarchy.items():
+            self.descendents[k] = set(l.name for l in v.iter_leaves())
+
+    def extractYoungerNodes(self):
+        """
+        Caches some frequently looked-up information - descendent nodes of every node
+        """
+        self.younger_nodes = {}
+        for k, v in self.hierarchy.items():
+            self.younger_nodes[k] = set(n.name for n in v.iter_preorder())
+
     def printSubTreeR(self, fd, lev=None, indent=0):
         if lev is None:
             lev = self.root
@@ -187,52 +244,56 @@ class Taxonomy(object):
 
     def get_histories(self, parser, verbosity=0):
 
-        histories = {}
-
-        if PROGRESSBAR and verbosity > 0:
-            pbar = setup_progressbar('Getting histories', len(self.hierarchy))
-            pbar.start()
+        with phase('get_histories') as ph:
+            histories = {}
 
-        for i, level in enumerate(self.hierarchy, start=1):
-            history = parser.getFamHistory()
-            history.analyzeLevel(level)
-            histories[level] = history
-            self.hierarchy[level].attach_fam_history(history)
             if PROGRESSBAR and verbosity > 0:
-                pbar.update(i)
+                pbar = setup_progressbar('Getting histories', len(self.hierarchy))
+                pbar.start()
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar.finish()
+            for i, level in enumerate(self.hierarchy, start=1):
+                history = parser.getFamHistory()
+                history.analyzeLevel(level)
+                histories[level] = history
+                self.hierarchy[level].attach_fam_history(history)
+                if PROGRESSBAR and verbosity > 0:
+                    pbar.update(i)
 
-        self.histories = histories
-        return histories
+            if PROGRESSBAR and verbosity > 0:
+                pbar.finish()
+            ph.count(len(histories))
 
-    def get_comparisons(self, parser, verbosity=0):
+            self.histories = histories
+            return histories
 
-        if getattr(self, 'histories', None) is None:
-            self.get_histories(parser)
+    def get_comparisons(self, parser, verbosity=0):
 
-        comparisons = {}
-        to_compare = [(node, child) for node in self
-                                    for child in node.down]
+        with phase('get_comparisons') as ph:
+            if getattr(self, 'histories', None) is None:
+                self.get_histories(parser)
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar = setup_progressbar('Comparing', len(to_compare))
-            pbar.start()
+            comparisons = {}
+            to_compare = [(node, child) for node in self
+                                        for child in node.down]
 
-        for i, (parent, child) in enumerate(to_compare, start=1):
-            parent_history = self.histories[parent.name]
-            child_history = self.histories[child.name]
-            parent_child_comparison = parent_history.compare(child_history)
-            comparisons[(parent.name, child.name)] = parent_child_comparison
-            child.attach_level_comparison_result(parent_child_comparison)
             if PROGRESSBAR and verbosity > 0:
-                pbar.update(i)
+                pbar = setup_progressbar('Comparing', len(to_compare))
+                pbar.start()
+
+            for i, (parent, child) in enumerate(to_compare, start=1):
+                parent_history = self.histories[parent.name]
+                child_history = self.histories[child.name]
+                parent_child_comparison = parent_history.compare(child_history)
+                comparisons[(parent.name, child.name)] = parent_child_comparison
+                child.attach_level_comparison_result(parent_child_comparison)
+                if PROGRESSBAR and verbosity > 0:
+                    pbar.update(i)
 
-        if PROGRESSBAR and verbosity > 0:
-            pbar.finish()
+            if PROGRESSBAR and verbosity > 0:
+                pbar.finish()
+            ph.count(len(to_compare))
 
-        return comparisons
+            return comparisons
 
     def newick(self):
         return str(self.hierarchy[self.root]) + ';'
@@ -336,6 +397,7 @@ class XMLTaxonomy(Taxonomy):
 
 
 class TaxRangeOrthoXMLTaxonomy(Taxonomy):
+    @profiled('TaxRangeOrthoXMLTaxonomy')
     def __init__(self, parser):
         self.parser = parser
         self.extractAdjacencies()
@@ -344,36 +406,39 @@ class TaxRangeOrthoXMLTaxonomy(Taxonomy):
         self.extractDescendentSpecies()
         self.extractYoungerNodes()
 
-    def _parseParentChildRelsR(self, grp):
-        levels = None
-        if self.parser.is_ortholog_group(grp):
-            levels = [l.get('value') for l in grp.findall(
-                './{{{ns0}}}property[@name="TaxRange"]'
-                .format(**self.parser.ns))]
-        directChildNodes = list(grp)
-        children = [child for child in directChildNodes
-                    if self.parser.is_evolutionary_node(child)]
-        geneRefs = [node for node in directChildNodes
-                    if OrthoXMLQuery.is_geneRef_node(node)]
-        speciesOfGenes = {self.parser.mapGeneToSpecies(x.get('id'))
-                          for x in geneRefs}
-
-        # recursively process childreen nodes
-        subLevs = speciesOfGenes
-        for child in children:
-            subLevs.update(self._parseParentChildRelsR(child))
-
-        if levels is not None:
-            for parent in levels:
-                for child in subLevs:
-                    self.adj.add((parent, child))
-            subLevs = set(levels)
-        return subLevs
+    def _parseParentChildRels(self, fam):
+        """adds the (parent, child) level pairs of the family `fam' to
+        the adjacencies."""
+        parser = self.parser
+        propertyTag = '{{{ns0}}}property'.format(**parser.ns)
+
+        def enter(grp, ctx):
+            return ((child, None) for child in grp
+                    if parser.is_evolutionary_node(child))
+
+        def leave(grp, ctx, below):
+            levels = None
+            if parser.is_ortholog_group(grp):
+                levels = [l.get('value') for l in grp.iterchildren(propertyTag)
+                          if l.get('name') == 'TaxRange']
+            subLevs = {parser.mapGeneToSpecies(x.get('id'))
+                       for x in grp if OrthoXMLQuery.is_geneRef_node(x)}
+            for levs in below:
+                subLevs.update(levs)
+
+            if levels is not None:
+                for parent in levels:
+                    for child in subLevs:
+                        self.adj.add((parent, child))
+                subLevs = set(levels)
+            return subLevs
+
+        return walk(fam, enter, leave)
 
     def extractAdjacencies(self):
         self.adj = set()
         for grp in self.parser.getToplevelGroups():
-            self._parseParentChildRelsR(grp)
+            self._parseParentChildRels(grp)
 
         self.nodes = set(itertools.chain(*self.adj))
 
@@ -416,22 +481,6 @@ class TaxRangeOrthoXMLTaxonomy(Taxonomy):
                 return False
         return True
 
-    def extractDescendentSpecies(self):
-        """
-        Caches some frequently looked-up information - descendent leaves of every node
-        """
-        self.descendents = {}
-        for k, v in self.hierarchy.items():
-            self.descendents[k] = set(l.name for l in v.iter_leaves())
-
-    def extractYoungerNodes(self):
-        """
-        Caches some frequently looked-up information - descendent nodes of every node
-        """
-        self.younger_nodes = {}
-        for k, v in self.hierarchy.items():
-            self.younger_nodes[k] = set(n.name for n in v.iter_preorder())
-
 
 @py2_iterable
 class Queue(object):
@@ -579,6 +628,93 @@ class TaxNode(object):
         self.comparison = comparison
 
 
+class TaxNodeView(TaxNode):
+    """TaxNode of a TaxonomyView. `up' and `down' link to the other
+    visible nodes, history and comparison are those of the wrapped
+    node."""
+
+    def __init__(self, node):
+        self.node = node
+        self.name = node.name
+        self.up = None
+        self.down = list()
+
+    @property
+    def history(self):
+        return self.node.history
+
+    @history.setter
+    def history(self, history):
+        self.node.history = history
+
+    @property
+    def comparison(self):
+        return self.node.comparison
+
+    @comparison.setter
+    def comparison(self, comparison):
+        self.node.comparison = comparison
+
+    def __getattr__(self, attr):
+        if attr == 'node':
+            raise AttributeError(attr)
+        return getattr(self.node, attr)
+
+
+class TaxonomyView(Taxonomy):
+    """ Induced subtree of a taxonomy: only the nodes in `names' are
+    visible. Nothing is copied - the view wraps the nodes of `base' and
+    shares their histories and comparisons (attaching a history to a
+    view node attaches it to the node of `base'). All names must be
+    closed under parents, as produced by Taxonomy.retain. """
+
+    def __init__(self, base, names):
+        self.base = base.base if isinstance(base, TaxonomyView) else base
+        self.hierarchy = dict()
+        ranks = self.base._preorder_ranks()
+        self.root = None
+        for name in sorted(names, key=ranks.__getitem__):
+            node = self.base.hierarchy[name]
+            view = self.hierarchy[name] = TaxNodeView(node)
+            if node.up is None or node.up.name not in self.hierarchy:
+                if self.root is not None:
+                    raise TaxonomyInconsistencyError(
+                        'view has several roots: {}, {}'
+                        .format(self.root, name))
+                self.root = name
+            else:
+                parent = self.hierarchy[node.up.name]
+                view.up = parent
+                parent.down.append(view)
+        histories = getattr(self.base, 'histories', None)
+        if histories is not None:
+            self.histories = dict((name, histories[name])
+                                  for name in self.hierarchy
+                                  if name in histories)
+        self._descendents = self._younger_nodes = None
+
+    # computed on first use only, as for large views they are not needed
+    @property
+    def descendents(self):
+        if self._descendents is None:
+            self.extractDescendentSpecies()
+        return self._descendents
+
+    @descendents.setter
+    def descendents(self, descendents):
+        self._descendents = descendents
+
+    @property
+    def younger_nodes(self):
+        if self._younger_nodes is None:
+            self.extractYoungerNodes()
+        return self._younger_nodes
+
+    @younger_nodes.setter
+    def younger_nodes(self, younger_nodes):
+        self._younger_nodes = younger_nodes
+
+
 class NewickTaxonomy(Taxonomy):
 
     """ Create a taxonomy from a file or filehandle in newick format. The
@@ -640,6 +776,8 @@ class NewickTaxonomy(Taxonomy):
 
         for child in root_node.down:
             _annotate(self, child, levels_dict)
+        self.extractDescendentSpecies()
+        self.extractYoungerNodes()
 
     def populate(self, root):
         if len(root.down) == 0:
@@ -710,6 +848,8 @@ class NewickTaxonomy(Taxonomy):
 
             elif token.typ == tokens.ENDTREE:  # trigger for tree-finalising functions
                 self.populate(self.root)
+                self.extractDescendentSpecies()
+                self.extractYoungerNodes()
                 del self.lexer
                 return
 
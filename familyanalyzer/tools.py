@@ -7,6 +7,10 @@ from future.builtins import range
 from future import standard_library
 standard_library.install_hooks()
 
+import collections
+import threading
+import weakref
+
 try:
     from progressbar import ProgressBar, Percentage, Timer, ETA, Bar
     PROGRESSBAR = True
@@ -74,3 +78,112 @@ def py2_iterable(Class):
         setattr(Class, 'next', next_method)
 
     return Class
+
+
+class LRUCache(object):
+    """A bounded mapping that evicts the least recently used entry
+    once more than `maxsize` items are stored. Lookups through get()
+    are counted as hits or misses, so the usefulness of a cache can be
+    inspected with stats(). Access is guarded by a lock, so an instance
+    can be shared between threads.
+
+    Named caches are registered globally and their statistics are
+    reported by cache_statistics()."""
+
+    def __init__(self, maxsize=128, name=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be positive')
+        self.maxsize = maxsize
+        self.name = name
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        if name is not None:
+            _CACHES.add(self)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        if self.name is not None:
+            _CACHES.add(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def __getitem__(self, key):
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            self._shrink()
+
+    def _shrink(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        """changes the capacity, evicting entries if necessary."""
+        if maxsize < 1:
+            raise ValueError('maxsize must be positive')
+        with self._lock:
+            self.maxsize = maxsize
+            self._shrink()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / lookups if lookups else None}
+
+
+_CACHES = weakref.WeakSet()
+
+
+def cache_statistics():
+    """returns the summed up statistics of all live named LRUCache
+    instances, keyed by cache name."""
+    res = dict()
+    for cache in list(_CACHES):
+        stats = cache.stats()
+        agg = res.setdefault(cache.name, dict(hits=0, misses=0, evictions=0,
+                                              size=0, maxsize=0, instances=0))
+        for key in ('hits', 'misses', 'evictions', 'size', 'maxsize'):
+            agg[key] += stats[key]
+        agg['instances'] += 1
+    for agg in res.values():
+        lookups = agg['hits'] + agg['misses']
+        agg['hit_rate'] = agg['hits'] / lookups if lookups else None
+    return res
@@ -0,0 +1,115 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Top-k family queries: the families at a level (or on an edge between
+#  two levels) are analyzed one at a time with the level analysis used
+#  by FamHistory, scored and kept in a bounded heap. Neither the
+#  FamHistory nor the LevelComparisonResult of the level is built, so
+#  only the k best families are kept in memory.
+#
+import heapq
+
+from .familyanalyzer import GroupAnnotator, LevelAnalysisFactory
+
+
+class TopKError(Exception):
+    pass
+
+
+def _size(summary):
+    return sum(len(s.genes) for s in summary.values())
+
+
+def _copy_number(summary):
+    return max([len(s.genes) for s in summary.values()] or [0])
+
+
+def _losses(summary):
+    return sum(1 for s in summary.values() if s.typ == 'ANCIENT_BUT_LOST')
+
+
+# scores of a family at a level, computed from its species summary
+LEVEL_METRICS = {'size': _size,
+                 'copy_number': _copy_number,
+                 'losses': _losses}
+
+EDGE_METRICS = ('duplications', 'losses')
+
+
+def _check(metric, metrics):
+    if metric not in metrics:
+        raise TopKError('Unknown metric: {}; expected one of {}'
+                        .format(metric, ', '.join(sorted(metrics))))
+
+
+def _prepare(parser):
+    # as getFamHistory, LOFT annotate the document if needed
+    if hasattr(parser, 'isLoftAnnotated') and not parser.isLoftAnnotated():
+        GroupAnnotator(parser).annotateDoc()
+
+
+def top_families(parser, level, k=10, metric='size', species=None):
+    """the `k' families at `level' with the largest `metric' (see
+    LEVEL_METRICS) as (LOFT id, score) pairs, best first; ties keep
+    the document order. `parser' is an OrthoXMLParser or CompactHOGs,
+    `species' restricts the analysis as in getFamHistory."""
+    _check(metric, LEVEL_METRICS)
+    _prepare(parser)
+    score = LEVEL_METRICS[metric]
+    speciesFilter = parser.getSpeciesFilter(species)
+    analyzer = LevelAnalysisFactory().newLevelAnalysis(parser, speciesFilter)
+
+    def scored():
+        for node in parser.iterSubFamilies(level):
+            fam = parser.newGeneFamily(node)
+            yield fam.getFamId(), score(analyzer.analyzeGeneFam(fam, level))
+
+    return heapq.nlargest(k, scored(), key=lambda x: x[1])
+
+
+def top_edge_families(parser, parent_level, child_level, k=10,
+                      metric='duplications', species=None):
+    """the `k' families at `parent_level' with the most duplications or
+    losses on the way to `child_level', as (LOFT id, count) pairs, best
+    first. The duplications of a family are counted as in
+    LevelComparisonResult.summarise, i.e. the number of subfamilies it
+    duplicated into; its losses are the species below `child_level'
+    without a gene of the family."""
+    _check(metric, EDGE_METRICS)
+    _prepare(parser)
+    speciesFilter = parser.getSpeciesFilter(species)
+    if metric == 'losses':
+        if parser.tax is None:
+            raise TopKError('losses on an edge require a taxonomy')
+        covered = parser.tax.descendents[child_level]
+        if speciesFilter is not None:
+            covered = covered.intersection(speciesFilter.species)
+
+    def scored():
+        last = None
+        for node in parser.iterSubFamilies(parent_level):
+            fam = parser.newGeneFamily(node)
+            famId = fam.getFamId()
+            if famId == last:
+                # an orthologGroup nested in the previous one at the
+                # same level; its genes and subfamilies are counted there
+                continue
+            last = famId
+            if metric == 'duplications':
+                subfams = [parser.newGeneFamily(sub).getFamId() for sub in
+                           parser.iterSubFamilies(child_level, node)]
+                # as in Comparer, a subfamily with the family's own id
+                # makes it identical on the edge
+                count = 0 if famId in subfams else len(subfams)
+            else:
+                present = {parser.mapGeneToSpecies(gene) for gene in
+                           fam.getMemberGenes(speciesFilter)}
+                count = len(covered.difference(present))
+            yield famId, count
+
+    return heapq.nlargest(k, scored(), key=lambda x: x[1])
@@ -0,0 +1,44 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+#
+#  Depth first traversal of HOGs (nested orthologGroup / paralogGroup
+#  elements) with an explicit stack instead of recursion, so that the
+#  depth of the families is not limited by the recursion limit of the
+#  interpreter.
+#
+
+
+def walk(root, enter, leave=None, context=None):
+    """walks the subtree of `root' depth first.
+
+    enter(node, context) is called in pre-order and returns the
+    (child, child context) pairs to descend into, in the order they
+    are to be visited, or None if the children are not visited. The
+    pairs are consumed lazily, i.e. after the subtrees of the previous
+    children have been walked.
+
+    leave(node, context, results) is called in post-order with the
+    list of values returned by leave for the visited children. walk
+    returns the value of leave for `root' (None without leave)."""
+    top = []
+    # frames: [node, context, pending children, results of the children,
+    #          list receiving the result of the node]
+    stack = [[root, context, None, None, top]]
+    while stack:
+        frame = stack[-1]
+        if frame[2] is None:
+            frame[2] = iter(enter(frame[0], frame[1]) or ())
+            frame[3] = []
+        for child, child_context in frame[2]:
+            stack.append([child, child_context, None, None, frame[3]])
+            break
+        else:
+            stack.pop()
+            if leave is not None:
+                frame[4].append(leave(frame[0], frame[1], frame[3]))
+    return top[0] if top else None
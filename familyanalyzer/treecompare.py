@@ -0,0 +1,253 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future.builtins import str
+from future import standard_library
+standard_library.install_hooks()
+from past.builtins import basestring
+
+#
+#  Robinson-Foulds comparison of trees. Every inner node of a tree is
+#  encoded as the integer bitset of the leaves below it, over a leaf
+#  index shared between the compared trees. Unrooted bipartitions,
+#  collapsing of weakly supported branches and the symmetric difference
+#  are then plain integer operations.
+#
+import io
+
+from .genetree import GeneTree
+from .newick import NewickLexer, Streamer
+
+
+class TreeCompareError(Exception):
+    pass
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+class LeafIndex(object):
+    """assigns a bit position to every leaf label."""
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.bits = dict()
+        for label in labels:
+            self.bit(label)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def bit(self, label):
+        bit = self.bits.get(label)
+        if bit is None:
+            bit = self.bits[label] = 1 << len(self.labels)
+            self.labels.append(label)
+        return bit
+
+    def labels_of(self, bits):
+        return [label for i, label in enumerate(self.labels) if bits >> i & 1]
+
+
+class TreeSplits(object):
+    """the clusters of a tree: `leaves' is the bitset of all leaves and
+    `nodes' a list of (bitset, support) tuples, one per inner node
+    (the root included). Inner nodes with a single child are not
+    represented; support is None if the node carries no value."""
+
+    def __init__(self, index, leaves, nodes):
+        self.index = index
+        self.leaves = leaves
+        self.nodes = nodes
+        self._splits = None
+
+    @classmethod
+    def from_genetree(cls, tree, index=None, losses=False):
+        """encodes a GeneTree (or GeneTreeNode). Loss nodes are ignored
+        unless `losses' is set."""
+        if index is None:
+            index = LeafIndex()
+        root = tree.root if isinstance(tree, GeneTree) else tree
+        nodes = []
+        frames = [[]]
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                kids = [b for b in frames.pop() if b]
+                bits = 0
+                for b in kids:
+                    bits |= b
+                if len(kids) > 1:
+                    nodes.append((bits, None))
+                frames[-1].append(bits)
+            elif node.node_type == 'loss' and not losses:
+                continue
+            elif node.is_leaf():
+                frames[-1].append(index.bit(node.name))
+            else:
+                stack.append((node, True))
+                frames.append([])
+                stack.extend((child, False)
+                             for child in reversed(node.children))
+        return cls(index, frames[0][0] if frames[0] else 0, nodes)
+
+    @classmethod
+    def iter_newick(cls, stream, index=None):
+        """yields the TreeSplits of all trees in a newick string or text
+        stream. Support values are taken from the inner node labels."""
+        if index is None:
+            index = LeafIndex()
+        if isinstance(stream, basestring):
+            stream = io.StringIO(str(stream))
+        lexer = NewickLexer(Streamer(stream))
+        tokens = lexer.tokens
+
+        def label_and_support():
+            label = next(lexer)
+            length = next(lexer)
+            if length.typ != tokens.LENGTH:
+                raise TreeCompareError('Expected a length, found {0}'
+                                       .format(length))
+            if label.typ == tokens.SUPPORT:
+                return None, label.val
+            try:
+                return label.val, float(label.val)
+            except (TypeError, ValueError):
+                return label.val, None
+
+        frames, nodes = [], []
+        for token in lexer:
+            if token.typ == tokens.EOF:
+                return
+            elif token.typ in (tokens.TREE, tokens.SUBTREE):
+                frames.append([0, 0])
+            elif token.typ == tokens.LEAF:
+                label, _ = label_and_support()
+                frames[-1][0] |= index.bit(label)
+                frames[-1][1] += 1
+            elif token.typ == tokens.ENDSUB:
+                _, support = label_and_support()
+                bits, nr_children = frames.pop()
+                if nr_children > 1:
+                    nodes.append((bits, support))
+                if frames:
+                    frames[-1][0] |= bits
+                    frames[-1][1] += 1
+                else:
+                    frames.append([bits, nr_children])
+            elif token.typ == tokens.ENDTREE:
+                yield cls(index, frames.pop()[0] if frames else 0, nodes)
+                frames, nodes = [], []
+            else:
+                raise TreeCompareError('Unexpected token in stream: {0}'
+                                       .format(token))
+
+    @classmethod
+    def from_newick(cls, newick, index=None):
+        """encodes the first tree of a newick string or stream."""
+        for splits in cls.iter_newick(newick, index):
+            return splits
+        raise TreeCompareError('no tree found')
+
+    @property
+    def nr_internal(self):
+        """number of inner nodes of the unrooted tree, i.e. a bifurcating
+        root is merged with its inner child."""
+        return len(self.splits) + 1 if self.nodes else 0
+
+    @property
+    def splits(self):
+        """the set of non-trivial unrooted bipartitions. Each is given
+        by the side not containing the lowest leaf."""
+        if self._splits is None:
+            self._splits = unrooted_splits(self.leaves,
+                                           (b for b, _ in self.nodes))
+        return self._splits
+
+    def collapse(self, threshold):
+        """returns a copy in which all inner nodes (but the root) with a
+        support below `threshold' are removed."""
+        return TreeSplits(self.index, self.leaves,
+                          [(b, s) for b, s in self.nodes
+                           if s is None or s >= threshold or
+                           b == self.leaves])
+
+    def newick(self):
+        """the topology in newick format (without a trailing ';')."""
+        # subtrees not yet joined, keyed by their leaf bitset. children
+        # are ordered by their lowest leaf
+        tops = dict((bit, label) for label, bit in self.index.bits.items()
+                    if bit & self.leaves)
+        for bits in sorted(set(b for b, _ in self.nodes), key=popcount):
+            kids = sorted((k for k in tops if k & bits == k),
+                          key=lambda k: k & -k)
+            if len(kids) > 1:
+                tops[bits] = '({0})'.format(', '.join(tops.pop(k)
+                                                      for k in kids))
+        if len(tops) == 1:
+            return list(tops.values())[0]
+        return '({0})'.format(', '.join(tops[k] for k in
+                                        sorted(tops, key=lambda k: k & -k)))
+
+
+def unrooted_splits(leaves, clusters):
+    low = leaves & -leaves
+    n = popcount(leaves)
+    splits = set()
+    for bits in clusters:
+        bits &= leaves
+        if bits & low:
+            bits ^= leaves
+        if 1 < popcount(bits) < n - 1:
+            splits.add(bits)
+    return frozenset(splits)
+
+
+def robinson_foulds(t1, t2):
+    """unweighted Robinson-Foulds distance (symmetric difference of the
+    unrooted bipartitions). Trees with different leaf sets are compared
+    on their common leaves."""
+    if t1.leaves == t2.leaves:
+        s1, s2 = t1.splits, t2.splits
+    else:
+        common = t1.leaves & t2.leaves
+        s1 = unrooted_splits(common, (b for b, _ in t1.nodes))
+        s2 = unrooted_splits(common, (b for b, _ in t2.nodes))
+    return len(s1 ^ s2)
+
+
+def congruence(hogtree, genetree, threshold=None):
+    """compares the tree of a HOG with a gene tree, whose branches with
+    a support below `threshold' are collapsed first. Returns the same
+    dict as TreeComparator.summarise of the congruence module."""
+    collapsed = (genetree.collapse(threshold) if threshold is not None
+                 else genetree)
+    diff = robinson_foulds(collapsed, hogtree)
+    nodes = collapsed.nr_internal + hogtree.nr_internal
+    return {'symmetric_difference': diff,
+            'nodes_hog': hogtree.nr_internal,
+            'nodes_gene': genetree.nr_internal,
+            'nodes_collapsed': collapsed.nr_internal,
+            'congruence': 1 - diff / nodes if nodes else 1.}
+
+
+def _as_splits(tree, index):
+    if isinstance(tree, TreeSplits):
+        return tree
+    if isinstance(tree, GeneTree):
+        return TreeSplits.from_genetree(tree, index)
+    return TreeSplits.from_newick(tree, index)
+
+
+def compare_many(pairs, threshold=None, index=None):
+    """congruence of many (hogtree, genetree) pairs; each tree is given
+    as GeneTree, TreeSplits or newick string. All trees are encoded
+    over one leaf index. Returns the list of result dicts."""
+    if index is None:
+        index = LeafIndex()
+    return [congruence(_as_splits(hog, index), _as_splits(gene, index),
+                       threshold)
+            for hog, gene in pairs]
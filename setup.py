@@ -29,5 +29,7 @@ setup(
          ],
     packages=find_packages(),
     install_requires=['lxml', 'progressbar-latest', 'future'],
-    scripts=['bin/familyanalyzer']
+    scripts=['bin/familyanalyzer', 'bin/fa_server', 'bin/fa_benchmark',
+             'bin/fa_congruence', 'bin/fa_genelineage',
+             'bin/fa_sqlite', 'bin/fa_annotate']
 )
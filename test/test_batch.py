@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.batch import (BatchJob, BatchRunner, BatchError,
+                                  read_job_file)
+
+
+class BatchRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(tax)
+        self.outdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir)
+
+    def single_run(self, job):
+        out = io.StringIO()
+        BatchRunner(self.op, self.outdir).write_job(job, out)
+        return out.getvalue()
+
+    def test_job_spec(self):
+        job = BatchJob.from_spec('Mammalia:Primates', ['HUMAN'])
+        self.assertEqual((job.level, job.second_level, job.species),
+                         ('Mammalia', 'Primates', ['HUMAN']))
+        self.assertEqual(job.name, 'Mammalia_vs_Primates')
+        self.assertEqual(BatchJob('HUMAN/PANTR').name, 'HUMAN_PANTR')
+
+    def test_job_file(self):
+        jobs = read_job_file(io.StringIO('# comment\nVertebrata\n\n'
+                                         'Mammalia\tPrimates\n'
+                                         'Primates\t\tHUMAN,PANTR\n'),
+                             species=['MOUSE'])
+        self.assertEqual([(j.level, j.second_level, j.species) for j in jobs],
+                         [('Vertebrata', None, ['MOUSE']),
+                          ('Mammalia', 'Primates', ['MOUSE']),
+                          ('Primates', None, ['HUMAN', 'PANTR'])])
+
+    def test_parallel_jobs_write_own_files(self):
+        jobs = [BatchJob('Vertebrata'), BatchJob('Mammalia', 'Primates'),
+                BatchJob('Primates', species=['HUMAN'])]
+        results = BatchRunner(self.op, self.outdir, processes=3).run(jobs)
+        self.assertEqual([(job, error) for job, _, error in results],
+                         [(job, None) for job in jobs])
+        for job, fname, _ in results:
+            self.assertEqual(fname, os.path.join(self.outdir,
+                                                 job.name + '.txt'))
+            with io.open(fname) as fh:
+                report = fh.read()
+            self.assertEqual(sorted(report.splitlines()),
+                             sorted(self.single_run(job).splitlines()))
+        with io.open(results[1][1]) as fh:
+            self.assertIn('FamilyAnalysis at Primates', fh.read())
+
+    def test_unknown_level(self):
+        runner = BatchRunner(self.op, self.outdir)
+        self.assertRaises(BatchError, runner.run, [BatchJob('Mammalia'),
+                                                   BatchJob('Fungi')])
+
+    def test_level_of_taxonomy_only(self):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        tax = fa.NewickTaxonomy(io.StringIO(
+            "((CANFA,(((HUMAN,PANTR)Hominidae)Primates,(RATNO,MOUSE)Rodents)"
+            "Euarchontoglires)Mammalia,XENTR)Vertebrata;"))
+        op.augmentTaxonomyInfo(tax)
+        self.assertNotIn('Hominidae', op.getLevels())
+        (job, fname, error), = BatchRunner(op, self.outdir).run(
+            [BatchJob('Hominidae')])
+        self.assertIsNone(error)
+        with io.open(fname) as fh:
+            self.assertIn('FamilyAnalysis at Hominidae', fh.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
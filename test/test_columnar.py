@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import os
+import shutil
+import tempfile
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.columnar import (ColumnarWriter, ColumnarReader,
+                                     ColumnarError, export_taxonomy, numpy)
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class ColumnarTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'export.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def history(self, level):
+        hist = self.op.getFamHistory()
+        hist.analyzeLevel(level)
+        return hist
+
+    def test_history_rows_match_text_report(self):
+        hist = self.history('Primates')
+        hist.setXRefTag('protId')
+        with ColumnarWriter(self.path, self.op, chunk_rows=4) as out:
+            out.add_history(hist)
+        expected = set()
+        for fam in hist:
+            for spec, elem in fam.summary.items():
+                for gene in elem.genes or [None]:
+                    expected.add(('Primates', fam.getFamId(), spec, elem.typ,
+                                  gene and self.op.mapGeneToXRef(gene,
+                                                                 'protId')))
+        rows = list(ColumnarReader(self.path).iter_families())
+        self.assertEqual(len(rows), len(expected))
+        self.assertEqual(set(rows), expected)
+
+    def test_comparison_events(self):
+        comp = self.history('Vertebrata').compare(self.history('Mammalia'))
+        with ColumnarWriter(self.path, self.op) as out:
+            out.add_comparison(comp)
+        events = list(ColumnarReader(self.path).iter_events())
+        self.assertEqual(sorted((fam, ev) for _, _, fam, ev, _ in events),
+                         sorted((ev.fam, ev.event) for ev in comp))
+        self.assertEqual(set(events[0][:2]), {'Vertebrata', 'Mammalia'})
+
+    def test_export_taxonomy(self):
+        export_taxonomy(self.op, self.tax, self.path)
+        reader = ColumnarReader(self.path)
+        self.assertEqual(set(reader.dictionary('level')),
+                         set(self.tax.hierarchy))
+        self.assertEqual(len(set(zip(reader.events['level1'].tolist(),
+                                     reader.events['level2'].tolist()))),
+                         len(self.tax.hierarchy) - 1)
+
+    def test_unknown_format(self):
+        with self.assertRaises(ColumnarError):
+            ColumnarWriter(self.path, self.op, fmt='csv')
+
+if __name__ == '__main__':
+    unittest.main()
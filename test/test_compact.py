@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import subprocess
+import sys
+import textwrap
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.compact import (CompactHOGs, CompactError, analyze_levels,
+                                    numpy, shared_memory, ORTHOLOG, GENEREF)
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class CompactHOGsTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.op.augmentSingletons()
+        self.hogs = CompactHOGs.from_parser(self.op)
+
+    def history(self, parser, level, species=None):
+        hist = parser.getFamHistory(species)
+        hist.analyzeLevel(level)
+        hist.setXRefTag('protId')
+        return hist
+
+    def test_tree_links(self):
+        hogs = self.hogs
+        for node in range(len(hogs)):
+            children = []
+            child = hogs.first_child[node]
+            while child >= 0:
+                self.assertEqual(hogs.parent[child], node)
+                children.append(child)
+                child = hogs.next_sibling[child]
+            self.assertEqual(children,
+                             [i for i in range(node + 1, hogs.end[node])
+                              if hogs.parent[i] == node])
+        self.assertEqual(len(hogs.getToplevelGroups()),
+                         len(self.op.getToplevelGroups()))
+        self.assertEqual(numpy.count_nonzero(hogs.kind == GENEREF),
+                         len(fa.OrthoXMLQuery.getGeneRefNodes(self.op.root)))
+
+    def test_histories_match_document(self):
+        for level in self.tax.hierarchy:
+            for species in (None, ['HUMAN', 'MOUSE']):
+                self.assertEqual(str(self.history(self.hogs, level, species)),
+                                 str(self.history(self.op, level, species)))
+
+    def test_comparison_matches_document(self):
+        comps = [self.history(p, 'Mammalia').compare(
+                 self.history(p, 'Primates')) for p in (self.op, self.hogs)]
+        self.assertEqual(str(comps[0]), str(comps[1]))
+
+    def test_family_levels(self):
+        fam = self.hogs.newGeneFamily(self.hogs.getToplevelGroups()[0])
+        dom = self.op.newGeneFamily(self.op.getToplevelGroups()[0])
+        self.assertEqual(fam.getLevels(), dom.getLevels())
+        for level in ('Primates', 'Rodents'):
+            self.assertEqual([f.getFamId() for f in fam.analyzeLevel(level)],
+                             [f.getFamId() for f in dom.analyzeLevel(level)])
+        self.assertRaises(CompactError, self.hogs.newGeneFamily,
+                          int(numpy.flatnonzero(self.hogs.kind != ORTHOLOG)[0]))
+
+    @unittest.skipIf(shared_memory is None, 'no shared memory support')
+    def test_attach_shared_block(self):
+        with self.hogs.share() as shared:
+            with CompactHOGs.attach(shared.handle) as attached:
+                self.assertEqual(attached.singletons, self.op.singletons)
+                self.assertEqual(set(attached.tax.hierarchy),
+                                 set(self.tax.hierarchy))
+                self.assertEqual(str(self.history(attached, 'Primates')),
+                                 str(self.history(self.op, 'Primates')))
+
+    @unittest.skipIf(shared_memory is None, 'no shared memory support')
+    def test_resource_tracker_stays_quiet(self):
+        # the resource tracker reports on stderr of the process, so the
+        # block is shared in a fresh interpreter: attached in the same
+        # process, in forked and spawned workers and in an unrelated
+        # process, which must not remove it
+        script = textwrap.dedent("""
+            import json, multiprocessing, subprocess, sys
+            import familyanalyzer as fa
+            from familyanalyzer.compact import CompactHOGs, analyze_levels
+            op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+            op.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(op))
+            with CompactHOGs.from_parser(op).share() as shared:
+                with CompactHOGs.attach(shared.handle):
+                    pass
+                for method in ('fork', 'spawn'):
+                    multiprocessing.set_start_method(method, force=True)
+                    analyze_levels(shared, ['Primates'], processes=2)
+                subprocess.check_call([sys.executable, '-W', 'ignore', '-c', (
+                    'import json, sys\\n'
+                    'from familyanalyzer.compact import CompactHOGs\\n'
+                    'CompactHOGs.attach(json.loads(sys.argv[1])).close()'),
+                    json.dumps(shared.handle)])
+                with CompactHOGs.attach(shared.handle):
+                    pass
+            """)
+        proc = subprocess.Popen([sys.executable, '-W', 'ignore', '-c', script],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        self.assertEqual(proc.returncode, 0, err)
+        self.assertEqual(err.decode(), '')
+
+    @unittest.skipIf(shared_memory is None, 'no shared memory support')
+    def test_analyze_levels_in_workers(self):
+        levels = sorted(self.tax.hierarchy)
+        with self.hogs.share() as shared:
+            res = analyze_levels(shared, levels, processes=2)
+        self.assertEqual(sorted(res), levels)
+        for level in levels:
+            hist = self.history(self.op, level)
+            self.assertEqual(res[level],
+                             [(fam.getFamId(), spec, s.typ, sorted(s.genes))
+                              for fam in hist
+                              for spec, s in fam.summary.items()])
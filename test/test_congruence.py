@@ -0,0 +1,153 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.congruence import (Aligner, TreeBuilder, Collapser,
+                                       TreeComparator, CongruencePipeline,
+                                       CongruenceRunner, CongruenceError,
+                                       Checkpoint, read_fasta, write_phylip)
+
+
+class CopyAligner(Aligner):
+    def align(self, fasta_fname, out_fname):
+        shutil.copy(fasta_fname, out_fname)
+
+
+class HogTreeBuilder(TreeBuilder):
+    """stand-in for phyml: returns the hog tree itself, unless the family
+    is listed in `fail'."""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+
+    def build(self, aln_fname, prefix, bootstrap):
+        if os.path.basename(prefix) in self.fail:
+            raise CongruenceError('tree building failed')
+        out = prefix + '.phy_phyml_tree'
+        shutil.copy(prefix + '.hogtree', out)
+        return out
+
+
+class CopyCollapser(Collapser):
+    def collapse(self, tree_fname, threshold, out_fname):
+        shutil.copy(tree_fname, out_fname)
+
+
+class IdentityComparator(TreeComparator):
+    def compare(self, collapsed, hogtree, genetree):
+        nodes = hogtree.count('(')
+        diff = 0 if collapsed == hogtree else 2 * nodes
+        return self.summarise(diff, nodes, genetree.count('('),
+                              collapsed.count('('))
+
+
+def stand_in_pipeline(fail=()):
+    return CongruencePipeline(CopyAligner(), HogTreeBuilder(fail),
+                              CopyCollapser(), IdentityComparator())
+
+
+class CongruenceRunnerTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.tax.get_histories(self.op)
+        self.tax.get_comparisons(self.op)
+        self.tmpdir = tempfile.mkdtemp()
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        self.seqs = os.path.join(self.tmpdir, 'seqs.fasta')
+        with io.open(self.seqs, 'w') as fh:
+            for xref in sorted(set(self.op._xrefs.values())):
+                fh.write('>{} some description\nMKV\nLAT\n'.format(xref))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def runner(self, pipeline):
+        return CongruenceRunner(self.op, self.tax, pipeline, self.outdir)
+
+    def test_hog_tree_topology(self):
+        tree = self.runner(stand_in_pipeline()).hog_tree('3').write_topology()
+        # the loss of the rat gene is dropped and its parent suppressed
+        self.assertNotIn('LOSS', tree)
+        self.assertEqual(tree.count('('), 6)
+        self.assertEqual(sorted(tree.strip('();').replace('(', '')
+                                .replace(')', '').split(', ')),
+                         ['CANFA3', 'HUMAN3', 'MOUSE3', 'MOUSE4', 'PANTR3',
+                          'PANTR4', 'XENTR3'])
+
+    def test_run_writes_results(self):
+        results = self.runner(stand_in_pipeline()).run(['1', '3'], self.seqs)
+        self.assertEqual([r['congruence'] for r in results], [1, 1])
+        prefix = os.path.join(self.outdir, '3', '3')
+        for ext in ('.FAtree', '.hogtree', '.fasta', '.gtc', '.txt'):
+            self.assertTrue(os.path.exists(prefix + ext), ext)
+        with io.open(prefix + '.fasta') as fh:
+            self.assertEqual(read_fasta(fh)['MOUSE4'], 'MKVLAT')
+
+    def test_native_collapse_and_comparison(self):
+        pipeline = CongruencePipeline(CopyAligner(), HogTreeBuilder(),
+                                      threshold=50)
+        res = self.runner(pipeline).run(['3'], self.seqs)[0]
+        self.assertEqual(res['congruence'], 1)
+        self.assertEqual(res['nodes_removed'], 0)
+        self.assertEqual(res['nodes_hog'], 5)
+
+    def test_parallel_run(self):
+        results = self.runner(stand_in_pipeline()).run(['1', '3'], self.seqs,
+                                                       processes=2)
+        self.assertEqual([r['family'] for r in results], ['1', '3'])
+        self.assertEqual(set(Checkpoint(os.path.join(
+            self.outdir, 'checkpoint.jsonl')).results), {'1', '3'})
+
+    def test_resume_skips_finished_and_retries_failed(self):
+        results = self.runner(stand_in_pipeline(fail=['3'])).run(
+            ['1', '3'], self.seqs)
+        self.assertNotIn('error', results[0])
+        self.assertIn('tree building failed', results[1]['error'])
+
+        seen = []
+        runner = self.runner(stand_in_pipeline())
+        self.assertEqual(runner.pending(['1', '3']), ['3'])
+        results = runner.run(['1', '3'], self.seqs, callback=seen.append)
+        self.assertEqual([r['family'] for r in seen], ['3'])
+        self.assertTrue(all('error' not in r for r in results))
+
+    def test_truncated_checkpoint_line_is_ignored(self):
+        self.runner(stand_in_pipeline()).run(['1'], self.seqs)
+        with io.open(os.path.join(self.outdir, 'checkpoint.jsonl'), 'a') as fh:
+            fh.write('{"family": "3", "congr')
+        runner = self.runner(stand_in_pipeline())
+        self.assertEqual(runner.pending(['1', '3']), ['3'])
+        runner.run(['1', '3'], self.seqs)
+        self.assertEqual(self.runner(stand_in_pipeline()).pending(['1', '3']),
+                         [])
+
+    def test_random_selection_is_kept_on_resume(self):
+        fams = self.runner(stand_in_pipeline()).select_families(num=1, seed=3)
+        for seed in range(10):
+            self.assertEqual(self.runner(stand_in_pipeline())
+                             .select_families(num=1, seed=seed), fams)
+
+    def test_missing_sequence(self):
+        with io.open(self.seqs, 'w') as fh:
+            fh.write('>HUMAN1\nMKV\n')
+        res = self.runner(stand_in_pipeline()).run(['1'], self.seqs)[0]
+        self.assertIn('no sequence', res['error'])
+
+    def test_phylip(self):
+        out = io.StringIO()
+        write_phylip(out, [('a', 'MK-'), ('bcd', 'MKL')])
+        self.assertEqual(out.getvalue(), ' 2 3\na   MK-\nbcd MKL\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,10 @@ from future.builtins import int
 from future import standard_library
 standard_library.install_hooks()
 
+import io
+import os
+import shutil
+import tempfile
 import unittest
 import familyanalyzer as fa
 fa.PROGRESSBAR = False
@@ -335,6 +339,341 @@ class TwoLineageComparisons(unittest.TestCase):
                 res[j].append(fams)
                 self.assertListEqual(res[j][i], expRes[j][i], "failed for {} vs {}".format(lev1, lev2))
 
+    def test_compact_events(self):
+        comp = self.compareLevelsSingletonAware('Vertebrata', 'HUMAN')
+        self.assertEqual(len(comp), 4)
+        self.assertIn('3', comp)
+        self.assertNotIn('3.1a', comp)
+        self.assertEqual(comp['3'], fa.FamDupl('3', '3.1a'))
+        self.assertEqual(comp['3'].into, '3.1a')
+        self.assertListEqual(sorted(comp.iter_events()),
+                             [('1', 'identical', []),
+                              ('2', 'novel', []),
+                              ('3', 'duplicated', ['3.1a']),
+                              ('5', 'singleton', [])])
+        self.assertListEqual(sorted(comp.fams_dict), ['1', '2', '3', '5'])
+        comp.add('3', 'lost')
+        self.assertEqual(comp['3'], fa.FamLost('3'))
+        self.assertEqual(comp.summarise()['duplicated'], 0)
+
+    def test_compact_events_replace_last(self):
+        comp = fa.LevelComparisonResult('Vertebrata', 'HUMAN')
+        comp.add('7', 'identical')
+        comp.add('7', 'novel')
+        comp.add('8', 'duplicated', ['8.1a', '8.1b'])
+        self.assertEqual(len(comp), 2)
+        self.assertEqual(comp['7'], fa.FamNovel('7'))
+        self.assertListEqual(comp['8'].subfamilies, ['8.1a', '8.1b'])
+
+    def test_sorted_views_follow_additions(self):
+        comp = fa.LevelComparisonResult('Vertebrata', 'HUMAN')
+        comp.add('2', 'lost')
+        comp.add('10', 'duplicated', ['10.1a', '10.1b'])
+        comp.add('3', 'novel')
+        comp.addFamily(fa.FamIdent('2'))
+        self.assertListEqual([f.fam for f in comp], ['2', '3', '10'])
+        self.assertListEqual(comp.filter({'identical', 'novel'}),
+                             [fa.FamIdent('2'), fa.FamNovel('3')])
+        self.assertListEqual(sorted(comp.group_fams()),
+                             ['duplicated', 'identical', 'novel'])
+        self.assertEqual(comp.summarise(),
+                         {'identical': 1, 'duplicated': 2, 'lost': 0,
+                          'novel': 1, 'singleton': 0})
+
+
+class SpeciesFilterTest(unittest.TestCase):
+    """restricting the analysis to some species must give the same
+    result as filtering the complete analysis at output."""
+
+    def summaries(self, hist, species=None):
+        res = dict()
+        for fam in hist:
+            for spec, sumElem in fam.summary.items():
+                if species is None or spec in species:
+                    res[(fam.getFamId(), spec)] = (sumElem.typ,
+                                                   sorted(sumElem.genes))
+        return res
+
+    def checkAllLevels(self, parser, speciesSets):
+        for species in speciesSets:
+            speciesFilter = parser.getSpeciesFilter(species)
+            for level in parser.getLevels():
+                full = parser.getFamHistory()
+                full.analyzeLevel(level)
+                restricted = parser.getFamHistory(speciesFilter)
+                restricted.analyzeLevel(level)
+                self.assertEqual(self.summaries(restricted),
+                                 self.summaries(full, species),
+                                 (level, species))
+
+    def test_without_taxonomy(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        self.checkAllLevels(parser, [['HUMAN'], ['MOUSE', 'XENTR']])
+
+    def test_with_taxonomy_and_singletons(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        parser.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(parser))
+        speciesSets = [['HUMAN'], ['RATNO', 'PANTR'],
+                       ['CANFA', 'MOUSE', 'XENTR']]
+        self.checkAllLevels(parser, speciesSets)
+        parser.augmentSingletons()
+        self.checkAllLevels(parser, speciesSets)
+
+    def test_gene_refs_from_species_index(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        parser.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(parser))
+        tag = '{{{ns0}}}geneRef'.format(**parser.ns)
+        for singletons in (False, True):
+            if singletons:
+                parser.augmentSingletons()
+            index = None
+            for species in (['HUMAN'], ['RATNO', 'PANTR'], ['CANFA', 'XX']):
+                speciesFilter = parser.getSpeciesFilter(species)
+                self.assertEqual(speciesFilter.geneRefs(parser),
+                                 [gref for gref in parser.root.iter(tag)
+                                  if gref.get('id') in speciesFilter.genes])
+                # the document is indexed once for all filters
+                if index is not None:
+                    self.assertIs(parser._geneRefsBySpecies(), index)
+                index = parser._geneRefsBySpecies()
+
+    def test_compare_with_singletons(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        parser.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(parser))
+        parser.augmentSingletons()
+
+        def events(species):
+            hists = []
+            for level in ('Primates', 'HUMAN'):
+                hist = parser.getFamHistory(species)
+                hist.analyzeLevel(level)
+                hists.append(hist)
+            return sorted(hists[0].compare(hists[1]).iter_events())
+
+        self.assertIn(('5', 'singleton', []), events(None))
+        self.assertEqual(events(['PANTR']), events(None))
+
+    def test_member_genes(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        fam = fa.GeneFamily(parser.getToplevelGroups()[0])
+        speciesFilter = parser.getSpeciesFilter(['HUMAN', 'PANTR'])
+        self.assertEqual(set(fam.getMemberGenes(speciesFilter)), {'1', '11'})
+        self.assertEqual(parser.get_species_below_node(fam.root,
+                                                       speciesFilter),
+                         {'HUMAN', 'PANTR'})
+
+
+class SingletonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        self.parser.augmentTaxonomyInfo(
+            fa.TaxonomyFactory.newTaxonomy(self.parser))
+        self.parser.augmentSingletons()
+
+    def test_singleton_ids_follow_families(self):
+        self.assertEqual(self.parser.singletons, {'4', '5'})
+        groups = self.parser.getToplevelGroups()
+        self.assertEqual([g.get('id') for g in groups[-2:]], ['4', '5'])
+
+    def test_families_without_id(self):
+        # annotateDoc numbers families without id by position, so the
+        # singletons follow these numbers
+        for with_taxonomy in (True, False):
+            parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+            for fam in parser.getToplevelGroups():
+                del fam.attrib['id']
+            if with_taxonomy:
+                parser.augmentTaxonomyInfo(
+                    fa.TaxonomyFactory.newTaxonomy(parser))
+            parser.augmentSingletons()
+            self.assertEqual(parser.singletons, {'3', '4'})
+            parser.getFamHistory()
+            self.assertEqual([g.get('og') for g in
+                              parser.getToplevelGroups()],
+                             ['0', '1', '2', '3', '4'])
+
+    def test_histories_agree_with_level_analysis(self):
+        histories = self.parser.getSingletonHistories()
+        self.assertEqual(set(histories), self.parser.getSpeciesSet())
+        for spec, hist in histories.items():
+            full = self.parser.getFamHistory()
+            full.analyzeLevel(spec)
+            self.assertEqual([fam.getFamId() for fam in hist],
+                             [fam.getFamId() for fam in full
+                              if fam.is_singleton()], spec)
+
+
+class AnnotationStateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'augmented.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unannotated_document(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        self.assertIsNone(parser.annotation.loft)
+        self.assertFalse(parser.isLoftAnnotated())
+        parser.getFamHistory()
+        self.assertTrue(parser.annotation.loft)
+
+    def test_state_survives_reload(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        tax = fa.TaxonomyFactory.newTaxonomy(parser)
+        parser.augmentTaxonomyInfo(tax)
+        parser.augmentSingletons()
+        parser.getFamHistory()
+        parser.write(self.fname)
+
+        reloaded = fa.OrthoXMLParser(self.fname)
+        state = reloaded.annotation
+        self.assertTrue(state.loft)
+        self.assertEqual(state.taxonomy,
+                         fa.AnnotationState.taxonomy_digest(tax))
+        self.assertEqual(state.singletons, (4, 6))
+        self.assertEqual(reloaded.singletons, parser.singletons)
+        self.assertEqual(
+            {spec: [fam.getFamId() for fam in hist] for spec, hist in
+             reloaded.getSingletonHistories().items()},
+            {spec: [fam.getFamId() for fam in hist] for spec, hist in
+             parser.getSingletonHistories().items()})
+
+    def test_same_taxonomy_not_added_again(self):
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        tax = fa.TaxonomyFactory.newTaxonomy(parser)
+        parser.augmentTaxonomyInfo(tax)
+        parser.write(self.fname)
+        reloaded = fa.OrthoXMLParser(self.fname)
+        calls = []
+        annotate = fa.GroupAnnotator.annotateMissingTaxRanges
+        fa.GroupAnnotator.annotateMissingTaxRanges = \
+            lambda *args, **kwargs: calls.append(args)
+        try:
+            reloaded.augmentTaxonomyInfo(tax)
+        finally:
+            fa.GroupAnnotator.annotateMissingTaxRanges = annotate
+        self.assertEqual(calls, [])
+
+
+
+
+class ReleasedDocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.parser, self.tax = self.annotated()
+        self.released, self.released_tax = self.annotated()
+        self.released.releaseDocument(keep_xml=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def annotated():
+        parser = SetupHelper.createOrthoXMLParserFromSimpleEx()
+        tax = fa.TaxonomyFactory.newTaxonomy(parser)
+        parser.augmentTaxonomyInfo(tax)
+        parser.augmentSingletons()
+        return parser, tax
+
+    def test_document_released(self):
+        self.assertTrue(self.released.isReleased())
+        self.assertIsNone(self.released.root)
+        self.assertEqual(self.released.mapGeneToSpecies('1'), 'HUMAN')
+
+    def test_histories_and_comparisons(self):
+        for level in self.tax.hierarchy:
+            for species in (None, ['HUMAN', 'RATNO']):
+                hists = []
+                for parser in (self.parser, self.released):
+                    hist = parser.getFamHistory(species)
+                    hist.analyzeLevel(level)
+                    hists.append(hist)
+                self.assertEqual(str(hists[0]), str(hists[1]))
+        comps = []
+        for parser in (self.parser, self.released):
+            h1, h2 = parser.getFamHistory(), parser.getFamHistory()
+            h1.analyzeLevel('Mammalia')
+            h2.analyzeLevel('Primates')
+            comps.append(str(h1.compare(h2)))
+        self.assertEqual(comps[0], comps[1])
+
+    def test_singletons_and_lineages(self):
+        self.assertEqual(
+            dict((spec, str(h)) for spec, h in
+                 self.released.getSingletonHistories().items()),
+            dict((spec, str(h)) for spec, h in
+                 self.parser.getSingletonHistories().items()))
+        for gene in self.parser.getGeneIds():
+            self.assertEqual(self.released.getGeneLineage(gene),
+                             self.parser.getGeneLineage(gene))
+
+    def test_gene_trees(self):
+        trees = []
+        for parser, tax in ((self.parser, self.tax),
+                            (self.released, self.released_tax)):
+            tax.get_histories(parser)
+            tax.get_comparisons(parser)
+            tracer = fa.GeneTreeTracer(parser, tax)
+            tracer.trace_gene_families(add_genelists=True)
+            trees.append([str(t) for t in tracer.trees])
+        self.assertEqual(trees[0], trees[1])
+
+    def test_write_only_if_kept(self):
+        fnames = [os.path.join(self.tmpdir, name) for name in ('a', 'b')]
+        # releasing the document assigns the LOFT ids
+        self.parser.getFamHistory()
+        self.parser.write(fnames[0])
+        self.released.write(fnames[1])
+        with open(fnames[0], 'rb') as a, open(fnames[1], 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+        parser, _ = self.annotated()
+        parser.releaseDocument()
+        self.assertRaises(fa.DocumentReleasedError, parser.write, fnames[0])
+        self.assertRaises(fa.DocumentReleasedError, parser.augmentSingletons)
+
+
+class DeepFamilyTest(unittest.TestCase):
+    """a family whose paralogGroups are nested deeper than the
+    recursion limit of the interpreter."""
+
+    depth = 1500
+
+    def setUp(self):
+        genes = ''.join('<gene id="{}"/>'.format(i)
+                        for i in range(1, self.depth + 2))
+        groups = ''.join('<paralogGroup><geneRef id="{}"/>'.format(i)
+                         for i in range(1, self.depth + 1))
+        xml = ('<orthoXML xmlns="http://orthoXML.org/2011/" version="0.3" '
+               'origin="deep" originVersion="1">'
+               '<species name="A" NCBITaxId="1"><database name="A" '
+               'version="1"><genes>{}</genes></database></species>'
+               '<species name="B" NCBITaxId="2"><database name="B" '
+               'version="1"><genes><gene id="0"/></genes></database>'
+               '</species><groups><orthologGroup id="1">'
+               '<property name="TaxRange" value="AB"/><geneRef id="0"/>'
+               '{}<geneRef id="{}"/>{}</orthologGroup></groups></orthoXML>'
+               ).format(genes, groups, self.depth + 1,
+                        '</paralogGroup>' * self.depth)
+        self.parser = fa.OrthoXMLParser(io.BytesIO(xml.encode('utf-8')))
+
+    def test_taxonomy_and_annotation(self):
+        tax = fa.TaxonomyFactory.newTaxonomy(self.parser)
+        self.assertEqual(set(tax.hierarchy), {'AB', 'A', 'B'})
+        self.parser.augmentTaxonomyInfo(tax)
+        self.parser.getFamHistory()
+        groups = self.parser.root.iter(
+            '{{{ns0}}}orthologGroup'.format(**self.parser.ns))
+        ogs = [grp.get('og') for grp in groups]
+        # every geneRef below the toplevel group got its own group
+        self.assertEqual(len(ogs), self.depth + 3)
+        self.assertNotIn(None, ogs)
+        # only the group added around geneRef 0 shares the toplevel id
+        self.assertEqual(len(set(ogs)), len(ogs) - 1)
+
 
 class TaxonomyFactoryTest(unittest.TestCase):
 
@@ -0,0 +1,57 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import unittest
+import familyanalyzer as fa
+import familyanalyzer.geneindex as geneindex
+
+
+class GeneIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.index = self.op.getGeneIndex()
+
+    def test_lineage_from_root_to_leaf(self):
+        self.assertEqual(self.op.getGeneLineage('3'),
+                         [('Vertebrata', '3'), ('Mammalia', '3'),
+                          ('Euarchontoglires', '3.1a'), ('Primates', '3.1a'),
+                          ('HUMAN', '3.1a')])
+
+    def test_agrees_with_level_analysis(self):
+        for level in self.tax.hierarchy:
+            hist = self.op.getFamHistory()
+            hist.analyzeLevel(level)
+            for fam in hist:
+                genes = list(fam.getMemberGenes())
+                self.assertEqual(self.index.families_at(level, genes),
+                                 [fam.getFamId()] * len(genes))
+                for gene in genes:
+                    self.assertEqual(self.index.family_at(gene, level),
+                                     fam.getFamId())
+
+    def test_batch_lookup_without_numpy(self):
+        expected = self.index.families_at('Mammalia', ['3', '1', 'unknown'])
+        self.assertEqual(expected, ['3', '1', None])
+        numpy, geneindex.numpy = geneindex.numpy, None
+        try:
+            self.index._columns.clear()
+            self.assertEqual(self.index.families_at('Mammalia',
+                                                    ['3', '1', 'unknown']),
+                             expected)
+        finally:
+            geneindex.numpy = numpy
+
+    def test_rebuilt_after_singletons(self):
+        self.op.augmentSingletons()
+        index = self.op.getGeneIndex()
+        self.assertIsNot(index, self.index)
+        self.assertEqual(len(index.genes), len(self.index.genes))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import itertools
+import unittest
+import familyanalyzer.taxonomy as tax
+from familyanalyzer.lca import numpy
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class MRCAIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tax = tax.NewickTaxonomy(io.StringIO(
+            "(((A,B)AB,C)ABC,(D,(E,F,G)EFG)DEFG,H)Root;"))
+        self.leaves = list('ABCDEFGH')
+
+    def all_sets(self):
+        return [s for k in range(1, 4)
+                for s in itertools.combinations(self.leaves, k)]
+
+    def test_same_as_mrca(self):
+        sets = self.all_sets()
+        self.assertListEqual(self.tax.mrca_batch(sets),
+                             [self.tax.mrca(s) for s in sets])
+
+    def test_csr_with_empty_sets(self):
+        index = self.tax.mrca_index()
+        indices = index.ranks(['A', 'B', 'E', 'G', 'C'])
+        res = index.mrca_csr([0, 2, 2, 4, 5], indices).tolist()
+        self.assertListEqual([index.names[r] if r >= 0 else None
+                              for r in res], ['AB', None, 'EFG', 'C'])
+
+    def test_bitmask(self):
+        index = self.tax.mrca_index()
+        masks = numpy.array([[1, 0, 0, 1],
+                             [0, 1, 1, 0],
+                             [0, 0, 0, 0],
+                             [0, 0, 1, 0]], dtype=bool)
+        res = index.mrca_bitmask(masks, ['A', 'C', 'D', 'H']).tolist()
+        self.assertListEqual([index.names[r] if r >= 0 else None
+                              for r in res], ['Root', 'Root', None, 'D'])
+
+    def test_index_follows_new_nodes(self):
+        first = self.tax.mrca_index()
+        self.assertIs(self.tax.mrca_index(), first)
+        node = tax.TaxNode('I')
+        self.tax.hierarchy['H'].add_child(node)
+        self.tax.hierarchy['I'] = node
+        self.assertEqual(self.tax.mrca_batch([('I', 'G')]), ['Root'])
+
+
+if __name__ == '__main__':
+    unittest.main()
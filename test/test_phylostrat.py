@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.phylostrat import Phylostratigrapher, read_genelist
+
+
+class PhylostratigrapherTest(unittest.TestCase):
+    def setUp(self):
+        self.strat = Phylostratigrapher(
+            fa.OrthoXMLParser("test/simpleEx.orthoxml"))
+
+    def test_origins(self):
+        cases = {'HUMAN1': ('HUMAN', 'Vertebrata'),
+                 'PANTR2': ('PANTR', 'Mammalia'),
+                 'RATNO3': ('RATNO', 'RATNO'),
+                 'HUMAN42': None}
+        for xref, expected in cases.items():
+            self.assertEqual(self.strat.origin(xref), expected, xref)
+
+    def test_csv_output(self):
+        out = io.StringIO()
+        self.strat.write(out, read_genelist(io.StringIO('CANFA3\nFOO\n')))
+        self.assertEqual(out.getvalue().splitlines()[1:],
+                         ['"CANFA3","CANFA","Vertebrata"',
+                          '"FOO","ERROR: gene not found",'
+                          '"ERROR: gene not found"'])
+
+    def test_all_genes(self):
+        self.assertEqual(len(list(self.strat.all_xrefs())), 19)
@@ -0,0 +1,89 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.compact import CompactHOGs
+from familyanalyzer.profiles import (PhyloProfiles, MinHashIndex,
+                                     ProfileError, numpy, _POPCOUNT)
+
+
+@unittest.skipIf(numpy is None, 'numpy not installed')
+class PhyloProfilesTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.op.augmentSingletons()
+        hist = self.op.getFamHistory()
+        hist.analyzeLevel('Vertebrata')
+        self.profiles = PhyloProfiles.from_history(hist)
+        self.species = dict((fam.getFamId(),
+                             {self.op.mapGeneToSpecies(g)
+                              for g in fam.getMemberGenes()})
+                            for fam in hist.geneFamList)
+
+    def test_profiles(self):
+        for fam, species in self.species.items():
+            self.assertEqual(set(self.profiles.profile(fam)), species)
+
+    def test_same_profiles_from_compact_hogs(self):
+        hogs = CompactHOGs.from_parser(self.op)
+        other = PhyloProfiles.from_hogs(hogs, 'Vertebrata')
+        self.assertListEqual(other.families, self.profiles.families)
+        self.assertListEqual(other.species, self.profiles.species)
+        self.assertTrue((other.bits == self.profiles.bits).all())
+
+    def test_similarities(self):
+        for f1, s1 in self.species.items():
+            for f2, s2 in self.species.items():
+                self.assertAlmostEqual(self.profiles.jaccard(f1, f2),
+                                       len(s1 & s2) / len(s1 | s2))
+                self.assertEqual(self.profiles.hamming(f1, f2),
+                                 len(s1 ^ s2))
+        self.assertRaises(ProfileError, self.profiles.scores, '1',
+                          metric='cosine')
+
+    def test_popcount_table(self):
+        values = numpy.arange(256, dtype=numpy.uint8)
+        self.assertListEqual(_POPCOUNT[values].tolist(),
+                             [bin(v).count('1') for v in range(256)])
+
+    def test_nearest(self):
+        fam = self.profiles.families[0]
+        expected = sorted(((f, self.profiles.jaccard(fam, f))
+                           for f in self.species if f != fam),
+                          key=lambda x: (-x[1], self.profiles.index(x[0])))
+        self.assertListEqual(self.profiles.nearest(fam, 2), expected[:2])
+        index = MinHashIndex(self.profiles, num_perm=16, bands=8)
+        identical = [f for f, s in expected if s == 1.]
+        self.assertListEqual(index.nearest(fam, len(identical)),
+                             [(f, 1.) for f in identical])
+        self.assertIn(self.profiles.index(fam),
+                      index.candidates(self.profiles.bits[0]))
+
+    def test_candidates_of_profile_rows(self):
+        index = MinHashIndex(self.profiles, num_perm=16, bands=8)
+        for row, fam in enumerate(self.profiles.families):
+            self.assertListEqual(
+                index.candidates(self.profiles.bits[row]).tolist(),
+                index.candidates(fam).tolist())
+        # a profile absent from the index: the families sharing a band
+        query = numpy.zeros_like(self.profiles.bits[0])
+        query[0] = 128
+        sig = index.signature(query)
+        expected = set()
+        for band in range(index.bands):
+            keys = index._band_keys(index.signatures, band)
+            expected.update(numpy.flatnonzero(
+                keys == index._band_keys(sig, band)[0]).tolist())
+        self.assertListEqual(index.candidates(query).tolist(),
+                             sorted(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import json
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.profiling import Profiler, PROFILER
+
+
+class ProfilerTest(unittest.TestCase):
+    def tearDown(self):
+        PROFILER.disable()
+        PROFILER.reset()
+
+    def test_disabled_records_nothing(self):
+        prof = Profiler()
+        with prof.phase('noop') as ph:
+            ph.count(3)
+        self.assertEqual(len(prof.records), 0)
+
+    def test_nested_phases_accumulate(self):
+        prof = Profiler()
+        prof.enable(trace_memory=True)
+        for _ in range(2):
+            with prof.phase('outer'):
+                with prof.phase('inner') as ph:
+                    buf = [0] * 100000
+                    ph.count(len(buf))
+        prof.disable()
+        outer, inner = prof.records['outer'], prof.records['inner']
+        self.assertEqual((outer.calls, inner.calls), (2, 2))
+        self.assertEqual(inner.items, 200000)
+        self.assertGreaterEqual(outer.peak_traced, inner.peak_traced)
+        self.assertGreaterEqual(outer.wall, inner.wall)
+
+    def test_analysis_phases_are_reported(self):
+        PROFILER.enable()
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        tax = fa.TaxonomyFactory.newTaxonomy(op)
+        op.augmentTaxonomyInfo(tax)
+        tax.get_comparisons(op)
+        fa.GeneTreeTracer(op, tax).trace_gene_families()
+        fd = io.StringIO()
+        PROFILER.write_json(fd)
+        phases = {p['phase']: p for p in json.loads(fd.getvalue())['phases']}
+        for name in ('parse', 'augmentTaxonomyInfo', 'annotateDoc',
+                     'get_histories', 'get_comparisons', 'GeneTreeTracer'):
+            self.assertIn(name, phases)
+        self.assertEqual(phases['get_histories']['items'],
+                         len(tax.hierarchy))
@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from familyanalyzer.seqindex import FastaIndex, FastaIndexError, SIDECAR_EXT
+
+FASTA = """>HUMAN1 some protein
+MKVL
+ATT
+>PANTR1
+MKVLAS
+>MOUSE1 another one
+MK
+VL
+"""
+
+
+class FastaIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.tmpdir, 'seqs.fa')
+        self.write(FASTA)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, content):
+        with io.open(self.fasta, 'w') as fh:
+            fh.write(content)
+
+    def test_sequences(self):
+        with FastaIndex(self.fasta) as idx:
+            self.assertEqual(len(idx), 3)
+            self.assertEqual(idx['HUMAN1'], 'MKVLATT')
+            self.assertEqual(idx['MOUSE1'], 'MKVL')
+            self.assertIsNone(idx.get('RATNO1'))
+
+    def test_sidecar_is_reused(self):
+        FastaIndex(self.fasta).close()
+        self.assertTrue(os.path.exists(self.fasta + SIDECAR_EXT))
+        with FastaIndex(self.fasta) as idx:
+            self.assertTrue(idx.from_sidecar)
+            self.assertEqual(idx['PANTR1'], 'MKVLAS')
+
+    def test_stale_sidecar_is_rebuilt(self):
+        FastaIndex(self.fasta).close()
+        self.write(FASTA + '>RATNO1\nMKV\n')
+        with FastaIndex(self.fasta) as idx:
+            self.assertFalse(idx.from_sidecar)
+            self.assertEqual(idx['RATNO1'], 'MKV')
+
+    def test_duplicate_ids(self):
+        self.write(FASTA + '>HUMAN1\nMKV\n')
+        self.assertRaises(FastaIndexError, FastaIndex, self.fasta)
+
+    def test_extract_many(self):
+        jobs = [(os.path.join(self.tmpdir, 'fam{}.fa'.format(i)), ids)
+                for i, ids in enumerate([['HUMAN1', 'MOUSE1'],
+                                         ['PANTR1', 'RATNO1'],
+                                         ['MOUSE1']])]
+        with FastaIndex(self.fasta) as idx:
+            missing = idx.extract_many(jobs, processes=2)
+        self.assertEqual([missing[fname] for fname, _ in jobs],
+                         [[], ['RATNO1'], []])
+        with io.open(jobs[0][0]) as fh:
+            self.assertEqual(fh.read(), '>HUMAN1\nMKVLATT\n>MOUSE1\nMKVL\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import asyncio
+import json
+import unittest
+import familyanalyzer as fa
+from familyanalyzer import compact
+from familyanalyzer.server import QueryEngine, QueryServer, QueryError
+
+
+def createEngine(cache_size=4):
+    op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+    tax = fa.TaxonomyFactory.newTaxonomy(op)
+    op.augmentTaxonomyInfo(tax)
+    return QueryEngine(op, tax, cache_size=cache_size)
+
+
+class QueryEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = createEngine()
+
+    def test_history_is_cached(self):
+        h1 = self.engine.history('Primates')
+        h2 = self.engine.history('Primates')
+        self.assertIs(h1, h2)
+
+    def test_history_cache_is_bounded(self):
+        engine = createEngine(cache_size=1)
+        h1 = engine.history('Primates')
+        engine.history('Rodents')
+        self.assertIsNot(h1, engine.history('Primates'))
+
+    def test_family_history(self):
+        res = self.engine.dispatch({'query': 'history', 'level': 'Primates',
+                                    'family': '3.1a', 'xreftag': 'protId'})
+        fam, = res['families']
+        self.assertEqual(fam['species']['PANTR'],
+                         {'type': 'SINGLECOPY', 'genes': ['PANTR3']})
+
+    def test_compare(self):
+        res = self.engine.dispatch({'query': 'compare', 'lev1': 'Primates',
+                                    'lev2': 'HUMAN'})
+        self.assertEqual(res['summary']['lost'], 1)
+        self.assertIn({'family': '3.1b', 'event': 'lost'}, res['events'])
+
+    def test_gene_family(self):
+        res = self.engine.dispatch({'query': 'gene', 'id': 'PANTR4',
+                                    'level': 'Euarchontoglires'})
+        self.assertEqual((res['id'], res['family'], res['subfamily']),
+                         ('14', '3', '3.1b'))
+
+    @unittest.skipIf(compact.numpy is None, 'numpy not installed')
+    def test_gene_family_of_released_document(self):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        tax = fa.TaxonomyFactory.newTaxonomy(op)
+        op.augmentTaxonomyInfo(tax)
+        fa.GroupAnnotator(op).annotateDoc()
+        op.releaseDocument()
+        res = QueryEngine(op, tax).dispatch(
+            {'query': 'gene', 'id': 'PANTR4', 'level': 'Euarchontoglires'})
+        self.assertEqual((res['id'], res['family'], res['subfamily']),
+                         ('14', '3', '3.1b'))
+
+    def test_gene_tree(self):
+        res = self.engine.dispatch({'query': 'genetree', 'family': '2'})
+        self.assertEqual(res['level'], 'Mammalia')
+        self.assertIn('PANTR2', res['newick'])
+
+    def test_unknown_level(self):
+        self.assertRaises(QueryError, self.engine.dispatch,
+                          {'query': 'history', 'level': 'Fungi'})
+
+
+class QueryServerTest(unittest.TestCase):
+    def request(self, port, raw):
+        async def _run():
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(raw)
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+            return data
+        return _run()
+
+    def test_roundtrip(self):
+        server = QueryServer(createEngine(), max_concurrent=2)
+
+        async def _scenario():
+            srv = await server.start(port=0)
+            port = srv.sockets[0].getsockname()[1]
+            body = json.dumps([{'query': 'gene', 'id': 'HUMAN1'},
+                               {'query': 'history', 'level': 'Fungi'}])
+            raw = ('POST /batch HTTP/1.1\r\nContent-Length: {}\r\n\r\n{}'
+                   .format(len(body), body).encode('utf-8'))
+            response = await self.request(port, raw)
+            await server.stop()
+            return response
+
+        response = asyncio.run(_scenario())
+        header, _, payload = response.partition(b'\r\n\r\n')
+        self.assertTrue(header.startswith(b'HTTP/1.1 200'))
+        gene, error = json.loads(payload.decode('utf-8'))
+        self.assertEqual(gene['family'], '1')
+        self.assertIn('error', error)
+
+    def test_malformed_request_line(self):
+        server = QueryServer(createEngine())
+
+        async def _scenario():
+            srv = await server.start(port=0)
+            port = srv.sockets[0].getsockname()[1]
+            response = await self.request(port, b'GARBAGE\r\n\r\n')
+            await server.stop()
+            return response
+
+        response = asyncio.run(_scenario())
+        self.assertTrue(response.startswith(b'HTTP/1.1 400'))
+
+    def test_refuses_remote_host(self):
+        server = QueryServer(createEngine())
+        self.assertRaises(QueryError, asyncio.run,
+                          server.start(host='0.0.0.0', port=0))
@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import familyanalyzer as fa
+from familyanalyzer import compact
+from familyanalyzer.sqlexport import (export_sqlite, SQLiteQuery,
+                                      SQLiteExportError)
+
+
+class SQLiteExportTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+        self.comparisons = self.tax.get_comparisons(self.op)
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'hogs.db')
+        export_sqlite(self.op, self.fname, self.comparisons.values())
+        self.query = SQLiteQuery(self.fname)
+
+    def tearDown(self):
+        self.query.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_parser_lookups(self):
+        self.assertEqual(self.query.getSpeciesSet(), self.op.getSpeciesSet())
+        self.assertEqual(self.query.getLevels(), set(self.tax.hierarchy))
+        self.assertEqual(self.query.mapGeneToSpecies('3'), 'HUMAN')
+        self.assertEqual(self.query.mapGeneToXRef('3', 'geneId'), 'HUMANg3')
+        self.assertEqual(self.query.mapXRefToGene('HUMAN3'), '3')
+
+    def test_families_match_history(self):
+        for level in ('Mammalia', 'Primates', 'HUMAN'):
+            hist = self.op.getFamHistory()
+            hist.analyzeLevel(level)
+            expected = dict((fam.getFamId(), sorted(fam.getMemberGenes()))
+                            for fam in hist)
+            found = self.query.getFamilies(level)
+            self.assertEqual(dict((k, sorted(v)) for k, v in found.items()),
+                             expected)
+
+    def test_lineage_and_events(self):
+        self.assertEqual(self.query.getLineage('3'),
+                         self.op.getGeneLineage('3'))
+        comp = self.comparisons[('Mammalia', 'Euarchontoglires')]
+        self.assertEqual(
+            sorted(set((fam, ev) for fam, ev, _ in
+                       self.query.getEvents('Mammalia', 'Euarchontoglires'))),
+            sorted((ev.fam, ev.event) for ev in comp))
+        self.assertEqual(
+            sorted(sub for _, _, sub in self.query.getEvents(
+                'Mammalia', 'Euarchontoglires', 'duplicated')),
+            ['3.1a', '3.1b'])
+
+    def test_family_without_id(self):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        first = op.getToplevelGroups()[0]
+        del first.attrib['id']
+        op.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(op))
+        fname = os.path.join(self.tmpdir, 'noid.db')
+        export_sqlite(op, fname)
+        conn = sqlite3.connect(fname)
+        families = {row[0] for row in
+                    conn.execute('SELECT family FROM groups')}
+        conn.close()
+        self.assertIn('0', families)
+        self.assertEqual(first.get('og'), '0')
+
+    @unittest.skipIf(compact.numpy is None, 'numpy not installed')
+    def test_released_document(self):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        op.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(op))
+        fa.GroupAnnotator(op).annotateDoc()
+        op.releaseDocument()
+        fname = os.path.join(self.tmpdir, 'released.db')
+        export_sqlite(op, fname)
+        released = sqlite3.connect(fname)
+        for table in ('species', 'genes', 'xrefs', 'groups', 'group_levels',
+                      'gene_refs', 'gene_families', 'taxonomy'):
+            sql = 'SELECT * FROM {}'.format(table)
+            self.assertListEqual(released.execute(sql).fetchall(),
+                                 self.query.conn.execute(sql).fetchall())
+        released.close()
+
+    def test_existing_database(self):
+        with self.assertRaises(SQLiteExportError):
+            export_sqlite(self.op, self.fname)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.streaming import (StreamingOrthoXMLReader, StreamingError,
+                                      annotate_stream)
+
+NS = '{http://orthoXML.org/2011/}'
+
+
+def group_signature(root):
+    return [(grp.get('og'),
+             [p.get('value') for p in grp.findall(NS + 'property')],
+             [g.get('id') for g in grp.iter(NS + 'geneRef')])
+            for grp in root.iter(NS + 'orthologGroup')]
+
+
+class StreamingTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def in_memory(self, singletons=False):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        op.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(op))
+        if singletons:
+            op.augmentSingletons()
+        op.getFamHistory()
+        return op
+
+    def test_same_annotation_as_parsed_document(self):
+        out = os.path.join(self.tmpdir, 'augmented.xml')
+        annotator = annotate_stream("test/simpleEx.orthoxml", out)
+        op = self.in_memory()
+        streamed = fa.OrthoXMLParser(out)
+        self.assertEqual(group_signature(streamed.root),
+                         group_signature(op.root))
+        self.assertEqual(streamed.getSpeciesSet(), op.getSpeciesSet())
+        self.assertEqual(annotator.geneIndex.lineage('3'),
+                         op.getGeneLineage('3'))
+
+    def test_gzip_and_singletons(self):
+        src = os.path.join(self.tmpdir, 'input.xml.gz')
+        with open("test/simpleEx.orthoxml", 'rb') as fh:
+            with gzip.open(src, 'wb') as gz:
+                gz.write(fh.read())
+        out = os.path.join(self.tmpdir, 'augmented.xml.gz')
+        annotator = annotate_stream(src, out, add_singletons=True,
+                                    pretty_print=True)
+        op = self.in_memory(singletons=True)
+        self.assertEqual(annotator.singletons, op.singletons)
+        with gzip.open(out, 'rb') as fh:
+            text = fh.read()
+        # singletons are written in the default namespace, like the
+        # parsed families
+        self.assertNotIn(b'ns0:', text)
+        streamed = fa.OrthoXMLParser(io.BytesIO(text))
+        self.assertEqual(group_signature(streamed.root),
+                         group_signature(op.root))
+        self.assertEqual(streamed.singletons, op.singletons)
+        self.assertTrue(streamed.isLoftAnnotated())
+
+    def test_stream_input(self):
+        with open("test/simpleEx.orthoxml", 'rb') as fh:
+            data = fh.read()
+        op = self.in_memory()
+        for src in (data, gzip.compress(data)):
+            out = io.BytesIO()
+            annotate_stream(io.BytesIO(src), out)
+            streamed = fa.OrthoXMLParser(io.BytesIO(out.getvalue()))
+            self.assertEqual(group_signature(streamed.root),
+                             group_signature(op.root))
+
+        class Unseekable(io.BytesIO):
+            def seekable(self):
+                return False
+
+        with self.assertRaises(StreamingError):
+            annotate_stream(Unseekable(data), io.BytesIO())
+        out = io.BytesIO()
+        annotate_stream(Unseekable(data), out, op.tax)
+        self.assertEqual(group_signature(fa.OrthoXMLParser(
+            io.BytesIO(out.getvalue())).root), group_signature(op.root))
+
+    def test_families_without_id(self):
+        op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        for fam in op.getToplevelGroups():
+            del fam.attrib['id']
+        src = os.path.join(self.tmpdir, 'noid.xml')
+        op.write(src)
+        annotator = annotate_stream(src, io.BytesIO(), add_singletons=True)
+        op.augmentTaxonomyInfo(fa.TaxonomyFactory.newTaxonomy(op))
+        op.augmentSingletons()
+        self.assertEqual(annotator.singletons, {'3', '4'})
+        self.assertEqual(annotator.singletons, op.singletons)
+
+    def test_families_read_once(self):
+        with StreamingOrthoXMLReader("test/simpleEx.orthoxml") as reader:
+            self.assertEqual(len(reader.header), 7)
+            self.assertEqual([f.get('id') for f in reader.families()],
+                             ['1', '2', '3'])
+            with self.assertRaises(StreamingError):
+                list(reader.families())
+
+    def test_missing_groups(self):
+        with self.assertRaises(StreamingError):
+            StreamingOrthoXMLReader(io.BytesIO(
+                b'<orthoXML xmlns="http://orthoXML.org/2011/"/>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
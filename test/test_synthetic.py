@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import io
+import unittest
+import familyanalyzer as fa
+from familyanalyzer.synthetic import SyntheticDataset
+from familyanalyzer.benchmark import PHASES, run_benchmarks
+
+
+def asXML(dataset):
+    buf = io.BytesIO()
+    dataset.write_orthoxml(buf)
+    return buf.getvalue()
+
+
+class SyntheticDatasetTest(unittest.TestCase):
+    def test_reproducible_from_seed(self):
+        d1 = SyntheticDataset(12, 30, dup_rate=.2, shape='random', seed=7)
+        d2 = SyntheticDataset(12, 30, dup_rate=.2, shape='random', seed=7)
+        self.assertEqual(asXML(d1), asXML(d2))
+        self.assertEqual(d1.newick(), d2.newick())
+
+    def test_different_seeds_differ(self):
+        d1 = SyntheticDataset(12, 30, seed=1)
+        d2 = SyntheticDataset(12, 30, seed=2)
+        self.assertNotEqual(asXML(d1), asXML(d2))
+
+    def test_shapes(self):
+        for shape, depth in (('balanced', 4), ('caterpillar', 8)):
+            d = SyntheticDataset(8, 1, shape=shape, seed=1)
+            leaf = next(d.species_tree.iter_leaves())
+            nr_parents = 0
+            while leaf.up is not None:
+                nr_parents += 1
+                leaf = leaf.up
+            self.assertLessEqual(nr_parents, depth)
+            self.assertEqual(len(d.species_names()), 8)
+
+    def test_dataset_is_analyzable(self):
+        d = SyntheticDataset(8, 20, dup_rate=.3, loss_rate=.2, seed=3)
+        op = fa.OrthoXMLParser(io.BytesIO(asXML(d)))
+        tax = fa.NewickTaxonomy(io.StringIO(d.newick()))
+        op.augmentTaxonomyInfo(tax)
+        hist = op.getFamHistory()
+        hist.analyzeLevel(tax.root)
+        self.assertEqual(len(op.getToplevelGroups()), 20)
+        self.assertEqual(op.getSpeciesSet(), set(d.species_names()))
+        self.assertGreater(len(hist), 0)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def test_report_contains_all_phases(self):
+        report = run_benchmarks([(4, 5)], seed=1)
+        res, = report['results']
+        self.assertEqual(set(res['timings']), set(PHASES))
+        self.assertEqual(res['counts']['nr_families'], 5)
@@ -29,3 +29,59 @@ class NewickTaxonomyTest(unittest.TestCase):
         self.assertIsNone(root.up, 'not root element')
         self.assertListEqual(list(taxonomy.iterParents(root_name)),[],'not root element')
         return root
+
+
+class TaxonomyMemoTest(unittest.TestCase):
+    def setUp(self):
+        fp = io.StringIO("(((A,B)AB,C)ABC,(D,E)DE)root;")
+        self.taxonomy = tax.NewickTaxonomy(fp)
+
+    def test_mrca_statistics(self):
+        self.assertEqual(self.taxonomy.mrca({'A', 'B'}), 'AB')
+        self.assertEqual(self.taxonomy.mrca({'B', 'A'}), 'AB')
+        stats = self.taxonomy.memo_statistics()['mrca']
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 1, 1))
+
+    def test_bounded_capacity(self):
+        self.taxonomy.set_memo_capacity(2)
+        for species in ({'A', 'B'}, {'A', 'C'}, {'D', 'E'}, {'A', 'D'}):
+            self.taxonomy.mrca(species)
+        stats = self.taxonomy.memo_statistics()['mrca']
+        self.assertEqual((stats['size'], stats['evictions']), (2, 2))
+        self.assertEqual(self.taxonomy.mrca({'A', 'B'}), 'AB')
+
+    def test_pruned_copy_keeps_memo(self):
+        self.taxonomy.mrca({'A', 'C'})
+        pruned = self.taxonomy.prune(['E'])
+        self.assertEqual(pruned.mrca({'A', 'C'}), 'ABC')
+
+
+class TaxonomyViewTest(unittest.TestCase):
+    def setUp(self):
+        fp = io.StringIO("(((A,B)AB,C)ABC,(D,E)DE)root;")
+        self.taxonomy = tax.NewickTaxonomy(fp)
+
+    def test_retain_masks_nodes(self):
+        view = self.taxonomy.retain(['A', 'C', 'D'])
+        self.assertEqual([n.name for n in view],
+                         ['root', 'ABC', 'AB', 'A', 'C', 'DE', 'D'])
+        self.assertEqual(view.newick(), '(((A)AB, C)ABC, (D)DE)root;')
+        self.assertEqual(view.descendents['ABC'], {'A', 'C'})
+        self.assertEqual(view.mrca({'A', 'D'}), 'root')
+        # the underlying taxonomy is unchanged
+        self.assertEqual([n.name for n in self.taxonomy['AB'].down],
+                         ['A', 'B'])
+        self.assertEqual(len(self.taxonomy.hierarchy), 9)
+
+    def test_view_shares_histories(self):
+        view = self.taxonomy.retain(['A', 'B'])
+        view['AB'].attach_fam_history('history')
+        self.assertEqual(self.taxonomy['AB'].history, 'history')
+        self.assertIs(view['AB'].node, self.taxonomy['AB'])
+
+    def test_view_of_view(self):
+        view = self.taxonomy.prune(['E']).retain(['A', 'B', 'D'])
+        self.assertIs(view.base, self.taxonomy)
+        self.assertEqual(sorted(view.hierarchy),
+                         ['A', 'AB', 'ABC', 'B', 'D', 'DE', 'root'])
@@ -0,0 +1,72 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import unittest
+import familyanalyzer as fa
+from familyanalyzer import topk
+
+
+class TopKTest(unittest.TestCase):
+    def setUp(self):
+        self.op = fa.OrthoXMLParser("test/simpleEx.orthoxml")
+        self.tax = fa.TaxonomyFactory.newTaxonomy(self.op)
+        self.op.augmentTaxonomyInfo(self.tax)
+
+    def history(self, level):
+        hist = self.op.getFamHistory()
+        hist.analyzeLevel(level)
+        return hist
+
+    def test_level_metrics(self):
+        for level in ('Vertebrata', 'Mammalia', 'Euarchontoglires'):
+            hist = self.history(level)
+            for metric, score in topk.LEVEL_METRICS.items():
+                expected = sorted(((fam.getFamId(), score(fam.summary))
+                                   for fam in hist), key=lambda x: -x[1])
+                got = topk.top_families(self.op, level, 2, metric)
+                self.assertListEqual([s for _, s in got],
+                                     [s for _, s in expected[:2]])
+                self.assertLessEqual(set(got), set(expected))
+
+    def test_species_filter(self):
+        got = dict(topk.top_families(self.op, 'Vertebrata', 10,
+                                     species=['HUMAN', 'PANTR']))
+        hist = self.op.getFamHistory(['HUMAN', 'PANTR'])
+        hist.analyzeLevel('Vertebrata')
+        self.assertEqual(got, dict((fam.getFamId(),
+                                    topk.LEVEL_METRICS['size'](fam.summary))
+                                   for fam in hist))
+
+    def test_edge_duplications(self):
+        for lev1, lev2 in (('Vertebrata', 'Euarchontoglires'),
+                           ('Mammalia', 'Primates'),
+                           ('Vertebrata', 'HUMAN')):
+            comp = self.history(lev1).compare(self.history(lev2))
+            got = topk.top_edge_families(self.op, lev1, lev2, 10)
+            self.assertEqual(sum(n for _, n in got),
+                             comp.summarise()['duplicated'])
+            self.assertEqual(dict((f, n) for f, n in got if n),
+                             dict((f, len(comp[f].subfamilies))
+                                  for f in comp.fams_dict
+                                  if comp[f].event == 'duplicated'))
+
+    def test_edge_losses(self):
+        got = topk.top_edge_families(self.op, 'Vertebrata', 'Rodents', 10,
+                                     'losses')
+        rodents = self.tax.descendents['Rodents']
+        for fam in self.history('Vertebrata'):
+            present = {self.op.mapGeneToSpecies(g)
+                       for g in fam.getMemberGenes()}
+            self.assertIn((fam.getFamId(), len(rodents - present)), got)
+
+    def test_unknown_metric(self):
+        self.assertRaises(topk.TopKError, topk.top_families, self.op,
+                          'Vertebrata', 3, 'length')
+
+
+if __name__ == '__main__':
+    unittest.main()
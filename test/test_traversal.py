@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import unittest
+import lxml.etree as etree
+from familyanalyzer.traversal import walk
+
+
+class WalkTest(unittest.TestCase):
+    def setUp(self):
+        self.root = etree.fromstring('<a><b><d/></b><c/></a>')
+
+    def test_pre_and_post_order(self):
+        pre, post = [], []
+
+        def enter(node, ctx):
+            pre.append(node.tag)
+            return ((child, None) for child in node)
+
+        def leave(node, ctx, results):
+            post.append(node.tag)
+
+        walk(self.root, enter, leave)
+        self.assertEqual(pre, ['a', 'b', 'd', 'c'])
+        self.assertEqual(post, ['d', 'b', 'c', 'a'])
+
+    def test_context_and_results(self):
+        def enter(node, depth):
+            return ((child, depth + 1) for child in node)
+
+        def leave(node, depth, results):
+            return max([depth] + results)
+
+        self.assertEqual(walk(self.root, enter, leave, 0), 2)
+
+    def test_children_not_visited(self):
+        seen = []
+
+        def enter(node, ctx):
+            seen.append(node.tag)
+            if node.tag == 'a':
+                return [(node[1], None)]
+
+        walk(self.root, enter)
+        self.assertEqual(seen, ['a', 'c'])
+
+    def test_deeper_than_recursion_limit(self):
+        root = node = etree.Element('n')
+        for _ in range(5000):
+            node = etree.SubElement(node, 'n')
+
+        def leave(node, ctx, results):
+            return 1 + sum(results)
+
+        self.assertEqual(walk(root, lambda n, c: ((x, c) for x in n),
+                              leave), 5001)
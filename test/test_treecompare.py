@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+from __future__ import print_function
+from __future__ import division
+from __future__ import absolute_import
+from future import standard_library
+standard_library.install_hooks()
+
+import unittest
+from familyanalyzer.genetree import GeneTree, GeneTreeNode
+from familyanalyzer.treecompare import (LeafIndex, TreeSplits, congruence,
+                                        robinson_foulds, compare_many)
+
+
+class TreeSplitsTest(unittest.TestCase):
+    def test_rooting_is_ignored(self):
+        index = LeafIndex()
+        t1 = TreeSplits.from_newick('((A,B),(C,D));', index)
+        t2 = TreeSplits.from_newick('(A,(B,(C,D)));', index)
+        self.assertEqual(t1.splits, t2.splits)
+        self.assertEqual(robinson_foulds(t1, t2), 0)
+        self.assertEqual((t1.nr_internal, t2.nr_internal), (2, 2))
+
+    def test_robinson_foulds(self):
+        index = LeafIndex()
+        t1 = TreeSplits.from_newick('((A,B),(C,D),E);', index)
+        t2 = TreeSplits.from_newick('((A,C),(B,D),E);', index)
+        self.assertEqual(robinson_foulds(t1, t2), 4)
+
+    def test_different_leaf_sets(self):
+        index = LeafIndex()
+        t1 = TreeSplits.from_newick('(((A,B),C),(D,E));', index)
+        t2 = TreeSplits.from_newick('((A,B),(D,F),E);', index)
+        self.assertEqual(robinson_foulds(t1, t2), 0)
+
+    def test_collapse_by_support(self):
+        tree = TreeSplits.from_newick('((A,B)90:0.1,(C,D)30:0.2,E);')
+        collapsed = tree.collapse(50)
+        self.assertEqual(collapsed.newick(), '((A, B), C, D, E)')
+        self.assertEqual((tree.nr_internal, collapsed.nr_internal), (3, 2))
+
+    def test_congruence(self):
+        index = LeafIndex()
+        hog = TreeSplits.from_newick('((A,C),(B,D),E);', index)
+        gene = TreeSplits.from_newick('((A,B)90,(C,D)30,E);', index)
+        res = congruence(hog, gene, 50)
+        self.assertEqual(res['symmetric_difference'], 3)
+        self.assertEqual(res['nodes_collapsed'], 2)
+        self.assertAlmostEqual(res['congruence'], 1 - 3 / 5)
+
+    def test_genetree_without_losses(self):
+        root = GeneTreeNode('Vertebrata', 'speciation')
+        dup = GeneTreeNode('DUP_1', 'duplication')
+        root.add_child(GeneTreeNode('XENTR1', 'leaf'))
+        root.add_child(dup)
+        mammals = GeneTreeNode('Mammalia', 'speciation')
+        mammals.add_child(GeneTreeNode('HUMAN1', 'leaf'))
+        mammals.add_child(GeneTreeNode('LOSS_1_MOUSE', 'loss'))
+        dup.add_child(mammals)
+        dup.add_child(GeneTreeNode('HUMAN2', 'leaf'))
+        dup.add_child(GeneTreeNode('MOUSE2', 'leaf'))
+        tree = GeneTree(root)
+        index = LeafIndex()
+        encoded = TreeSplits.from_genetree(tree, index)
+        parsed = TreeSplits.from_newick(tree.write_topology(), index)
+        self.assertEqual(encoded.nodes, parsed.nodes)
+        self.assertEqual(index.labels_of(encoded.leaves),
+                         ['XENTR1', 'HUMAN1', 'HUMAN2', 'MOUSE2'])
+        self.assertEqual(encoded.nr_internal, 1)
+
+    def test_compare_many(self):
+        newick = '((A,B)80,(C,D)20,(E,F)70);'
+        pairs = [('((A,B),(C,D),(E,F));', newick)] * 3
+        res = compare_many(pairs, threshold=50)
+        self.assertEqual(len(res), 3)
+        self.assertEqual(res[0]['symmetric_difference'], 1)
+        self.assertEqual(res[0]['nodes_gene'] - res[0]['nodes_collapsed'], 1)
+
+    def test_several_trees_in_one_stream(self):
+        trees = list(TreeSplits.iter_newick('(A,(B,C));\n((A,B),C);'))
+        self.assertEqual([t.newick() for t in trees],
+                         ['(A, (B, C))', '((A, B), C)'])
+
+if __name__ == '__main__':
+    unittest.main()